@@ -0,0 +1,217 @@
+"""
+Activity scheduling of the enemies.
+
+A friendly or aggressive enemy which is not chasing the hero (its last_seen is
+None) and cannot see the hero does nothing on its turn but look for the hero
+and regenerate mana. Such an enemy is put to sleep: it is left out of the enemy
+phases until the hero enters a position it might see, which only changes when
+the hero moves since a sleeping enemy does not move.
+
+Sleeping enemies are indexed by the row and by the column they stand on, or,
+when the enemies see within a radius, by a spatial.SpatialHash, so that waking
+the ones which might see the hero costs as much as the number of enemies woken.
+The turns of an enemy phase are then played by the active enemies only, and
+its cost depends on the number of active enemies, not on the total number of
+enemies.
+
+The mana regeneration of a sleeping enemy is applied lazily: the scheduler
+counts the enemy phases (its clock) and remembers the clock an enemy fell
+asleep at, and the regeneration of the phases missed is given at once when the
+enemy wakes up (see ActivityScheduler.settle for when the whole table must be
+up to date). Since the mana is capped at its maximum and regeneration is never
+negative, one capped addition gives the same mana as one per phase.
+"""
+
+import enemies
+import spatial
+
+
+class ActivityScheduler:
+    """
+    Attributes:
+    - table: the enemies.EnemyTable scheduled
+    - clock: the number of enemy phases which regenerated mana
+    - active: the set of the indexes of the enemies which are not sleeping
+    - asleep: maps the index of each sleeping enemy to the clock it fell asleep
+      at
+    - killed: the indexes of the enemies killed since the last call of
+      ActivityScheduler.take_killed
+    """
+
+    def __init__(self, table, fov_radius=None):
+        """Every living enemy of (table) starts active; those who can sleep fall
+        asleep at the first enemy phase."""
+        self.table = table
+        self.fov_radius = fov_radius
+        self.clock = 0
+        self.active = set(table.live)
+        self.asleep = {}
+        self.killed = []
+        self._by_row = {}
+        self._by_col = {}
+        self._near = spatial.SpatialHash() if fov_radius is not None else None
+
+
+    def awake(self, pos):
+        """Returns, in table order, the indexes of the enemies which may do
+        something more than regenerate mana this turn if the hero is at (pos):
+        the rabid ones, those chasing the hero (last_seen is not None) and those
+        which might see (pos), on its row or column, or within the field of
+        view radius. The sleeping enemies which might see (pos) are woken up,
+        the active ones which can sleep fall asleep."""
+
+        self._wake_around(pos)
+        table = self.table
+        health, behaviors = table.health, table.behaviors
+        last_seen_rows, rows, cols = table.last_seen_rows, table.rows, table.cols
+        row, col = pos
+        radius_sq = None if self.fov_radius is None else self.fov_radius ** 2
+        awake = []
+        for index in self.active:
+            if health[index] <= 0:
+                continue
+            if (behaviors[index] == enemies.RABID
+                    or last_seen_rows[index] != enemies.NOWHERE):
+                awake.append(index)
+            elif radius_sq is None:
+                if rows[index] == row or cols[index] == col:
+                    awake.append(index)
+                else:
+                    self._sleep(index)
+            elif (rows[index] - row) ** 2 + (cols[index] - col) ** 2 <= radius_sq:
+                awake.append(index)
+            else:
+                self._sleep(index)
+        awake.sort()
+        # the dead and the sleeping are dropped, the enemies killed during the
+        # phase are still regenerated at its end, as in the table's live
+        self.active = set(awake)
+        return awake
+
+
+    def regen_mana(self):
+        """Gives every active enemy its mana regeneration, capped at its maximum
+        mana, with the batched enemies.EnemyTable.regen_mana, and advances the
+        clock."""
+        self.table.regen_mana(self.active)
+        self.clock += 1
+
+
+    def enemy_killed(self, index):
+        """Call when the enemy (index) dies. A sleeping enemy gets the mana it
+        missed so far and becomes active, so that a death during an enemy phase
+        is regenerated at its end like the other enemies alive at its start."""
+        if index in self.asleep:
+            self._wake(index)
+        self.killed.append(index)
+
+
+    def take_killed(self):
+        """Returns the indexes of the enemies killed since the last call."""
+        killed, self.killed = self.killed, []
+        return killed
+
+
+    def settle(self):
+        """Gives every sleeping enemy the mana it missed so far, without waking
+        it up. Call before reading the mana of the whole table, as in a
+        snapshot. The enemies are not marked as touched: their mana, once
+        regenerated up to any later clock, is unchanged."""
+        table, clock = self.table, self.clock
+        mana, max_mana, regen = table.mana, table.max_mana, table.mana_regen
+        asleep = self.asleep
+        for i, since in asleep.items():
+            if since != clock:
+                mana[i] = min(max_mana[i], mana[i] + regen[i] * (clock - since))
+                asleep[i] = clock
+
+
+    def restore(self, clock, asleep):
+        """Sets the clock to (clock) and puts to sleep the enemies of (asleep),
+        which maps their indexes to the clock they fell asleep at, as in an
+        earlier state of a scheduler of the same table (see undo.History).
+        Their mana must be as it was then, not yet regenerated."""
+        self.clock = clock
+        for index, since in asleep.items():
+            self.active.discard(index)
+            self._sleep(index)
+            self.asleep[index] = since
+
+    ########################################
+    # sleeping and waking
+
+    # the enemies put to sleep and woken up are marked as touched in the table:
+    # the clock a sleeping enemy fell asleep at is part of its state, its mana
+    # being regenerated from it (see undo.History)
+
+    def _sleep(self, index):
+        table = self.table
+        self.asleep[index] = self.clock
+        if table.touched is not None:
+            table.touched.add(index)
+        if self._near is None:
+            self._by_row.setdefault(table.rows[index], set()).add(index)
+            self._by_col.setdefault(table.cols[index], set()).add(index)
+        else:
+            self._near.add(_Sleeper(index, table), _Sleeper.pos_of(index, table))
+
+
+    def _wake(self, index):
+        table = self.table
+        since = self.asleep.pop(index)
+        row, col = table.rows[index], table.cols[index]
+        if self._near is None:
+            _discard(self._by_row, row, index)
+            _discard(self._by_col, col, index)
+        else:
+            self._near.remove(_Sleeper(index, table), (row, col))
+        if since != self.clock:
+            table.mana[index] = min(
+                table.max_mana[index],
+                table.mana[index] + table.mana_regen[index] * (self.clock - since))
+        self.active.add(index)
+        if table.touched is not None:
+            table.touched.add(index)
+
+
+    def _wake_around(self, pos):
+        if self._near is None:
+            row, col = pos
+            woken = self._by_row.get(row, ()), self._by_col.get(col, ())
+            woken = set().union(*woken)
+        else:
+            woken = {sleeper.index
+                     for sleeper in self._near.in_radius(pos, self.fov_radius)}
+        for index in woken:
+            self._wake(index)
+
+
+def _discard(buckets, key, index):
+    bucket = buckets[key]
+    bucket.discard(index)
+    if not bucket:
+        del buckets[key]
+
+
+class _Sleeper:
+    """The entry of a sleeping enemy in a spatial.SpatialHash, which needs the
+    position of its actors."""
+
+    __slots__ = ('index', 'pos')
+
+    def __init__(self, index, table):
+        self.index = index
+        self.pos = self.pos_of(index, table)
+
+
+    @staticmethod
+    def pos_of(index, table):
+        return (table.rows[index], table.cols[index])
+
+
+    def __eq__(self, other):
+        return self.index == other.index
+
+
+    def __hash__(self):
+        return hash(self.index)
@@ -0,0 +1,94 @@
+"""
+Non-blocking animations.
+
+Instead of drawing and sleeping on the spot, the game queues its animations in
+a Scheduler while the turn is computed, and the scheduler plays all of them
+together when the screen is drawn: the animations share one frame clock, so
+that eight enemies casting spells take as long as the longest spell, not as
+long as all of them.
+
+An animation is a list of frames. A frame is a list of (<row>, <col>,
+<symbol>) triples, the cells to show on top of the map during that frame.
+Pressing a key during playback skips the rest of it; the key is then handed
+back to curses, so that it is not lost to the game.
+"""
+
+import curses
+
+
+FRAME_SECS = 0.075
+
+
+class Scheduler:
+    """
+    Attributes:
+    - pending: the animations queued since the last playback
+    - speed: frames are shown for FRAME_SECS / speed seconds
+    """
+
+    def __init__(self, speed=1):
+        self.pending = []
+        self.speed = speed
+
+
+    def add(self, frames):
+        if frames:
+            self.pending.append(frames)
+
+
+    @property
+    def ticks(self):
+        """The number of frames the pending animations take to play."""
+        return max(map(len, self.pending), default=0)
+
+
+    def clear(self):
+        self.pending = []
+
+
+    def play(self, scr, chat, to_screen):
+        """Plays the pending animations on (scr). (chat(r, c)) must return the
+        character to put back at the dunmap position (r, c) once a frame is
+        over, and (to_screen(r, c)) its screen coordinates, or None if it is
+        not shown (see viewport.Viewport.to_screen)."""
+
+        pending, self.pending = self.pending, []
+        if not pending:
+            return
+        delay = max(1, int(1000 * FRAME_SECS / self.speed))
+        shown = set()
+        try:
+            for tick in range(max(map(len, pending))):
+                cells = [(r, c, to_screen(r, c), symbol)
+                         for frames in pending if tick < len(frames)
+                         for r, c, symbol in frames[tick]]
+                cells = [cell for cell in cells if cell[2] is not None]
+                if not cells:
+                    # nothing of this frame is on the screen
+                    continue
+                for r, c, screen_pos, symbol in cells:
+                    scr.addstr(*screen_pos, symbol)
+                    shown.add((r, c, screen_pos))
+                scr.refresh()
+                if self._key_pressed(scr, delay):
+                    break
+                for r, c, screen_pos, symbol in cells:
+                    scr.addstr(*screen_pos, chat(r, c))
+        finally:
+            for r, c, screen_pos in shown:
+                scr.addstr(*screen_pos, chat(r, c))
+            scr.refresh()
+
+
+    def _key_pressed(self, scr, delay):
+        """Waits for (delay) milliseconds or until a key is pressed. Returns
+        True in the latter case, after pushing the key back."""
+        scr.timeout(delay)
+        try:
+            key = scr.getch()
+        finally:
+            scr.timeout(-1)
+        if key == -1:
+            return False
+        curses.ungetch(key)
+        return True
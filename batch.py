@@ -0,0 +1,163 @@
+"""
+Batch runner: plays many headless games in a process pool and streams
+aggregated statistics.
+
+Every (dungeon, seed) pair is one game. The seed drives both the game's
+randomness (treasure chests, rabid enemies) and the hero policy. Each worker
+keeps one Game per dungeon, so a dungeon file is parsed once per worker and
+every further game on it only costs a Game.reset.
+
+Usage:
+    py batch.py [options] <dungeon-path> ...
+
+Options:
+    --seeds A:B        play seeds A, A+1, ..., B-1 (default 0:1000)
+    --policy P         'random' or 'script:<filename>' (default random)
+    --max-turns N      give up on a game after N turns (default 1000)
+    --workers N        number of processes (default: all cores)
+    --report-every N   print running totals every N games (default 1000)
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import multiprocessing
+
+import policies
+
+from game import Game
+
+
+WON, KILLED, UNFINISHED = 'won', 'killed', 'unfinished'
+
+# per-worker state, see init_worker
+_policy = None
+_max_turns = None
+_games = {}
+
+
+def init_worker(policy_spec, max_turns):
+    global _policy, _max_turns
+    _policy = policies.parse(policy_spec)
+    _max_turns = max_turns
+
+
+def _get_game(path, seed):
+    game = _games.get(path)
+    if game is None:
+        game = _games[path] = Game(path, headless=True, seed=seed)
+    else:
+        game.reset(seed)
+    return game
+
+
+def play_one(task):
+    """(task) is a pair (<dungeon-path>, <seed>). Returns a triple (<dungeon-path>,
+    <result>, <number of turns>), where <result> is one of {WON, KILLED,
+    UNFINISHED}."""
+
+    path, seed = task
+    rng = random.Random(seed)
+    game = _get_game(path, seed)
+    if hasattr(_policy, 'restart'):
+        _policy.restart()
+
+    for turn in range(1, _max_turns + 1):
+        command = _policy.command(game, rng)
+        if command is None:
+            return path, UNFINISHED, turn - 1
+        outcome = game.step(command)
+        if outcome is Game.WON:
+            return path, WON, turn
+        elif outcome is Game.KILLED:
+            return path, KILLED, turn
+    return path, UNFINISHED, _max_turns
+
+
+class Stats:
+    """Aggregated results for one dungeon."""
+
+    def __init__(self):
+        self.counts = {WON: 0, KILLED: 0, UNFINISHED: 0}
+        self.games = 0
+        self.turns = 0
+        self.min_turns = None
+        self.max_turns = None
+
+
+    def add(self, result, turns):
+        self.counts[result] += 1
+        self.games += 1
+        self.turns += turns
+        self.min_turns = turns if self.min_turns is None else min(self.min_turns, turns)
+        self.max_turns = turns if self.max_turns is None else max(self.max_turns, turns)
+
+
+    def __str__(self):
+        def pct(result):
+            return f'{100 * self.counts[result] / self.games:5.1f}%'
+        return (f'games {self.games:>7}  won {pct(WON)}  killed {pct(KILLED)}  '
+                f'unfinished {pct(UNFINISHED)}  turns avg '
+                f'{self.turns / self.games:7.1f} min {self.min_turns} '
+                f'max {self.max_turns}')
+
+
+def run(paths, seeds, policy_spec='random', max_turns=1000, workers=None,
+        report_every=1000, out=sys.stdout):
+    """Plays every dungeon in (paths) once for each seed in (seeds). Returns a
+    dict mapping each path to its Stats."""
+
+    workers = workers or os.cpu_count()
+    tasks = [(path, seed) for seed in seeds for path in paths]
+    stats = {path: Stats() for path in paths}
+    # big enough chunks to amortize the IPC, small enough to balance the load
+    chunksize = max(1, min(256, len(tasks) // (workers * 8)))
+    start = time.perf_counter()
+
+    with multiprocessing.Pool(workers, init_worker,
+                              (policy_spec, max_turns)) as pool:
+        results = pool.imap_unordered(play_one, tasks, chunksize)
+        for done, (path, result, turns) in enumerate(results, 1):
+            stats[path].add(result, turns)
+            if report_every and done % report_every == 0:
+                rate = done / (time.perf_counter() - start)
+                print(f'[{done}/{len(tasks)}] {rate:.0f} games/s', file=out)
+                report(stats, out)
+
+    elapsed = time.perf_counter() - start
+    print(f'done: {len(tasks)} games in {elapsed:.2f}s on {workers} workers',
+          file=out)
+    report(stats, out)
+    return stats
+
+
+def report(stats, out):
+    for path, path_stats in stats.items():
+        if path_stats.games:
+            print(f'  {path}: {path_stats}', file=out)
+
+
+def parse_seeds(text):
+    first, last = text.split(':')
+    return range(int(first), int(last))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Plays dungeons headlessly under many seeds.')
+    parser.add_argument('paths', nargs='+', metavar='dungeon')
+    parser.add_argument('--seeds', type=parse_seeds, default=range(1000))
+    parser.add_argument('--policy', default='random')
+    parser.add_argument('--max-turns', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--report-every', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    run(args.paths, args.seeds, args.policy, args.max_turns, args.workers,
+        args.report_every)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
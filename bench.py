@@ -0,0 +1,104 @@
+"""
+Throughput benchmark for the game engine.
+
+Every dungeon is played headlessly by a random hero for a fixed number of turns
+(the dungeon is reset whenever a game ends). For comparison, the same games are
+played a second time with animations enabled but never drawn, counting how
+many frames the UI-bound loop would have played after each half turn. Each
+frame lasts at least animation.FRAME_SECS, which gives a lower bound for the
+time the curses loop spends on the same turns.
+
+Usage: py bench.py [<turns-per-dungeon>] [<dungeon-path> ...]
+"""
+
+import os
+import sys
+import time
+import random
+
+import globvars
+import policies
+import animation
+
+from game import Game
+
+
+TURNS = 2000
+
+
+class FrameCountingGame(Game):
+    """A Game which queues its animations, but instead of playing them it only
+    counts the frames that Game.draw would have played after each half turn."""
+
+    def __init__(self, filename):
+        self.frames = 0
+        super().__init__(filename)
+
+
+    def _count_frames(self):
+        self.frames += self.animations.ticks
+        self.animations.clear()
+
+
+    def hero_phase(self, command):
+        outcome = super().hero_phase(command)
+        self._count_frames()
+        return outcome
+
+
+    def enemy_phase(self):
+        outcome = super().enemy_phase()
+        self._count_frames()
+        return outcome
+
+
+def run(game, turns, seed=0):
+    """Plays (turns) turns of (game) with a random hero. Returns the number of
+    finished games."""
+
+    rng = random.Random(seed)
+    game.reset(seed)
+    finished = 0
+    for _ in range(turns):
+        if game.step(policies.random_command(rng)) is not Game.ONGOING:
+            finished += 1
+            game.reset(seed + finished)
+    return finished
+
+
+def bench(path, turns):
+    game = Game(path, headless=True)
+    start = time.perf_counter()
+    finished = run(game, turns)
+    elapsed = time.perf_counter() - start
+
+    counting = FrameCountingGame(path)
+    run(counting, turns)
+    ui_floor = counting.frames * animation.FRAME_SECS
+
+    return {'dungeon': os.path.basename(path),
+            'turns': turns,
+            'games': finished,
+            'secs': elapsed,
+            'turns_per_sec': turns / elapsed,
+            'frames': counting.frames,
+            'ui_turns_per_sec': turns / (elapsed + ui_floor)}
+
+
+def main(argv):
+    turns = int(argv[0]) if argv else TURNS
+    paths = argv[1:] or [f'{globvars.DUNDIR}/{name}'
+                         for name in sorted(os.listdir(globvars.DUNDIR))]
+
+    print(f'{"dungeon":<10}{"games":>8}{"turns/s":>14}'
+          f'{"frames":>10}{"ui turns/s":>14}{"speedup":>10}')
+    for path in paths:
+        result = bench(path, turns)
+        speedup = result['turns_per_sec'] / result['ui_turns_per_sec']
+        print(f'{result["dungeon"]:<10}{result["games"]:>8}'
+              f'{result["turns_per_sec"]:>14.0f}{result["frames"]:>10}'
+              f'{result["ui_turns_per_sec"]:>14.1f}{speedup:>9.0f}x')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
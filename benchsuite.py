@@ -0,0 +1,193 @@
+"""
+Benchmark suite for the hot paths of the game engine.
+
+Generates dungeons of growing size and enemy count (see SIZES) with dungen, and
+times on each of them:
+- load: parsing the JSON dungeon file and building the game (uncached)
+- reset: Game.reset
+- chars: Dunmap.chars
+- find_hero: Game.find_hero, per enemy
+- actor_move: Game.actor_move of the hero, back and forth
+- spell: Game.actor_attack with a spell cast along the hero's row
+- turn: a full turn (Game.step) with a random hero
+
+Every time is the best of a few runs, per operation. The results are printed
+and written as JSON, which a later run can be compared with to catch
+regressions:
+
+    py benchsuite.py -o before.json
+    ... change the engine ...
+    py benchsuite.py -o after.json --compare before.json
+
+With --compare, the exit status is 1 if an operation got slower than the
+threshold. With --plan-workers N, the enemies of the full turns plan in N
+worker processes (see planning).
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import timeit
+import argparse
+import platform
+import tempfile
+
+import dungen
+import policies
+import treasures
+
+from game import Game
+
+
+# (<side of the square map>, <number of enemies>)
+SIZES = ((10, 3), (100, 50), (500, 1000), (1000, 5000), (2000, 20000))
+
+OBSTACLE_DENSITY = 0.2
+# the hero of the generated dungeons, which the random turns should not kill
+HERO = dict(dungen.HERO, max_health=10**9)
+REPEAT = 3
+TURNS = 200
+
+
+def per_op(function, ops=1, repeat=REPEAT):
+    """Returns the best time of (repeat) runs of (function), which performs
+    (ops) operations, per operation. (function) is called often enough for a
+    run to last at least 0.2 seconds."""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / (number * ops)
+
+
+def bench_dungeon(path, repeat, plan_workers=0):
+    """Returns a dict mapping each case to its time per operation, for the
+    dungeon file (path)."""
+    results = {}
+    results['load'] = per_op(lambda: Game(path, headless=True, cache=False),
+                             repeat=repeat)
+    game = Game(path, headless=True, cache=False, seed=0)
+    results['reset'] = per_op(game.reset, repeat=repeat)
+    results['chars'] = per_op(lambda: game.dunmap.chars, repeat=repeat)
+
+    game.reset()
+    sample = game.enemies[:1000]
+    if sample:
+        def find_hero():
+            for enemy in sample:
+                game.find_hero(enemy)
+        results['find_hero'] = per_op(find_hero, len(sample), repeat)
+
+    hero = game.hero
+    def move():
+        game.actor_move(hero, 'left')
+        game.actor_move(hero, 'right')
+    results['actor_move'] = per_op(move, 2, repeat)
+
+    # a harmless spell, as far as the hero's row lets it go
+    hero.spell = treasures.Spell('bench', 0, 0, game.dunmap.ncols)
+    results['spell'] = per_op(
+        lambda: game.actor_attack(hero, 'spell', 'right'), repeat=repeat)
+
+    game = Game(path, headless=True, cache=False, seed=0,
+                plan_workers=plan_workers)
+    rng = random.Random(0)
+    def turns():
+        for _ in range(TURNS):
+            if game.step(policies.random_command(rng)) is not Game.ONGOING:
+                game.reset()
+    try:
+        results['turn'] = per_op(turns, TURNS, repeat)
+    finally:
+        game.planner.close()
+    return results
+
+
+def run(sizes, repeat=REPEAT, out=sys.stdout, plan_workers=0):
+    """Benchmarks every size in (sizes), see SIZES. Returns the results, a
+    list of dicts with the keys case, side, enemies and secs."""
+    results = []
+    print(f'{"case":<12}{"dungeon":>18}{"time/op":>14}', file=out)
+    for side, nenemies in sizes:
+        params = dungen.Params(side, side, OBSTACLE_DENSITY, nenemies,
+                               hero=HERO)
+        with tempfile.NamedTemporaryFile('w', suffix='.json',
+                                         delete=False) as f:
+            dungen.write(params, f)
+        try:
+            for case, secs in bench_dungeon(f.name, repeat,
+                                            plan_workers).items():
+                results.append({'case': case, 'side': side,
+                                'enemies': nenemies, 'secs': secs})
+                dungeon = f'{side}x{side}/{nenemies}'
+                print(f'{case:<12}{dungeon:>18}{format_secs(secs):>14}',
+                      file=out)
+        finally:
+            os.remove(f.name)
+    return results
+
+
+def format_secs(secs):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if secs >= scale:
+            return f'{secs / scale:.2f} {unit}'
+    return f'{secs / 1e-9:.0f} ns'
+
+
+def compare(results, baseline, threshold, out=sys.stdout):
+    """Prints how (results) compare with (baseline), both lists as returned by
+    run. Returns the number of operations more than (threshold) times slower
+    than in the baseline."""
+    before = {(r['case'], r['side'], r['enemies']): r['secs'] for r in baseline}
+    regressions = 0
+    print(f'{"case":<12}{"dungeon":>18}{"ratio":>10}', file=out)
+    for r in results:
+        old = before.get((r['case'], r['side'], r['enemies']))
+        if old is None:
+            continue
+        ratio = r['secs'] / old
+        slower = ratio > threshold
+        regressions += slower
+        dungeon = f'{r["side"]}x{r["side"]}/{r["enemies"]}'
+        print(f'{r["case"]:<12}{dungeon:>18}{ratio:>9.2f}x'
+              f'{"  SLOWER" if slower else ""}', file=out)
+    return regressions
+
+
+def parse_sizes(text):
+    """'10:3,100:50' -> ((10, 3), (100, 50))"""
+    return tuple(tuple(map(int, size.split(':'))) for size in text.split(','))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Times the hot paths of the engine on generated dungeons.')
+    parser.add_argument('--sizes', type=parse_sizes, default=SIZES,
+                        help='<side>:<enemies>,... (default: all of SIZES)')
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--plan-workers', type=int, default=0,
+                        help='worker processes planning the enemy turns')
+    parser.add_argument('-o', '--output', help='where to write the JSON results')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='JSON results of an earlier run')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='slowdown ratio counted as a regression')
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.repeat, plan_workers=args.plan_workers)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'machine': platform.machine(),
+                       'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'results': results}, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
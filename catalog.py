@@ -0,0 +1,166 @@
+"""
+The dungeon catalog.
+
+A Catalog describes every dungeon file of a directory (its dimensions, its
+enemies per behavior and its chests) for the dungeon menu, without parsing the
+files every time the menu is shown: the descriptions are kept in
+globvars.CACHEDIR, each with the modification time and size of its file, and
+Catalog.refresh only reads again the files which were added or changed since.
+
+The catalog is read before the first menu is shown, so it is stored with
+marshal, which is built in, rather than with pickle or json, which take longer
+to import than reading the catalog itself. The modules needed to read a
+dungeon file are only imported when a file has to be read.
+
+Any problem with the stored catalog (a missing directory, a corrupt file, a
+file written by another version) is treated as an empty catalog.
+"""
+
+import os
+import marshal
+
+import globvars
+import utils
+
+
+# bumped whenever the format of the entries changes
+FORMAT = 1
+
+CATALOG_FILE = 'catalog'
+
+
+class Entry:
+    """
+    Attributes:
+    - name: the name of the file in the directory
+    - mtime_ns, size: the modification time and size of the file when it was
+      read
+    - dims: the pair (<number of rows>, <number of columns>)
+    - behaviors: a dict mapping each behavior to the number of its enemies
+    - nchests: the number of treasure chests
+    - error: None, or why the file could not be read, in which case the other
+      attributes are empty
+    """
+
+    __slots__ = ('name', 'mtime_ns', 'size', 'dims', 'behaviors', 'nchests',
+                 'error')
+
+    def __init__(self, name, mtime_ns, size, dims=None, behaviors=None,
+                 nchests=0, error=None):
+        self.name = name
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.dims = dims
+        self.behaviors = behaviors or {}
+        self.nchests = nchests
+        self.error = error
+
+
+    @property
+    def nenemies(self):
+        return sum(self.behaviors.values())
+
+
+    def describe(self):
+        """Returns a one-line description of the dungeon, without its name."""
+        if self.error is not None:
+            return f'unreadable: {self.error}'
+        nrows, ncols = self.dims
+        behaviors = ', '.join(f'{count} {behavior}'
+                              for behavior, count in self.behaviors.items())
+        return (f'{nrows}x{ncols}  {self.nenemies} enemies'
+                f'{f" ({behaviors})" if behaviors else ""}'
+                f'  {self.nchests} chests')
+
+
+    def to_tuple(self):
+        return tuple(getattr(self, attr) for attr in self.__slots__)
+
+
+class Catalog:
+    """
+    Attributes:
+    - directory: the directory of the dungeon files
+    - entries: maps the name of every file of the directory to its Entry
+    """
+
+    def __init__(self, directory=globvars.DUNDIR):
+        self.directory = directory
+        self.path = os.path.join(globvars.CACHEDIR, CATALOG_FILE)
+        self.entries = self._load()
+
+
+    def names(self):
+        """Returns the sorted names of the dungeon files."""
+        return sorted(self.entries)
+
+
+    def refresh(self):
+        """Brings the entries up to date with the directory: reads the files
+        which are new or changed and forgets those which are gone. Returns
+        True if anything changed."""
+        entries = {}
+        changed = False
+        with os.scandir(self.directory) as it:
+            for dirent in it:
+                if not dirent.is_file():
+                    continue
+                stat = dirent.stat()
+                entry = self.entries.get(dirent.name)
+                if (entry is None or entry.mtime_ns != stat.st_mtime_ns
+                        or entry.size != stat.st_size):
+                    entry = _read(dirent.path, dirent.name, stat)
+                    changed = True
+                entries[dirent.name] = entry
+        changed = changed or len(entries) != len(self.entries)
+        self.entries = entries
+        if changed:
+            self._save()
+        return changed
+
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                version, directory, tuples = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return {}
+        if version != FORMAT or directory != os.path.abspath(self.directory):
+            return {}
+        return {t[0]: Entry(*t) for t in tuples}
+
+
+    def _save(self):
+        data = (FORMAT, os.path.abspath(self.directory),
+                [entry.to_tuple() for entry in self.entries.values()])
+        try:
+            os.makedirs(globvars.CACHEDIR, exist_ok=True)
+            utils.write_atomically(self.path, marshal.dumps(data))
+        except OSError:
+            pass
+
+
+def _read(path, name, stat):
+    """Returns the Entry of the dungeon file (path)."""
+
+    # only needed when a file changed, which is not worth slowing down the
+    # start for
+    import dunfile
+    import enemies
+
+    try:
+        dungeon = dunfile.load(path)
+        try:
+            behaviors = dict.fromkeys(enemies.BEHAVIORS, 0)
+            for *_, behavior in dungeon.enemies():
+                behaviors[behavior] += 1
+            nchests = sum(1 for _ in dungeon.chests())
+            dims = tuple(dungeon.dims)
+        finally:
+            dungeon.close()
+    except (OSError, ValueError, KeyError, TypeError, IndexError) as e:
+        return Entry(name, stat.st_mtime_ns, stat.st_size, error=str(e))
+    behaviors = {behavior: count for behavior, count in behaviors.items()
+                 if count}
+    return Entry(name, stat.st_mtime_ns, stat.st_size, dims, behaviors,
+                 nchests)
@@ -0,0 +1,118 @@
+"""
+The compiled dungeon cache.
+
+Building the initial state of a dungeon (parsing the file, creating every actor
+and chest) is done once per version of the file. The result, a Game.snapshot,
+is kept in memory and saved to globvars.CACHEDIR in the format of savegame,
+keyed by the absolute path of the file, its modification time and its size.
+Later Games on the same file restore the snapshot with a few bulk copies
+instead (see Game.restore).
+
+A cache file is the modification time and the size of the dungeon file (see
+STAMP) followed by the saved game of the snapshot. Its name holds FORMAT;
+writing a cache file removes the files of the other formats.
+
+Any problem with the disk cache (a missing directory, a corrupt or stale file)
+is treated as a miss.
+"""
+
+import os
+import struct
+import hashlib
+import collections
+
+import globvars
+import savegame
+import utils
+
+
+# bumped whenever the format of the snapshots changes
+FORMAT = 5
+
+# the modification time and the size of the dungeon file
+STAMP = struct.Struct('<qQ')
+
+# the extension of the cache files, and that of the files of the formats before
+# the cache used savegame
+EXTENSION = '.cache'
+_OLD_EXTENSION = '.pickle'
+
+# the number of snapshots kept in memory
+MEMORY_SIZE = 16
+
+_memory = collections.OrderedDict()
+
+
+def _key(filename):
+    stat = os.stat(filename)
+    return (FORMAT, os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+
+
+def _cache_path(key):
+    # the format is part of the name, so that a file written by another
+    # version is never even read
+    name = hashlib.sha1(key[1].encode()).hexdigest()
+    return os.path.join(globvars.CACHEDIR, f'{name}-{FORMAT}{EXTENSION}')
+
+
+def get(filename):
+    """Returns the snapshot of the initial state of the dungeon in (filename),
+    or None if it is not in the cache."""
+    try:
+        key = _key(filename)
+    except OSError:
+        return None
+
+    snapshot = _memory.get(key)
+    if snapshot is not None:
+        _memory.move_to_end(key)
+        return snapshot
+
+    path = _cache_path(key)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < STAMP.size or STAMP.unpack_from(data) != key[2:]:
+            return None
+        dungeon, snapshot = savegame.loads(data[STAMP.size:], path)
+    except (OSError, ValueError):
+        return None
+    if dungeon != key[1]:
+        return None
+    _remember(key, snapshot)
+    return snapshot
+
+
+def put(filename, snapshot):
+    """Stores (snapshot) as the initial state of the dungeon in (filename)."""
+    try:
+        key = _key(filename)
+    except OSError:
+        return
+    _remember(key, snapshot)
+
+    try:
+        os.makedirs(globvars.CACHEDIR, exist_ok=True)
+        utils.write_atomically(_cache_path(key), STAMP.pack(*key[2:])
+                               + savegame.dumps(key[1], snapshot))
+        _remove_other_formats()
+    except OSError:
+        pass
+
+
+def _remove_other_formats():
+    """Removes the cache files written in other formats than FORMAT."""
+    suffix = f'-{FORMAT}{EXTENSION}'
+    with os.scandir(globvars.CACHEDIR) as it:
+        for dirent in it:
+            name = dirent.name
+            if (name.endswith(_OLD_EXTENSION)
+                    or (name.endswith(EXTENSION) and not name.endswith(suffix))):
+                os.remove(dirent.path)
+
+
+def _remember(key, snapshot):
+    _memory[key] = snapshot
+    _memory.move_to_end(key)
+    while len(_memory) > MEMORY_SIZE:
+        _memory.popitem(last=False)
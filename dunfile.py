@@ -0,0 +1,216 @@
+"""
+Dungeon files.
+
+A dungeon file is either a JSON document (the format of the files in
+globvars.DUNDIR) or a binary file in the format described below. load() tells
+them apart and returns a dungeon object which Game.reset reads the initial state
+from. Both kinds of dungeon objects have the same interface:
+- dims: the pair (<number of rows>, <number of columns>)
+- hero: a dict with the keys max_health, max_mana, mana_regen, fist_damage, pos
+- gateway: the position of the gateway
+- treasures: the list of treasure dicts (see treasures.parse_dict)
+- loot_tables: the dict of the loot table declarations (see loot)
+- enemies(): an iterator of (<max_health>, <max_mana>, <mana_regen>,
+  <fist_damage>, <pos>, <behavior>) tuples
+- chests(): an iterator of (<pos>, <loot table id>) pairs, one per treasure
+  chest
+- place_obstacles(dunmap): makes the obstacle positions of (dunmap) obstacles
+
+The binary format (all integers little-endian):
+- a header, see HEADER
+- the obstacle layer: one bit per position, row-major, the least significant
+  bit of each byte first; a set bit is an obstacle
+- the enemies: fixed-width records, see ENEMY
+- the treasure chests: fixed-width records, see CHEST
+- the loot: a JSON object in UTF-8, with the treasures list, the loot table
+  declarations and the list of the ids of the tables chests are drawn from
+  (which the chest records refer to by index)
+
+The binary loader maps the file in memory instead of reading it, and expands the
+obstacle layer into the dunmap chunk by chunk, so that loading a big dungeon
+never needs more than a chunk of memory on top of the dunmap itself.
+
+Converting a JSON dungeon: py dunfile.py <json-path> <binary-path>
+"""
+
+import sys
+import json
+import mmap
+import struct
+
+import enemies
+import loot
+
+
+MAGIC = b'DUNB'
+VERSION = 2
+
+# magic, version, nrows, ncols, hero (max_health, max_mana, mana_regen,
+# fist_damage, row, col), gateway (row, col), number of enemies, number of
+# chests, size of the loot
+HEADER = struct.Struct('<4sHIIiiiiIIIIIII')
+# max_health, max_mana, mana_regen, fist_damage, row, col, behavior (an index
+# into enemies.BEHAVIORS), 3 padding bytes
+ENEMY = struct.Struct('<iiiiIIB3x')
+# row, col, loot table (an index into the 'chest-tables' list of the loot)
+CHEST = struct.Struct('<III')
+
+# the number of obstacle layer bytes expanded at once
+CHUNK_BYTES = 1 << 16
+
+# (_BITS[b]) is the 8 bytes of the 8 bits of (b), each either 0 or 1
+_BITS = [bytes((b >> k) & 1 for k in range(8)) for b in range(256)]
+
+
+def load(filename):
+    """Returns the dungeon object for the file (filename), whatever its
+    format."""
+    with open(filename, 'rb') as f:
+        binary = f.read(len(MAGIC)) == MAGIC
+    if binary:
+        return BinaryDungeon(filename)
+    with open(filename) as f:
+        return JsonDungeon(json.load(f))
+
+
+class JsonDungeon:
+    def __init__(self, dct):
+        self.dct = dct
+        self.dims = tuple(dct['dims'])
+        self.hero = dct['hero']
+        self.gateway = tuple(dct['gateway'])
+        self.treasures = dct['treasures']
+        self.loot_tables = dct.get('loot-tables', {})
+
+
+    def enemies(self):
+        for penemy in self.dct['enemies']:
+            yield (penemy['max_health'], penemy['max_mana'],
+                   penemy['mana_regen'], penemy['fist_damage'],
+                   tuple(penemy['pos']), penemy['behavior'])
+
+
+    def chests(self):
+        # a chest is its position, or a dict with its position and table
+        for chest in self.dct['treasure-chests']:
+            if isinstance(chest, dict):
+                yield tuple(chest['pos']), chest.get('table', loot.DEFAULT)
+            else:
+                yield tuple(chest), loot.DEFAULT
+
+
+    def place_obstacles(self, dunmap):
+        dunmap.set_obstacles(self.dct['obstacles'])
+
+
+    def close(self):
+        pass
+
+
+class BinaryDungeon:
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, nrows, ncols, *hero, gate_row, gate_col,
+         self.nenemies, self.nchests, loot_size) = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION:
+            self.data.close()
+            raise ValueError(f'{filename}: not a version {VERSION} dungeon file')
+
+        self.dims = (nrows, ncols)
+        self.hero = dict(zip(('max_health', 'max_mana', 'mana_regen',
+                              'fist_damage'), hero[:4]),
+                         pos=tuple(hero[4:]))
+        self.gateway = (gate_row, gate_col)
+
+        self.obstacles_offset = HEADER.size
+        self.enemies_offset = self.obstacles_offset + (nrows * ncols + 7) // 8
+        self.chests_offset = self.enemies_offset + self.nenemies * ENEMY.size
+        loot_offset = self.chests_offset + self.nchests * CHEST.size
+        loot_dct = json.loads(self.data[loot_offset:loot_offset + loot_size])
+        self.treasures = loot_dct['treasures']
+        self.loot_tables = loot_dct['loot-tables']
+        self.chest_tables = loot_dct['chest-tables']
+
+
+    def close(self):
+        self.data.close()
+
+
+    def _records(self, record, offset, count):
+        view = memoryview(self.data)[offset:offset + count * record.size]
+        try:
+            yield from record.iter_unpack(view)
+        finally:
+            view.release()
+
+
+    def enemies(self):
+        behaviors = enemies.BEHAVIORS
+        for *stats, row, col, behavior in self._records(
+                ENEMY, self.enemies_offset, self.nenemies):
+            yield (*stats, (row, col), behaviors[behavior])
+
+
+    def chests(self):
+        tables = self.chest_tables
+        for row, col, table in self._records(CHEST, self.chests_offset,
+                                             self.nchests):
+            yield (row, col), tables[table]
+
+
+    def place_obstacles(self, dunmap):
+        ncells = dunmap.nrows * dunmap.ncols
+        start, end = self.obstacles_offset, self.enemies_offset
+        for offset in range(start, end, CHUNK_BYTES):
+            chunk = self.data[offset:min(end, offset + CHUNK_BYTES)]
+            first = (offset - start) * 8
+            mask = b''.join(map(_BITS.__getitem__, chunk))
+            dunmap.set_obstacle_mask(first, mask[:ncells - first])
+
+
+def convert(dct):
+    """Returns the binary dungeon file equivalent to the JSON dungeon (dct)."""
+    nrows, ncols = dct['dims']
+    hero = dct['hero']
+    dungeon = JsonDungeon(dct)
+    chests = list(dungeon.chests())
+    chest_tables = list(dict.fromkeys(table for _, table in chests))
+    table_numbers = {table: i for i, table in enumerate(chest_tables)}
+    loot_json = json.dumps({'treasures': dungeon.treasures,
+                            'loot-tables': dungeon.loot_tables,
+                            'chest-tables': chest_tables}).encode()
+
+    bits = bytearray((nrows * ncols + 7) // 8)
+    for row, col in dct['obstacles']:
+        i = row * ncols + col
+        bits[i >> 3] |= 1 << (i & 7)
+
+    parts = [HEADER.pack(MAGIC, VERSION, nrows, ncols,
+                         hero['max_health'], hero['max_mana'],
+                         hero['mana_regen'], hero['fist_damage'], *hero['pos'],
+                         *dct['gateway'], len(dct['enemies']),
+                         len(chests), len(loot_json)),
+             bits]
+    parts.extend(ENEMY.pack(e['max_health'], e['max_mana'], e['mana_regen'],
+                            e['fist_damage'], *e['pos'],
+                            enemies.BEHAVIORS.index(e['behavior']))
+                 for e in dct['enemies'])
+    parts.extend(CHEST.pack(*pos, table_numbers[table]) for pos, table in chests)
+    parts.append(loot_json)
+    return b''.join(parts)
+
+
+def main(argv):
+    if len(argv) != 2:
+        print('usage: py dunfile.py <json-path> <binary-path>', file=sys.stderr)
+        return 2
+    with open(argv[0]) as f:
+        dct = json.load(f)
+    with open(argv[1], 'wb') as f:
+        f.write(convert(dct))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
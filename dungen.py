@@ -0,0 +1,200 @@
+"""
+Procedural dungeon generator.
+
+Writes a random dungeon in the JSON format of the files in globvars.DUNDIR. The
+dungeon is determined by its parameters and seed: the same command always
+writes the same file.
+
+The gateway is always reachable from the hero. Before a row is filled, a
+corridor is drawn through it: it enters the row where the corridor left the
+previous row and leaves it at a random column, so that the corridor meanders
+from the hero, in the first row, down to the gateway, in the last row. No
+obstacle is put on it.
+
+The enemies and the treasure chests are placed with selection sampling: every
+position is chosen with the probability (<number still to place> / <number of
+positions left>), which places exactly the requested number of them, uniformly,
+in a single pass over the positions.
+
+The output is streamed: nothing but the current row is ever in memory, so that
+any size can be generated. Since the obstacles, the enemies and the chests are
+separate lists in the file, the generation is run once per list; it replays
+exactly, since everything is drawn from one random.Random seeded the same way.
+
+Usage: py dungen.py <path> [--size <rows>x<cols>] [--density D] [--enemies N]
+                           [--chests N] [--seed S]
+(<path> may be - for the standard output.)
+"""
+
+import sys
+import json
+import random
+import argparse
+
+import enemies
+
+
+OBSTACLE, ENEMY, CHEST = 'obstacle', 'enemy', 'chest'
+
+TREASURES = [
+    {'type': 'weapon', 'name': 'sword', 'damage': 30},
+    {'type': 'weapon', 'name': 'axe', 'damage': 40},
+    {'type': 'spell', 'name': 'fireball', 'damage': 40, 'mana_cost': 30,
+     'cast_range': 4},
+    {'type': 'area_spell', 'name': 'nova', 'damage': 25, 'mana_cost': 50,
+     'cast_range': 3, 'radius': 2},
+    {'type': 'health_potion', 'amount': 40},
+    {'type': 'mana_potion', 'amount': 40},
+]
+
+# the statistics of the hero
+HERO = {'max_health': 100, 'max_mana': 100, 'mana_regen': 2, 'fist_damage': 20}
+
+
+class Params:
+    def __init__(self, nrows, ncols, density=0.2, nenemies=0, nchests=0,
+                 seed=0, hero=HERO):
+        """(hero) is a dict of the statistics of the hero, see HERO."""
+        if nrows <= 0 or ncols <= 0 or nrows * ncols < 2:
+            raise ValueError(f'invalid dimensions: {nrows}x{ncols}')
+        if not 0 <= density <= 1:
+            raise ValueError(f'invalid obstacle density: {density}')
+        if nenemies < 0 or nchests < 0 or nenemies + nchests > nrows * ncols - 2:
+            raise ValueError(f'{nenemies} enemies and {nchests} chests do not '
+                             f'fit in {nrows}x{ncols}')
+        self.nrows = nrows
+        self.ncols = ncols
+        self.density = density
+        self.nenemies = nenemies
+        self.nchests = nchests
+        self.seed = seed
+        self.hero = dict(hero)
+
+
+def _ends(params):
+    """Returns the positions of the hero and of the gateway."""
+    rng = random.Random(params.seed)
+    if params.nrows == 1:
+        return (0, 0), (0, params.ncols - 1)
+    return ((0, rng.randrange(params.ncols)),
+            (params.nrows - 1, rng.randrange(params.ncols)))
+
+
+def _corridor_exits(params, hero, gateway):
+    """Yields, for each row, the pair (<column where the corridor enters the row>,
+    <column where it leaves it>)."""
+    rng = random.Random(params.seed + 1)
+    nrows, ncols = params.nrows, params.ncols
+    reach = max(1, ncols // 4)
+    col = hero[1]
+    for row in range(nrows):
+        if row == nrows - 1:
+            exit_col = gateway[1]
+        else:
+            exit_col = min(max(col + rng.randint(-reach, reach), 0), ncols - 1)
+        yield col, exit_col
+        col = exit_col
+
+
+def generate(params):
+    """Yields a triple (<pos>, <what>, <enemy>) for every position of the
+    dungeon which is not walkable, in the order left to right, top to bottom.
+    (what) is one of {OBSTACLE, ENEMY, CHEST}; (enemy) is the dict of the enemy
+    when (what == ENEMY), otherwise None."""
+
+    hero, gateway = _ends(params)
+    rng = random.Random(params.seed + 2)
+    behaviors = enemies.BEHAVIORS
+    enemies_left, chests_left = params.nenemies, params.nchests
+    # the positions which may receive an enemy or a chest
+    left = params.nrows * params.ncols - 2
+    corridors = _corridor_exits(params, hero, gateway)
+    for row in range(params.nrows):
+        entry, exit_col = next(corridors)
+        corridor = range(min(entry, exit_col), max(entry, exit_col) + 1)
+        for col in range(params.ncols):
+            pos = (row, col)
+            if pos == hero or pos == gateway:
+                continue
+            # one draw decides between enemy, chest, obstacle and nothing
+            x = rng.random() * left
+            left -= 1
+            if x < enemies_left:
+                enemies_left -= 1
+                yield pos, ENEMY, {
+                    'max_health': rng.randrange(30, 61, 10),
+                    'max_mana': 100,
+                    'mana_regen': rng.randrange(1, 4),
+                    'fist_damage': rng.randrange(10, 31, 5),
+                    'behavior': rng.choice(behaviors),
+                    'pos': pos}
+            elif x < enemies_left + chests_left:
+                chests_left -= 1
+                yield pos, CHEST, None
+            elif (col not in corridor
+                  and rng.random() < params.density):
+                yield pos, OBSTACLE, None
+
+
+def write(params, out):
+    """Writes the dungeon described by (params) to the text file (out)."""
+
+    hero, gateway = _ends(params)
+    header = {
+        'dims': [params.nrows, params.ncols],
+        'hero': dict(params.hero, pos=list(hero)),
+        'gateway': list(gateway),
+        'treasures': TREASURES,
+    }
+    dumps = json.JSONEncoder(separators=(',', ':')).encode
+    out.write('{\n')
+    for key, value in header.items():
+        out.write(f'{dumps(key)}: {dumps(value)},\n')
+
+    lists = (('obstacles', OBSTACLE), ('enemies', ENEMY),
+             ('treasure-chests', CHEST))
+    for n, (key, what) in enumerate(lists):
+        out.write(f'{dumps(key)}: [')
+        separator = '\n'
+        for pos, kind, enemy in generate(params):
+            if kind == what:
+                out.write(separator)
+                out.write(dumps(enemy if kind == ENEMY else pos))
+                separator = ',\n'
+        out.write(']\n' if n == len(lists) - 1 else '],\n')
+    out.write('}\n')
+
+
+def parse_size(text):
+    nrows, ncols = text.lower().split('x')
+    return int(nrows), int(ncols)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Writes a random dungeon with a reachable gateway.')
+    parser.add_argument('path', help='the file to write, - for stdout')
+    parser.add_argument('--size', type=parse_size, default=(20, 40),
+                        help='<rows>x<cols> (default 20x40)')
+    parser.add_argument('--density', type=float, default=0.2,
+                        help='the probability of an obstacle (default 0.2)')
+    parser.add_argument('--enemies', type=int, default=10)
+    parser.add_argument('--chests', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    try:
+        params = Params(*args.size, args.density, args.enemies, args.chests,
+                        args.seed)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.path == '-':
+        write(params, sys.stdout)
+    else:
+        with open(args.path, 'w') as f:
+            write(params, f)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,188 @@
+"""
+Struct-of-arrays storage for enemies.
+
+An EnemyTable keeps every attribute of every enemy in its own column (a typed
+array, or a list for object references), indexed by the enemy's index in the
+table. The game manipulates enemies through lightweight views (see game.Enemy),
+one per index, but the work that concerns all enemies at once (mana
+regeneration, dropping the dead, the geometric tests against the hero) runs as
+whole-column operations, which is what keeps turns cheap with tens of
+thousands of enemies.
+"""
+
+import array
+import operator
+import itertools
+
+
+BEHAVIORS = ('friendly', 'aggressive', 'rabid')
+FRIENDLY, AGGRESSIVE, RABID = range(len(BEHAVIORS))
+
+NOWHERE = -1 # the value of last_seen_rows/last_seen_cols when last_seen is None
+
+
+# the typecode of the columns: 64-bit on every platform, so that the snapshots
+# of a table have the same layout everywhere (see savegame)
+TYPECODE = 'q'
+
+
+def _column(typecode=TYPECODE):
+    return array.array(typecode)
+
+
+# the columns which are typed arrays
+ARRAY_COLUMNS = ('health', 'max_health', 'mana', 'max_mana', 'mana_regen',
+                 'fist_damage', 'rows', 'cols', 'last_seen_rows',
+                 'last_seen_cols', 'live')
+
+
+class EnemyTable:
+    """
+    Columns (all of the same length, one entry per enemy):
+    - health, max_health, mana, max_mana, mana_regen, fist_damage
+    - rows, cols: the position of the enemy
+    - last_seen_rows, last_seen_cols: the position the hero was last seen in, or
+      NOWHERE in both columns
+    - behaviors: a bytearray of indexes into BEHAVIORS
+    - weapons, spells: lists of the treasures held by the enemies
+
+    Other attributes:
+    - live: an array of the indexes of the enemies which were alive the last
+      time the dead were dropped (see EnemyTable.drop_dead), in table order
+    - views: (views[i]) is the view object of the enemy with index (i)
+    - touched: when a set rather than None, the indexes of the enemies written
+      to (by the views, by EnemyTable.regen_mana, or put to sleep or woken up
+      by an activity.ActivityScheduler) are added to it (see undo.History)
+    """
+
+    def __init__(self):
+        self.health = _column()
+        self.max_health = _column()
+        self.mana = _column()
+        self.max_mana = _column()
+        self.mana_regen = _column()
+        self.fist_damage = _column()
+        self.rows = _column()
+        self.cols = _column()
+        self.last_seen_rows = _column()
+        self.last_seen_cols = _column()
+        self.behaviors = bytearray()
+        self.weapons = []
+        self.spells = []
+        self.live = _column()
+        self.views = []
+        self.touched = None
+
+
+    def __len__(self):
+        return len(self.health)
+
+
+    def add(self, max_health, max_mana, mana_regen, fist_damage, pos, behavior,
+            weapon, spell):
+        """Appends an enemy at full health and mana. Returns its index."""
+        index = len(self.health)
+        self.health.append(max_health)
+        self.max_health.append(max_health)
+        self.mana.append(max_mana)
+        self.max_mana.append(max_mana)
+        self.mana_regen.append(mana_regen)
+        self.fist_damage.append(fist_damage)
+        self.rows.append(pos[0])
+        self.cols.append(pos[1])
+        self.last_seen_rows.append(NOWHERE)
+        self.last_seen_cols.append(NOWHERE)
+        self.behaviors.append(BEHAVIORS.index(behavior))
+        self.weapons.append(weapon)
+        self.spells.append(spell)
+        self.live.append(index)
+        return index
+
+    def snapshot(self):
+        """Returns the content of the columns as a dict of immutable values."""
+        snapshot = {name: getattr(self, name).tobytes() for name in ARRAY_COLUMNS}
+        snapshot['behaviors'] = bytes(self.behaviors)
+        snapshot['weapons'] = tuple(self.weapons)
+        snapshot['spells'] = tuple(self.spells)
+        return snapshot
+
+
+    def restore(self, snapshot):
+        """Replaces the content of the columns with (snapshot), see
+        EnemyTable.snapshot, and (self.live) with the enemies alive in it (the
+        'live' entry of (snapshot) is not read). The views are left alone and
+        the writes are no longer tracked."""
+        for name in ARRAY_COLUMNS:
+            if name == 'live':
+                continue
+            column = _column()
+            column.frombytes(snapshot[name])
+            setattr(self, name, column)
+        self.behaviors = bytearray(snapshot['behaviors'])
+        self.weapons = list(snapshot['weapons'])
+        self.spells = list(snapshot['spells'])
+        self.live = array.array(
+            TYPECODE, itertools.compress(range(len(self.health)), self.health))
+        self.touched = None
+
+    ########################################
+    # batched operations
+
+    def drop_dead(self):
+        """Removes the dead enemies from (self.live)."""
+        health = self.health
+        self.live = array.array(TYPECODE, itertools.compress(
+            self.live, map(health.__getitem__, self.live)))
+
+
+    def regen_mana(self, indexes=None):
+        """Gives every enemy in (indexes), by default (self.live), its mana
+        regeneration, capped at its maximum mana. (indexes) must not hold an
+        index twice."""
+        if indexes is None:
+            indexes = self.live
+        if self.touched is not None:
+            # those at their maximum mana are unchanged
+            self.touched.update(itertools.compress(indexes, map(
+                operator.lt, map(self.mana.__getitem__, indexes),
+                map(self.max_mana.__getitem__, indexes))))
+        if len(indexes) == len(self.health):
+            # every enemy regenerates, work on the whole columns
+            self.mana = array.array(TYPECODE, map(
+                min, self.max_mana, map(operator.add, self.mana, self.mana_regen)))
+            return
+        mana, max_mana, regen = self.mana, self.max_mana, self.mana_regen
+        for i in indexes:
+            mana[i] = min(max_mana[i], mana[i] + regen[i])
+
+
+    def in_vicinity(self, pos, indexes):
+        """Returns the set of the (indexes) of the enemies which are directly
+        above, below, left or right of (pos)."""
+        row, col = pos
+        drows = map(abs, map(operator.sub, map(self.rows.__getitem__, indexes),
+                             itertools.repeat(row)))
+        dcols = map(abs, map(operator.sub, map(self.cols.__getitem__, indexes),
+                             itertools.repeat(col)))
+        return set(itertools.compress(
+            indexes, map((1).__eq__, map(operator.add, drows, dcols))))
+
+
+    def in_spell_range(self, pos, indexes):
+        """Returns the set of the (indexes) of the enemies which are on the row
+        or column of (pos), within the cast range of their spell, and have
+        enough mana to cast it."""
+        row, col = pos
+        drows = list(map(operator.sub, map(self.rows.__getitem__, indexes),
+                         itertools.repeat(row)))
+        dcols = list(map(operator.sub, map(self.cols.__getitem__, indexes),
+                         itertools.repeat(col)))
+        spells = list(map(self.spells.__getitem__, indexes))
+        aligned = map(operator.not_, map(operator.mul, drows, dcols))
+        distances = map(abs, map(operator.add, drows, dcols))
+        ranges = map(operator.attrgetter('cast_range'), spells)
+        costs = map(operator.attrgetter('mana_cost'), spells)
+        manas = map(self.mana.__getitem__, indexes)
+        return set(itertools.compress(indexes, map(all, zip(
+            aligned, map(operator.le, distances, ranges),
+            map(operator.le, costs, manas)))))
@@ -1,17 +1,33 @@
-import json
 import copy
+import array
 import os
 import itertools
 import sys
-import time
 import random
 import signal
 import curses
 import curses.textpad
-
+import hashlib
+
+import activity
+import animation
+import dunfile
+import duncache
+import enemies
+import logger
+import loot
+import pathfinding
+import planning
+import profiling
+import recording
+import savegame
+import spatial
 import treasures
+import undo
 import utils
 import globvars
+import viewport
+import visibility
 
 
 class Matrix:
@@ -94,6 +110,27 @@ class Dunmap(Matrix):
     there is a gateway position, self.gateway_pos will store that
     position. Otherwise, self.gateway_pos will be None.
 
+    Unlike a plain Matrix, a Dunmap does not keep a Python object per
+    position. Internally it is represented by two flat row-major arrays:
+    - (self.kinds): a bytearray holding the kind of each position (one of
+      Dunmap.KIND_WALKABLE, KIND_OBSTACLE, KIND_HERO, KIND_ENEMY, KIND_CHEST)
+    - (self.eids): an array of entity ids, meaningful only at positions holding
+      an actor or a treasure chest. The entity with id (eid) is
+      (self.entities[eid]). Id 0 is never used.
+    Indexing with (row, col) still returns and accepts the same objects as
+    before, so the Matrix interface keeps working.
+
+    The character representation of every position (see Dunmap.chat) is kept
+    up to date in the bytearray (self.charbuf) as cells change. When
+    (self.dirty) is a set rather than None, the positions whose character
+    changed are also added to it, for the display to redraw only those.
+    Likewise, when (self.touched_rows) is a set rather than None, the rows of
+    the positions assigned to are added to it (see undo.History).
+
+    Objects interested in the changes of a Dunmap can be added to
+    (self.listeners). A listener's method cell_changed(pos, old_kind, new_kind)
+    is called whenever the kind at a position changes.
+
     Apart from the attributes coming from Matrix, a Dunmap has one additional
     attribute: (self.gateway_pos) which indicates the position of the
     gateway. If there is no gateway, (self.gateway_pos is None).
@@ -102,69 +139,253 @@ class Dunmap(Matrix):
     WALKABLE = '.'
     OBSTACLE = '#'
 
+    KIND_WALKABLE = 0
+    KIND_OBSTACLE = 1
+    KIND_HERO = 2
+    KIND_ENEMY = 3
+    KIND_CHEST = 4
+
+    # The character of each kind, see Dunmap.chat
+    KIND_CHARS = '.#HET'
+    GATEWAY_CHAR = 'G'
+    _CHAR_CODES = KIND_CHARS.encode('ascii')
+    _GATEWAY_CODE = ord(GATEWAY_CHAR)
+    _MASK_CHARS = (WALKABLE + OBSTACLE).encode('ascii').ljust(256, b'?')
+
+    # Maps entity types to kinds. Filled in once the entity classes exist.
+    ENTITY_KINDS = {}
+
     def __init__(self, nrows, ncols):
         """Returns a Dunmap with @nrows rows and @ncols columns where every
         position is walkable. The gateway_pos of the result will be None."""
 
-        super().__init__([[self.WALKABLE for c in range(ncols)]
-                          for r in range(nrows)])
-        self.gateway_pos = None
-        
+        if nrows <= 0 or ncols <= 0:
+            raise ValueError(f'invalid dimensions: {nrows}x{ncols}')
+        self.nrows = nrows
+        self.ncols = ncols
+        self.kinds = bytearray(nrows * ncols)
+        self.eids = array.array('I', bytes(4 * nrows * ncols))
+        self.entities = [None]
+        self._entity_ids = {}
+        self.listeners = []
+        self.charbuf = bytearray(self.WALKABLE.encode() * (nrows * ncols))
+        self.dirty = None
+        self.touched_rows = None
+        self._gateway_pos = None
+
+
+    @property
+    def gateway_pos(self):
+        return self._gateway_pos
+
+
+    @gateway_pos.setter
+    def gateway_pos(self, pos):
+        old_pos, self._gateway_pos = self._gateway_pos, pos
+        for pos in (old_pos, pos):
+            if pos is not None:
+                self._update_char(pos, self.index(pos))
+
+
+    def _update_char(self, pos, i):
+        kind = self.kinds[i]
+        if ((kind == self.KIND_WALKABLE or kind == self.KIND_CHEST)
+                and pos == self._gateway_pos):
+            code = self._GATEWAY_CODE
+        else:
+            code = self._CHAR_CODES[kind]
+        if self.charbuf[i] != code:
+            self.charbuf[i] = code
+            if self.dirty is not None:
+                self.dirty.add(pos)
+
+
+    def take_dirty(self):
+        """Returns the positions changed since the last call and starts tracking
+        the changes anew."""
+        dirty, self.dirty = self.dirty, set()
+        return dirty or ()
+
+
+    def snapshot(self):
+        """Returns the state of (self) as a dict of immutable values. The
+        entities themselves are not part of it, only their ids (see
+        Dunmap.from_snapshot)."""
+        return {'dims': (self.nrows, self.ncols),
+                'kinds': bytes(self.kinds),
+                'eids': self.eids.tobytes(),
+                'charbuf': bytes(self.charbuf),
+                'gateway_pos': self._gateway_pos}
+
+
+    @classmethod
+    def from_snapshot(cls, snapshot, entities):
+        """Returns a Dunmap in the state (snapshot), see Dunmap.snapshot.
+        (entities[eid]) must be the entity to put wherever the entity with id
+        (eid) was when the snapshot was taken. The state is bulk-copied, nothing
+        is replayed."""
+        dunmap = cls.__new__(cls)
+        dunmap.nrows, dunmap.ncols = snapshot['dims']
+        dunmap.kinds = bytearray(snapshot['kinds'])
+        dunmap.eids = array.array('I')
+        dunmap.eids.frombytes(snapshot['eids'])
+        dunmap.charbuf = bytearray(snapshot['charbuf'])
+        dunmap.entities = list(entities)
+        dunmap._entity_ids = {entity: eid for eid, entity in enumerate(entities)
+                              if entity is not None}
+        dunmap.listeners = []
+        dunmap.dirty = None
+        dunmap.touched_rows = None
+        dunmap._gateway_pos = snapshot['gateway_pos']
+        return dunmap
+
+
+    def index(self, pos):
+        """Returns the index of (pos) in the flat arrays."""
+        row, col = pos
+        return row * self.ncols + col
+
+    
+    def __getitem__(self, pos):
+        row, col = pos
+        i = row * self.ncols + col
+        kind = self.kinds[i]
+        if kind == self.KIND_WALKABLE:
+            return self.WALKABLE
+        elif kind == self.KIND_OBSTACLE:
+            return self.OBSTACLE
+        return self.entities[self.eids[i]]
+
+    
+    def __setitem__(self, pos, value):
+        row, col = pos
+        i = row * self.ncols + col
+        if value is self.WALKABLE:
+            kind = self.KIND_WALKABLE
+        elif value is self.OBSTACLE:
+            kind = self.KIND_OBSTACLE
+        else:
+            kind = self.ENTITY_KINDS[type(value)]
+            self.eids[i] = self.entity_id(value)
+        self._set_kind(pos, i, kind)
+
+
+    def _set_kind(self, pos, i, kind):
+        old_kind = self.kinds[i]
+        self.kinds[i] = kind
+        if self.touched_rows is not None:
+            self.touched_rows.add(pos[0])
+        if old_kind != kind:
+            self._update_char(tuple(pos), i)
+            for listener in self.listeners:
+                listener.cell_changed(pos, old_kind, kind)
+
+
+    def entity_id(self, entity):
+        """Returns the id of (entity), registering it if it is new."""
+        eid = self._entity_ids.get(entity)
+        if eid is None:
+            eid = self._entity_ids[entity] = len(self.entities)
+            self.entities.append(entity)
+        return eid
+
+
+    def kind(self, pos):
+        row, col = pos
+        return self.kinds[row * self.ncols + col]
+
+
+    @property
+    def rows(self):
+        # returns an iterator of lists representing @self's rows
+        return ([self[row, col] for col in range(self.ncols)]
+                for row in range(self.nrows))
+
     
     def is_walkable(self, pos):
-        return self[pos] is self.WALKABLE
+        row, col = pos
+        return self.kinds[row * self.ncols + col] == self.KIND_WALKABLE
 
     
     def make_walkable(self, pos):
-        self[pos] = self.WALKABLE
+        row, col = pos
+        self._set_kind(pos, row * self.ncols + col, self.KIND_WALKABLE)
 
         
     def is_obstacle(self, pos):
-        return self[pos] is self.OBSTACLE
+        row, col = pos
+        return self.kinds[row * self.ncols + col] == self.KIND_OBSTACLE
 
     
     def can_move_to(self, pos):
         """Returns True if pos is within @self and if there is nothing at that
         position that prevents you from moving there."""
-        
-        return (self.pos_is_valid(pos)
-                and (isinstance(self[pos], treasures.TreasureChest)
-                     or self[pos] is self.WALKABLE))
+
+        row, col = pos
+        if not (0 <= row < self.nrows and 0 <= col < self.ncols):
+            return False
+        kind = self.kinds[row * self.ncols + col]
+        return kind == self.KIND_WALKABLE or kind == self.KIND_CHEST
+
+
+    def set_obstacles(self, posns):
+        """Makes every position in (posns) an obstacle."""
+        if self.listeners:
+            for pos in posns:
+                self[pos] = self.OBSTACLE
+            return
+        kinds, ncols, obstacle = self.kinds, self.ncols, self.KIND_OBSTACLE
+        for pos in posns:
+            i = pos[0] * ncols + pos[1]
+            kinds[i] = obstacle
+            self._update_char(tuple(pos), i)
+
+
+    def set_obstacle_mask(self, first, mask):
+        """(mask) is a bytes object of 0s and 1s. Makes an obstacle of every
+        position (i) for which (mask[i - first]) is 1, where positions are
+        numbered left to right, top to bottom."""
+        end = first + len(mask)
+        if (self.listeners
+                or self.kinds.count(self.KIND_WALKABLE, first, end) != len(mask)):
+            ones = (i for i, bit in enumerate(mask, first) if bit)
+            self.set_obstacles(divmod(i, self.ncols) for i in ones)
+            return
+        # the region is walkable, so it can be overwritten in bulk. The mask
+        # already holds the right kinds, since KIND_OBSTACLE is 1.
+        self.kinds[first:end] = mask
+        self.charbuf[first:end] = mask.translate(self._MASK_CHARS)
+        if self._gateway_pos is not None:
+            self._update_char(self._gateway_pos, self.index(self._gateway_pos))
+
+
+    def count(self, kind):
+        """Returns the number of positions of kind (kind)."""
+        return self.kinds.count(kind)
+
+
+    def posns_of(self, kind):
+        """Returns an iterator of the positions of kind (kind), in the order left
+        to right, top to bottom."""
+        kinds, ncols, needle = self.kinds, self.ncols, bytes((kind,))
+        i = kinds.find(needle)
+        while i != -1:
+            yield divmod(i, ncols)
+            i = kinds.find(needle, i + 1)
 
     
     @property
     def chars(self):
-        """Returns a Matrix, which is the character representation of (self)."""
-        return [''.join(self.chat(row, col) for col in range(self.ncols))
-                for row in range(self.nrows)]
+        """Returns a list of strings, the character representation of (self)'s
+        rows."""
+        ncols, charbuf = self.ncols, self.charbuf
+        return [charbuf[r * ncols:(r + 1) * ncols].decode()
+                for r in range(self.nrows)]
 
 
     def chat(self, r, c):
-        """Returns the character code of the entity at the position (pos)."""
-
-        WALKABLE = '.'
-        OBSTACLE = '#'
-        GATEWAY = 'G'
-        HERO = 'H'
-        ENEMY = 'E'
-        TREASURE_CHEST = 'T'
-
-        pos = (r, c)
-        entity = self[pos]
-        if self.is_obstacle(pos):
-            return OBSTACLE                
-        elif type(entity) is Hero:
-            return HERO
-        elif type(entity) is Enemy:
-            return ENEMY
-        elif pos == self.gateway_pos:
-            return GATEWAY
-        elif self.is_walkable(pos):
-            return WALKABLE
-        elif type(entity) is treasures.TreasureChest:
-            return TREASURE_CHEST
-        else:
-            raise ValueError(f'invalid entity at {pos}: {entity}')
+        """Returns the character code of the entity at the position (r, c)."""
+        return chr(self.charbuf[r * self.ncols + c])
 
     
 class Actor:
@@ -180,6 +401,8 @@ class Actor:
     * spell
     * pos: the coordinates (row, column) of the actor in the dunmap
     """
+
+    __slots__ = ()
     
     @property
     def is_alive(self):
@@ -202,16 +425,109 @@ class Actor:
 
         
 class Hero(Actor):
-    pass
+    __slots__ = ('health', 'max_health', 'mana', 'max_mana', 'mana_regen',
+                 'fist_damage', 'weapon', 'spell', 'pos')
+
+    def __init__(self, max_health, max_mana, mana_regen, fist_damage, pos,
+                 weapon=treasures.default_weapon, spell=treasures.default_spell):
+        """The hero starts at full health and mana."""
+        self.health = self.max_health = max_health
+        self.mana = self.max_mana = max_mana
+        self.mana_regen = mana_regen
+        self.fist_damage = fist_damage
+        self.weapon = weapon
+        self.spell = spell
+        self.pos = tuple(pos)
+
+
+    def state(self):
+        """Returns the values of all of (self)'s attributes, see
+        Hero.from_state."""
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+
+    @classmethod
+    def from_state(cls, state):
+        hero = cls.__new__(cls)
+        for name, value in zip(cls.__slots__, state):
+            setattr(hero, name, value)
+        return hero
+
+
+def _column_property(name, doc=None):
+    """A property reading and writing the column (name) of an EnemyTable, at the
+    index of the view."""
+    
+    def fget(self):
+        return getattr(self.table, name)[self.index]
+
+    def fset(self, value):
+        table = self.table
+        getattr(table, name)[self.index] = value
+        if table.touched is not None:
+            table.touched.add(self.index)
+
+    return property(fget, fset, doc=doc)
 
 
 class Enemy(Actor):
     """
+    A view of the enemy with index (self.index) in the enemies.EnemyTable
+    (self.table). All the actor attributes are read from and written to the
+    table's columns.
+
     Additional attributes:
     - last_seen: the position the hero was last seen in.
     - behavior
     """
 
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    health = _column_property('health')
+    max_health = _column_property('max_health')
+    mana = _column_property('mana')
+    max_mana = _column_property('max_mana')
+    mana_regen = _column_property('mana_regen')
+    fist_damage = _column_property('fist_damage')
+    weapon = _column_property('weapons')
+    spell = _column_property('spells')
+
+    @property
+    def pos(self):
+        return (self.table.rows[self.index], self.table.cols[self.index])
+
+    @pos.setter
+    def pos(self, pos):
+        table = self.table
+        table.rows[self.index], table.cols[self.index] = pos
+        if table.touched is not None:
+            table.touched.add(self.index)
+
+    @property
+    def last_seen(self):
+        row = self.table.last_seen_rows[self.index]
+        if row == enemies.NOWHERE:
+            return None
+        return (row, self.table.last_seen_cols[self.index])
+
+    @last_seen.setter
+    def last_seen(self, pos):
+        if pos is None:
+            pos = (enemies.NOWHERE, enemies.NOWHERE)
+        table = self.table
+        index = self.index
+        table.last_seen_rows[index], table.last_seen_cols[index] = pos
+        if table.touched is not None:
+            table.touched.add(index)
+
+    @property
+    def behavior(self):
+        return enemies.BEHAVIORS[self.table.behaviors[self.index]]
+
     @property
     def hero_direction(self):
         if self.last_seen is None:
@@ -219,10 +535,25 @@ class Enemy(Actor):
         return utils.relative_direction(self.pos, self.last_seen)
 
 
+    @property
+    def approach_direction(self):
+        """The direction of a step towards (self.last_seen), even when it is not
+        on the same row or column as (self)."""
+        if self.last_seen is None:
+            return None
+        return utils.approach_direction(self.pos, self.last_seen)
+
+
+Dunmap.ENTITY_KINDS.update({Hero: Dunmap.KIND_HERO,
+                            Enemy: Dunmap.KIND_ENEMY,
+                            treasures.TreasureChest: Dunmap.KIND_CHEST})
+
+
 class Game:
     WON = object()
     KILLED = object()
     QUIT = object()
+    ONGOING = object()
 
     class Exc(Exception):
         pass
@@ -230,70 +561,261 @@ class Game:
     ########################################
     # constructor
     
-    def __init__(self, filename):
-        with open(filename) as f:
-            dct = json.load(f)
-    
-        self.validate(dct)
-
-        # needed for eventual state resets (see Game.reset())
-        self.prows, self.pcols = dct['dims']
-        self.phero = dct['hero']
-        self.penemies = dct['enemies']
-        self.ptreasures = dct['treasures']
-        self.pobposns = dct['obstacles']
-        self.ptcposns = dct['treasure-chests']
-        self.pgatepos = dct['gateway']
+    def __init__(self, filename, headless=False, fov_radius=None, animate=True,
+                 cache=True, seed=None, record=None, plan_workers=0):
+        """When (headless) is True the game never touches curses: animations
+        are skipped and the game is meant to be driven through (self.step).
+        When (animate) is False, animations are skipped without being played
+        headlessly (see animation.Scheduler).
+
+        By default enemies only see along their row and column. When
+        (fov_radius) is given, they see the hero anywhere within their field of
+        view of that radius (see visibility.Visibility.fov).
+
+        When (cache) is True, the compiled dungeon cache is used (see
+        duncache).
+
+        Everything random in the game (treasure chests, rabid enemies) is drawn
+        from (self.rng), seeded with (seed) on every reset. By default a seed is
+        picked at random. When (record) is a path, Game.play records the game
+        to that file (see recording).
+
+        (self.history) is the undo.History recording the turns, or None when
+        turns are not recorded. Game.play starts recording.
+
+        The enemies plan their turns in (plan_workers) worker processes, or in
+        the game's process when it is 0 (see planning.Planner)."""
+        
+        self.filename = filename
+        self.headless = headless
+        self.history = None
+        self.seed = random.randrange(2**32) if seed is None else seed
+        self.rng = random.Random(self.seed)
+        self.record_path = record
+        self.recorder = None
+        # the profiling.Profiler timing (self), None when it is not timed
+        self.profiler = None
+        self.fov_radius = fov_radius
+        self.planner = planning.Planner(plan_workers)
+        self.animations = (animation.Scheduler() if animate and not headless
+                           else None)
+        
+        # the initial state, needed for eventual state resets (see
+        # Game.reset()). Building it is skipped when the dungeon file was
+        # compiled before (see duncache).
+        self.initial = duncache.get(filename) if cache else None
+        if self.initial is None:
+            self.dungeon = dunfile.load(filename)
+            try:
+                self.validate(self.dungeon)
+                self.build()
+            finally:
+                # a binary dungeon maps its file, which is only read by build
+                self.dungeon.close()
+                self.dungeon = None
+            self.initial = self.snapshot()
+            if cache:
+                duncache.put(filename, self.initial)
 
         self.reset()
 
         
-    def validate(self, dct):
+    def validate(self, dungeon):
         # hero, enemies, dunmap, treasures
         pass
 
     
-    def reset(self):
+    def reset(self, seed=None):
         """Returns (self) back to it's initial state. The state is represented
-        by the attributes {hero enemies dunmap}."""
+        by the attributes {hero enemy_table dunmap rng}. The random number
+        generator is seeded anew with (seed), by default the seed (self) was
+        created with. The reset can be undone (see Game.record)."""
+        self.record()
+        self.restore(self.initial)
+        if seed is not None:
+            self.seed = seed
+        self.rng.seed(self.seed)
+
+
+    def build(self):
+        """Builds the initial state from (self.dungeon), entity by entity."""
         
-        self.dunmap = Dunmap(self.prows, self.pcols)
+        dungeon = self.dungeon
+        self.dunmap = Dunmap(*dungeon.dims)
+        dungeon.place_obstacles(self.dunmap)
         
         # Initialize the hero
-        hero, phero = Hero(), self.phero
-        hero.health = hero.max_health = phero['max_health']
-        hero.mana = hero.max_mana = phero['max_mana']
-        hero.mana_regen = phero['mana_regen']
-        hero.fist_damage = phero['fist_damage']
-        hero.weapon, hero.spell = treasures.defaults
-        hero.pos = phero['pos']
-        self.hero = hero
+        phero = dungeon.hero
+        self.hero = hero = Hero(phero['max_health'], phero['max_mana'],
+                                phero['mana_regen'], phero['fist_damage'],
+                                phero['pos'])
         self.dunmap[hero.pos] = hero
 
         # Initialize the enemies
-        self.enemies = []
-        for penemy in self.penemies:
-            enemy = Enemy()
-            enemy.health = enemy.max_health = penemy['max_health']
-            enemy.mana = enemy.max_mana = penemy['max_mana']
-            enemy.mana_regen = penemy['mana_regen']
-            enemy.fist_damage = penemy['fist_damage']
-            enemy.weapon, enemy.spell = treasures.defaults
-            enemy.behavior = penemy['behavior']
-            enemy.pos = penemy['pos']
-            enemy.last_seen = None
-            self.enemies.append(enemy)
-            self.dunmap[enemy.pos] = enemy
+        self.enemy_table = table = enemies.EnemyTable()
+        for *stats, pos, behavior in dungeon.enemies():
+            index = table.add(*stats, pos, behavior, *treasures.defaults)
+            enemy = Enemy(table, index)
+            table.views.append(enemy)
+            self.dunmap[pos] = enemy
+
+        # chests have no state of their own, so a single one is shared by all
+        # the positions drawing from the same loot table
+        tables = loot.compile_tables(dungeon.treasures, dungeon.loot_tables)
+        chests = {}
+        for tcpos, table_id in dungeon.chests():
+            chest = chests.get(table_id)
+            if chest is None:
+                if table_id not in tables:
+                    raise ValueError(f'chest at {tcpos}: unknown loot table: '
+                                     f'{table_id}')
+                chest = chests[table_id] = treasures.TreasureChest(
+                    tables[table_id])
+            self.dunmap[tcpos] = chest
+        self.chests = list(chests.values())
+
+        self.dunmap.gateway_pos = tuple(dungeon.gateway)
+
+        self.visibility = visibility.Visibility(self.dunmap)
+        self.flow_fields = pathfinding.FlowFields(self.dunmap)
+        self.activity = activity.ActivityScheduler(table, self.fov_radius)
+        self._actor_index = None
 
-        treasure_col = [treasures.parse_dict(dct) for dct in self.ptreasures]
-            
-        for tcpos in self.ptcposns:
-            self.dunmap[tcpos] = treasures.TreasureChest(treasure_col)
+    ########################################
+    # snapshots
+
+    # how Game.snapshot describes the entities which are not enemies (enemies
+    # are described by their index, the chest (self.chests[k]) by
+    # (_CHEST_ENTITY - k))
+    _NO_ENTITY, _HERO_ENTITY, _CHEST_ENTITY = -1, -2, -3
+
+    def snapshot(self):
+        """Returns the state of (self) as a dict of immutable values, which can
+        be saved (see savegame) and given to Game.restore."""
+        self.activity.settle()
+        return {'dunmap': self.dunmap.snapshot(),
+                'entities': self.describe(self.dunmap.entities).tobytes(),
+                'hero': self.hero.state(),
+                'enemies': self.enemy_table.snapshot(),
+                'loot': tuple(chest.table for chest in self.chests),
+                'rng': self.rng.getstate()}
+
+
+    def describe(self, entities):
+        """Returns the array of the descriptions of (entities), entities of the
+        dunmap, as in the 'entities' entry of a snapshot."""
+
+        chest_entities = {chest: self._CHEST_ENTITY - k
+                          for k, chest in enumerate(self.chests)}
+
+        def describe(entity):
+            if entity is None:
+                return self._NO_ENTITY
+            elif entity is self.hero:
+                return self._HERO_ENTITY
+            elif type(entity) is treasures.TreasureChest:
+                return chest_entities[entity]
+            return entity.index
+
+        return array.array('q', map(describe, entities))
+
+
+    def restore(self, snapshot):
+        """Puts (self) in the state (snapshot), see Game.snapshot. The enemy
+        table is restored in place and keeps its views."""
+
+        table = getattr(self, 'enemy_table', None)
+        if table is None:
+            table = self.enemy_table = enemies.EnemyTable()
+        table.restore(snapshot['enemies'])
+        views = table.views
+        del views[len(table):]
+        views.extend(Enemy(table, index) for index in range(len(views), len(table)))
+
+        self.hero = Hero.from_state(snapshot['hero'])
+        self.chests = [treasures.TreasureChest(table)
+                       for table in snapshot['loot']]
+        others = {self._NO_ENTITY: None, self._HERO_ENTITY: self.hero}
+        others.update((self._CHEST_ENTITY - k, chest)
+                      for k, chest in enumerate(self.chests))
+        descriptions = array.array('q')
+        descriptions.frombytes(snapshot['entities'])
+        entities = [views[d] if d >= 0 else others[d] for d in descriptions]
+        self.dunmap = Dunmap.from_snapshot(snapshot['dunmap'], entities)
+        self.rng.setstate(snapshot['rng'])
+
+        self.visibility = visibility.Visibility(self.dunmap)
+        self.flow_fields = pathfinding.FlowFields(self.dunmap)
+        self.activity = activity.ActivityScheduler(table, self.fov_radius)
+        self._actor_index = None
+
+        if self.animations is not None:
+            self.animations.clear()
 
-        for obpos in self.pobposns:
-            self.dunmap[obpos] = self.dunmap.OBSTACLE
+        
+    def digest(self):
+        """Returns a hash of the state of (self), equal for equal states
+        whatever the identity of the objects making them."""
+        self.activity.settle()
+        h = hashlib.sha1()
+        dunmap = self.dunmap
+        h.update(repr((dunmap.nrows, dunmap.ncols, dunmap.gateway_pos,
+                       self.hero.state()[:6], str(self.hero.weapon),
+                       str(self.hero.spell), tuple(self.hero.pos),
+                       self.rng.getstate())).encode())
+        for layer in (dunmap.kinds, dunmap.charbuf, dunmap.eids.tobytes()):
+            h.update(layer)
+        table = self.enemy_table
+        for name in enemies.ARRAY_COLUMNS:
+            h.update(getattr(table, name).tobytes())
+        h.update(bytes(table.behaviors))
+        h.update(repr([(str(w), str(s)) for w, s in zip(table.weapons, table.spells)]
+                      ).encode())
+        return h.digest()
+
+
+    def save(self, path):
+        """Saves the current state to the file (path), see savegame."""
+        savegame.save(path, self.filename, self.snapshot())
+
+
+    def load(self, path):
+        """Puts (self) in the state saved in the file (path), see Game.save.
+        Raises ValueError if the game was saved on another dungeon."""
+        dungeon, snapshot = savegame.load(path)
+        if dungeon != os.path.abspath(self.filename):
+            raise ValueError(f'{path}: saved on another dungeon ({dungeon})')
+        self.record()
+        self.restore(snapshot)
+
+
+    def record(self):
+        """Records the current state in (self.history), if there is one, before
+        it changes."""
+        if self.history is not None:
+            self.history.record()
 
-        self.dunmap.gateway_pos = tuple(self.pgatepos)
+
+    @property
+    def actor_index(self):
+        """The spatial.SpatialHash of the actors on the dunmap. It is built on
+        first use, then kept up to date by Game.actor_move and Game.actor_attack
+        until the state is restored."""
+        if self._actor_index is None:
+            index = self._actor_index = spatial.SpatialHash()
+            if self.hero.is_alive:
+                index.add(self.hero, self.hero.pos)
+            for enemy in self.enemy_table.views:
+                if enemy.is_alive:
+                    index.add(enemy, enemy.pos)
+        return self._actor_index
+
+        
+    @property
+    def enemies(self):
+        """The list of the enemies which were alive at the end of the last hero
+        turn."""
+        return [self.enemy_table.views[i] for i in self.enemy_table.live]
 
         
     ########################################
@@ -312,86 +834,85 @@ class Game:
     ########################################
     # enemy turn
     
-    def enemy_friendly_turn(self, enemy):
-        hero_pos = self.find_hero(enemy)
-        if hero_pos is None:
-            self.move_to_last_seen(enemy)
-        else:
-            enemy.last_seen = hero_pos
-            self.move_to_last_seen(enemy)
+    def enemy_friendly_turn(self, enemy, plan):
+        seen, direction = plan
+        if seen:
+            enemy.last_seen = self.hero.pos
+        self.move_to_last_seen(enemy, direction)
 
 
-    def enemy_aggressive_turn(self, enemy):
-        hero_pos  = self.find_hero(enemy)
-        if hero_pos is None:
-            self.move_to_last_seen(enemy)
+    def enemy_aggressive_turn(self, enemy, plan):
+        seen, direction = plan
+        if not seen:
+            self.move_to_last_seen(enemy, direction)
         else:
-            enemy.last_seen = hero_pos
+            enemy.last_seen = self.hero.pos
             if self.hero_in_vicinity(enemy):
                 self.enemy_near_attack(enemy)
             else:
                 if not self.enemy_far_attack(enemy):
-                    self.move_to_last_seen(enemy)
+                    self.move_to_last_seen(enemy, direction)
 
 
-    def enemy_rabid_turn(self, enemy):
-        hero_pos = self.find_hero(enemy)
-        if hero_pos is None:
+    def enemy_rabid_turn(self, enemy, plan):
+        seen, direction = plan
+        if not seen:
             if enemy.last_seen is None:
-                direction = random.choice(('up', 'down', 'left', 'right'))
+                direction = self.rng.choice(('up', 'down', 'left', 'right'))
                 self.actor_move(enemy, direction)
             else:
-                self.move_to_last_seen(enemy)
+                self.move_to_last_seen(enemy, direction)
         else:
-            enemy.last_seen = hero_pos
+            enemy.last_seen = self.hero.pos
             if self.hero_in_vicinity(enemy):
                 self.enemy_near_attack(enemy)
             else:
                 if not self.enemy_far_attack(enemy):
-                    self.move_to_last_seen(enemy)
+                    self.move_to_last_seen(enemy, direction)
 
 
     def find_hero(self, enemy):
         """Returns the the hero position if he can be seen by (enemy), otherwise
         None."""
 
-        def try_direction(direction):
-            """Looks in (direction) for the hero. Returns None if (enemy) can't
-            see him in that direction."""
-
-            for pos in self.dunmap.relative_posns(enemy.pos, direction):
-                entity = self.dunmap[pos]
-                if type(entity) is Hero:
-                    return pos
-                elif entity is not self.dunmap.WALKABLE:
-                    # something blocks @self's view
-                    return None
+        hero_pos = self.hero.pos
+        if self.dunmap[hero_pos] is not self.hero:
+            # the hero is dead and someone else may stand in his place
             return None
+        if planning.sees(self.visibility, self.fov_radius, enemy.pos, hero_pos):
+            return hero_pos
+        return None
 
-        for direction in ('up', 'down', 'left', 'right'):
-            pos = try_direction(direction)
-            if pos is not None:
-                return pos
 
-        return None
+    def plan_enemy(self, enemy):
+        """Returns the plan of (enemy) for its turn, see planning. The step
+        towards its target follows a shortest path around the obstacles; the
+        enemies chasing the same position share the search for the paths (see
+        pathfinding.FlowFields)."""
+        seen = self.find_hero(enemy) is not None
+        return planning.plan(enemy.pos, enemy.last_seen, self.hero.pos, seen,
+                             self.flow_fields)
 
 
-    def move_to_last_seen(self, enemy):
+    def move_to_last_seen(self, enemy, direction):
+        """Moves (enemy) a step in (direction), its planned step towards where
+        it last saw the hero (see Game.plan_enemy), and forgets that position
+        once reached."""
         if enemy.last_seen is None:
             return
 
         if enemy.pos == enemy.last_seen:
             enemy.last_seen = None
-        else:
-            self.actor_move(enemy, enemy.hero_direction)
+            return
+        if direction is not None:
+            self.actor_move(enemy, direction)
 
 
     def hero_in_vicinity(self, enemy):
         """Returns True if hero is directly above, below, to the right or to the
-        left of (enemy)."""
-        pos_row, pos_col = enemy.pos
-        hero_row, hero_col = self.hero.pos
-        return abs(pos_row - hero_row) <= 1 and abs(pos_col - hero_col) <= 1
+        left of (enemy). Only valid during the enemy phase, for which the test
+        is done for all the awake enemies at once (see Game.enemy_phase)."""
+        return enemy.index in self._near_hero
 
 
     def enemy_near_attack(self, enemy):
@@ -417,20 +938,21 @@ class Game:
          possible to cast a spell that will damage the hero, this function casts
          the spell and returns True. Otherwise, it returns False."""
 
-        enemy_row, enemy_col = enemy.pos
-        hero_row, hero_col = enemy.last_seen
-        distance = abs((enemy_row - hero_row) + (enemy_col - hero_col))
-        if (distance <= enemy.spell.cast_range and
-                enemy.spell.mana_cost <= enemy.mana):
+        # the range and mana tests are done for all the awake enemies at the
+        # start of the enemy phase, while the hero's position is fixed
+        if enemy.index in self._hero_in_range:
             self.actor_attack(enemy, by='spell', direction=enemy.hero_direction)
             return True
         return False
 
     
-    def enemy_turn(self, enemy):
-        behavior = getattr(self, f'enemy_{enemy.behavior}_turn')
-        behavior(enemy)
-        enemy.add_mana(enemy.mana_regen)
+    def enemy_turn(self, enemy, plan):
+        """Plays the behavior of (enemy), following (plan) (see
+        Game.plan_enemy). Mana regeneration is not part of it, it is applied to
+        all the enemies at once at the end of the enemy phase."""
+        behaviors = (self.enemy_friendly_turn, self.enemy_aggressive_turn,
+                     self.enemy_rabid_turn)
+        behaviors[enemy.table.behaviors[enemy.index]](enemy, plan)
         
     ########################################
     # general actor functions
@@ -441,10 +963,12 @@ class Game:
             return
         entity = self.dunmap[new_pos]        
         if type(entity) is treasures.TreasureChest: 
-            entity.open().give_to_actor(actor)
+            entity.open(self.rng).give_to_actor(actor)
             self.dunmap.make_walkable(new_pos)
         self.dunmap.make_walkable(actor.pos)
         self.dunmap[new_pos] = actor
+        if self._actor_index is not None:
+            self._actor_index.move(actor, actor.pos, new_pos)
         actor.pos = new_pos
 
 
@@ -455,41 +979,66 @@ class Game:
         if by not in {'weapon', 'spell', 'fist'}:
             raise ValueError(f'Invalid attack method: {by}')
         
-        victim = None # needed later to clean up if dead
+        victims = [] # needed later to clean up the dead
         
         if by == 'spell':
             spell = actor.spell
             if actor.mana < spell.mana_cost:
                 return
             actor.reduce_mana(spell.mana_cost)
-            anim_posns = []
-            for pos in itertools.islice(self.dunmap.relative_posns(actor.pos, direction), spell.cast_range):
-                anim_posns.append(pos)
-                entity = self.dunmap[pos]
+            hit_pos = self.visibility.nearest(actor.pos, direction)
+            reach = (None if hit_pos is None else
+                     abs(hit_pos[0] - actor.pos[0]) + abs(hit_pos[1] - actor.pos[1]))
+            if reach is not None and reach <= spell.cast_range:
+                entity = self.dunmap[hit_pos]
                 if isinstance(entity, Actor):
-                    victim = entity
-                    victim.damage(spell.damage)
-                    self.animate_spell(direction, anim_posns, end='hit-actor')
-                    break
-                elif entity is not self.dunmap.WALKABLE:
-                    self.animate_spell(direction, anim_posns, end='hit-inanimate')
-                    break
+                    victims.append(entity)
+                    end = 'hit-actor'
+                else:
+                    end = 'hit-inanimate'
             else:
-                self.animate_spell(direction, anim_posns, end='evaporate')
+                reach, end = spell.cast_range, 'evaporate'
+            if isinstance(spell, treasures.AreaSpell):
+                center = self.spell_landing(actor.pos, direction, reach)
+                victims = [a for a in self.actor_index.in_radius(center, spell.radius)
+                           if a is not actor]
+                end = 'burst'
+            for victim in victims:
+                victim.damage(spell.damage)
+            if self.animations is not None:
+                anim_posns = list(itertools.islice(
+                    self.dunmap.relative_posns(actor.pos, direction), reach))
+                self.animate_spell(direction, anim_posns, end=end,
+                                   hits=[victim.pos for victim in victims])
         else:
             # by is in {'weapon', 'fist'}
             damage = actor.weapon.damage if by == 'weapon' else actor.fist_damage
-            victim_pos = next(self.dunmap.relative_posns(actor.pos, direction), None)            
+            victim_pos = next(self.dunmap.relative_posns(actor.pos, direction),
+                              None)
             if victim_pos is None:
-                return            
+                return
             victim = self.dunmap[victim_pos]
             if not isinstance(victim, Actor):
                 return            
             victim.damage(damage)
+            victims.append(victim)
             self.animate_melee(victim_pos)
             
-        if victim is not None and not victim.is_alive:
-            self.dunmap.make_walkable(victim.pos)
+        for victim in victims:
+            if not victim.is_alive:
+                self.dunmap.make_walkable(victim.pos)
+                if self._actor_index is not None:
+                    self._actor_index.remove(victim, victim.pos)
+                if isinstance(victim, Enemy):
+                    self.activity.enemy_killed(victim.index)
+
+
+    def spell_landing(self, pos, direction, reach):
+        """Returns the position (reach) steps away from (pos) in (direction),
+        or the last position of the dunmap on the way."""
+        row, col = utils.move_pos((0, 0), direction)
+        return (min(max(pos[0] + row * reach, 0), self.dunmap.nrows - 1),
+                min(max(pos[1] + col * reach, 0), self.dunmap.ncols - 1))
 
     ########################################
     # command reader
@@ -523,7 +1072,7 @@ class Game:
     def init_screens(self):
         """Assumes curses has already been initialized at this
         point. Initializes the attributes (self.hero_scr, self.dunmap_scr,
-        self.console_scr)"""
+        self.console_scr, self.viewport)"""
         
         globvars.stdscr.clear()
 
@@ -532,14 +1081,22 @@ class Game:
         self.hero_scr = curses.newwin(5, curses.COLS, 0, 0)
         self.hero_scr.keypad(True)
 
+        # the dunmap gets the lines left by the other screens. The last column is
+        # kept free, curses cannot write to the bottom right corner of a window.
         row = self.hero_scr.getbegyx()[0] + self.hero_scr.getmaxyx()[0]
-        self.dunmap_scr = curses.newwin(self.dunmap.nrows, curses.COLS, row, 0)
+        self.viewport = viewport.Viewport(
+            self.dunmap.nrows, self.dunmap.ncols,
+            curses.LINES - row - 1, curses.COLS - 1)
+        self.dunmap_scr = curses.newwin(self.viewport.height, curses.COLS, row, 0)
         self.dunmap_scr.keypad(True)
 
         row = self.dunmap_scr.getbegyx()[0] + self.dunmap_scr.getmaxyx()[0]
         self.console_scr = curses.newwin(1, curses.COLS, row, 0)
         self.console_scr.keypad(True)
 
+        # the new screens are empty, the next draw must be a full one
+        self.dunmap.dirty = None
+
 
     def deinit_screens(self):        
         for scr in (self.hero_scr, self.dunmap_scr, self.console_scr):
@@ -552,54 +1109,86 @@ class Game:
     
     def draw(self):
         """Assumes the screens have been initialized. Updates the screens'
-        contents to reflect (self)'s state."""
-
-        for scr in (self.hero_scr, self.dunmap_scr, self.console_scr):
-            scr.clear()
-            
-        self.hero_scr.addstr(0, 0, f'health: {self.hero.health}')
-        self.hero_scr.addstr(1, 0, f'mana: {self.hero.mana}')
-        self.hero_scr.addstr(2, 0, f'weapon: {self.hero.weapon}')
-        self.hero_scr.addstr(3, 0, f'spell: {self.hero.spell}')
-        self.hero_scr.noutrefresh()
-        
-        for i, row in enumerate(self.dunmap.chars):
-            self.dunmap_scr.addstr(i, 0, row)
+        contents to reflect (self)'s state.
+
+        Only the part of the dunmap inside (self.viewport), which follows the
+        hero, is shown. The first draw of a dunmap, and every draw after the
+        viewport moved, writes all of that part and (re)starts the dunmap's
+        change tracking (see Dunmap.dirty). Other draws only write the cells
+        which changed since the previous draw. The hero screen is only
+        rewritten when the hero's stats changed."""
+
+        dunmap, viewport = self.dunmap, self.viewport
+        moved = viewport.follow(self.hero.pos)
+        if dunmap.dirty is None:
+            for scr in (self.hero_scr, self.console_scr):
+                scr.erase()
+            self._drawn_stats = None
+            self.console_scr.noutrefresh()
+            moved = True
+        if moved:
+            self.dunmap_scr.erase()
+            for i, row in enumerate(viewport.rows(dunmap)):
+                self.dunmap_scr.addstr(i, 0, row)
+            dunmap.dirty = set()
+        else:
+            for r, c in dunmap.take_dirty():
+                screen_pos = viewport.to_screen(r, c)
+                if screen_pos is not None:
+                    self.dunmap_scr.addstr(*screen_pos, dunmap.chat(r, c))
         self.dunmap_scr.noutrefresh()
 
-        self.console_scr.clear()
+        stats = (f'health: {self.hero.health}',
+                 f'mana: {self.hero.mana}',
+                 f'weapon: {self.hero.weapon}',
+                 f'spell: {self.hero.spell}')
+        if stats != self._drawn_stats:
+            for i, line in enumerate(stats):
+                self.hero_scr.move(i, 0)
+                self.hero_scr.clrtoeol()
+                self.hero_scr.addstr(i, 0, line)
+            self.hero_scr.noutrefresh()
+            self._drawn_stats = stats
         
         curses.doupdate()
+        self.play_animations()
     
         
-    def animate_spell(self, direction, posns, end):
-        """(end) must be in {'hit-actor', 'hit-inanimate', 'evaporate'}. All
-        (posns) until the last one must be walkable."""
+    def animate_spell(self, direction, posns, end, hits=()):
+        """(end) must be in {'hit-actor', 'hit-inanimate', 'evaporate',
+        'burst'}. All (posns) until the last one must be walkable. (hits) are
+        the positions of the actors a burst hit, shown in a last frame. The
+        animation is queued, it is played by the next Game.draw."""
 
         HIT = '*'
+
+        if self.animations is None:
+            return
         
         symbol = {'up': '^', 'down': 'v', 'left': '<', 'right': '>'}[direction]
-        for r, c in posns[:-1]:
-            self._flash(r, c, symbol)
-            
-        r, c = posns[-1]
-        endsym = HIT if end == 'hit-actor' else symbol
-        self._flash(r, c, endsym)
-
-
-    def _flash(self, r, c, symbol):
-        SECS = 0.075
-        oldch = self.dunmap.chat(r, c)
-        self.dunmap_scr.addstr(r, c, symbol)
-        self.dunmap_scr.refresh()
-        time.sleep(SECS)
-        self.dunmap_scr.addstr(r, c, oldch)
-        self.dunmap_scr.refresh()
+        frames = [[(r, c, symbol)] for r, c in posns[:-1]]
+        if posns:
+            r, c = posns[-1]
+            endsym = HIT if end in ('hit-actor', 'burst') else symbol
+            frames.append([(r, c, endsym)])
+        if end == 'burst' and hits:
+            frames.append([(r, c, HIT) for r, c in hits])
+        self.animations.add(frames)
 
         
     def animate_melee(self, pos):
         HIT = '*'
-        self._flash(*pos, HIT)
+        if self.animations is None:
+            return
+        r, c = pos
+        self.animations.add([[(r, c, HIT)]])
+
+
+    def play_animations(self):
+        """Plays the queued animations on top of the dunmap screen."""
+        if self.animations is not None:
+            self.animations.play(self.dunmap_scr, self.dunmap.chat,
+                                 self.viewport.to_screen)
         
     ########################################
     # console
@@ -608,13 +1197,112 @@ class Game:
         """Handles console commands. Gives feedback to the main loop about how
         to continue."""
         cmd = self.read_console()
-        utils.log(f'the command is "{cmd}"')
+        logger.info(f'the command is "{cmd}"')
+        # the commands with arguments are told apart by their first word
+        words = cmd.split()
+        name = words[0] if words else ''
         if cmd == 'q':
             return 'quit'
         elif cmd == 'r':
             self.reset()
+            self.note(recording.RESET)
+            self.draw()
+            return 'continue'
+        elif cmd in ('u', 'undo', 'redo'):
+            if self.history is not None:
+                if cmd == 'redo':
+                    self.history.redo()
+                    self.note(recording.REDO)
+                else:
+                    self.history.undo()
+                    self.note(recording.UNDO)
             self.draw()
             return 'continue'
+        elif name in ('save', 'load'):
+            self.console_save_load(words)
+            self.draw()
+            return 'continue'
+        elif name == 'anim':
+            self.console_anim(words[1:])
+            return 'continue'
+        elif name == 'stats':
+            self.console_stats(words[1:])
+            self.draw()
+            return 'continue'
+        elif cmd:
+            logger.error(f'unknown command: "{cmd}"')
+        return 'continue'
+
+
+    def console_anim(self, args):
+        """The 'anim' command: 'anim off' turns animations off, 'anim on' turns
+        them back on, 'anim <speed>' plays them (speed) times faster."""
+        if args == ['off']:
+            self.animations = None
+        elif args == ['on']:
+            self.animations = self.animations or animation.Scheduler()
+        elif len(args) == 1:
+            try:
+                speed = float(args[0])
+            except ValueError:
+                return
+            if speed > 0:
+                self.animations = self.animations or animation.Scheduler()
+                self.animations.speed = speed
+
+
+    def console_save_load(self, args):
+        """The 'save [<path>]' and 'load [<path>]' commands. The default path
+        is the name of the dungeon file with the extension .sav, in the current
+        directory. Loading can be undone."""
+        cmd, *args = args
+        if len(args) > 1:
+            return
+        elif args:
+            path = args[0]
+        else:
+            name = os.path.splitext(os.path.basename(self.filename))[0]
+            path = f'{name}.sav'
+        try:
+            if cmd == 'save':
+                self.save(path)
+            elif cmd == 'load':
+                self.load(path)
+                if self.recorder is not None:
+                    self.recorder.load(path)
+        except (OSError, ValueError) as e:
+            logger.error(f'{cmd} failed: {e}')
+
+
+    def console_stats(self, args):
+        """The 'stats' command: 'stats on' starts timing the turns (see
+        profiling), 'stats off' stops, 'stats' shows the latency percentiles
+        until a key is pressed, 'stats clear' forgets the timings and 'stats
+        trace <path>' exports the trace of the latest turns."""
+        if args == ['on']:
+            self.profiler = self.profiler or profiling.Profiler()
+            self.profiler.attach(self)
+        elif args == ['off']:
+            if self.profiler is not None:
+                self.profiler.detach()
+        elif self.profiler is None:
+            return
+        elif args == ['clear']:
+            self.profiler.clear()
+        elif len(args) == 2 and args[0] == 'trace':
+            try:
+                self.profiler.export(args[1])
+            except OSError as e:
+                logger.error(f'stats trace failed: {e}')
+        elif not args:
+            height, width = self.dunmap_scr.getmaxyx()
+            self.dunmap_scr.erase()
+            for i, line in enumerate(self.profiler.report()[:height]):
+                self.dunmap_scr.addstr(i, 0, line[:width - 1])
+            self.dunmap_scr.refresh()
+            self.dunmap_scr.getch()
+            # the dunmap screen must be drawn anew
+            self.dunmap.dirty = None
 
         
     def read_console(self):
@@ -642,12 +1330,27 @@ class Game:
     # play
     
     def play(self):
+        if self.history is None:
+            self.history = undo.History(self)
+        if self.record_path is not None:
+            self.recorder = recording.Recorder(self.record_path, self.filename,
+                                               self.seed)
         try:
             self.init_screens()
             self.draw()
             return self._main_loop()
         finally:
             self.deinit_screens()
+            if self.recorder is not None:
+                self.recorder.close(self.digest())
+                self.recorder = None
+
+
+    def note(self, event):
+        """Adds (event) to the recording of the game, if it is recorded (see
+        recording.Recorder.event)."""
+        if self.recorder is not None:
+            self.recorder.event(event)
 
 
     def _main_loop(self):
@@ -660,15 +1363,76 @@ class Game:
                 else:
                     continue
             else:
-                self.hero_turn(command)
+                self.note(command)
+                outcome = self.hero_phase(command)
                 self.draw()
-                if self.hero.pos == self.dunmap.gateway_pos:
-                    return self.WON
-                self.enemies = [enemy for enemy in self.enemies if enemy.is_alive]
-                if not self.enemies:
-                    return self.WON
-                for enemy in self.enemies:
-                    self.enemy_turn(enemy)
+                if outcome is not self.ONGOING:
+                    return outcome
+                outcome = self.enemy_phase()
                 self.draw()
-                if not self.hero.is_alive:
-                    return self.KILLED
+                if outcome is not self.ONGOING:
+                    return outcome
+
+
+    def step(self, command):
+        """Plays a whole turn without any screen I/O: the hero executes
+        (command) (see Game.read_command for the possible values, except
+        'start-console') and then every living enemy takes its turn. Returns
+        one of {Game.WON, Game.KILLED, Game.ONGOING}."""
+        
+        outcome = self.hero_phase(command)
+        if outcome is not self.ONGOING:
+            return outcome
+        return self.enemy_phase()
+
+    
+    def hero_phase(self, command):
+        """The hero's half of a turn. Returns Game.WON if the hero reached the
+        gateway or if no enemies are left alive, otherwise Game.ONGOING."""
+        
+        self.record()
+        self.hero_turn(command)
+        if self.hero.pos == self.dunmap.gateway_pos:
+            return self.WON
+        if self.activity.take_killed():
+            self.enemy_table.drop_dead()
+        if not self.enemy_table.live:
+            return self.WON
+        return self.ONGOING
+
+    
+    def enemy_phase(self):
+        """The enemies' half of a turn. Returns Game.KILLED if the hero did
+        not survive it, otherwise Game.ONGOING.
+
+        Only the awake enemies (see activity.ActivityScheduler.awake) take a
+        turn, the others could do nothing but regenerate mana, which the
+        sleeping ones get when they wake up.
+
+        The awake enemies first all plan their turns, then play them in table
+        order (see planning)."""
+
+        table = self.enemy_table
+        hero_pos = self.hero.pos
+        awake = self.activity.awake(hero_pos)
+        self._near_hero = table.in_vicinity(hero_pos, awake)
+        self._hero_in_range = table.in_spell_range(hero_pos, awake)
+        planner = self.planner
+        plans = planner.plan(self, awake)
+        views, health = table.views, table.health
+        planner.start_commit()
+        try:
+            for index, plan in zip(awake, plans):
+                # an enemy killed earlier in the phase, by a spell, is off the
+                # map
+                if health[index] > 0:
+                    enemy = views[index]
+                    if not planner.is_valid(self, enemy, plan):
+                        plan = self.plan_enemy(enemy)
+                    self.enemy_turn(enemy, plan)
+        finally:
+            planner.end_commit()
+        self.activity.regen_mana()
+        if not self.hero.is_alive:
+            return self.KILLED
+        return self.ONGOING
@@ -1,3 +1,10 @@
 stdscr = None # None when curses has not yet been initialized
 
 DUNDIR = 'dungeons' # the directory containing the dungeon files
+
+CACHEDIR = '.dungeon-cache' # the directory of the compiled dungeons, see duncache
+
+REPLAYFILE = 'last-game.replay' # the recording of the last game played, see replay.py
+
+LOGFILE = 'log' # see logger
+TRUNCATE_LOG = True # whether main.py starts with an empty log
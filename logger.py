@@ -0,0 +1,177 @@
+"""
+The log.
+
+Logging a message only puts it in a queue, which costs about as much as a
+function call; a background thread takes the messages out of the queue and
+writes them in batches, with one write and one flush per batch instead of an
+open, a write and a close per message. The writer is started by the first
+message, so that importing this module has no side effect.
+
+Messages below the configured level are dropped on the spot. When the log file
+grows over (max_bytes), it is rotated: log becomes log.1, log.1 becomes log.2
+and so on, keeping (backups) old files.
+
+The queue is flushed when the program exits (see close), and can be flushed
+explicitly (see flush), for example before reading the log.
+"""
+
+import os
+import time
+import queue
+import atexit
+import threading
+
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+
+# the most messages written at once
+BATCH = 1024
+
+_config = {'path': 'log', 'level': INFO, 'max_bytes': 1 << 20, 'backups': 3,
+           'truncate': False}
+_level = _config['level']
+_writer = None
+_lock = threading.Lock()
+
+
+def configure(path=None, level=None, max_bytes=None, backups=None,
+              truncate=False):
+    """Changes the configuration of the log; the arguments left to None keep
+    their value. When (truncate) is True, the log file is emptied when the
+    next message is written, so that configuring touches no file. Messages
+    logged before are written with the previous configuration."""
+    global _level
+    close()
+    for key, value in (('path', path), ('level', level),
+                       ('max_bytes', max_bytes), ('backups', backups)):
+        if value is not None:
+            _config[key] = value
+    _config['truncate'] = truncate
+    _level = _config['level']
+
+
+def log(level, text):
+    if level < _level:
+        return
+    writer = _writer or _start()
+    writer.queue.put((time.time(), level, text))
+
+
+def debug(text):
+    log(DEBUG, text)
+
+
+def info(text):
+    log(INFO, text)
+
+
+def warning(text):
+    log(WARNING, text)
+
+
+def error(text):
+    log(ERROR, text)
+
+
+def flush():
+    """Returns once every message logged so far is written."""
+    if _writer is not None:
+        done = threading.Event()
+        _writer.queue.put(done)
+        done.wait()
+
+
+def close():
+    """Writes the pending messages and stops the writer. A later message starts
+    a new one."""
+    global _writer
+    with _lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.queue.put(None)
+        writer.join()
+
+
+def _start():
+    global _writer
+    with _lock:
+        if _writer is None:
+            _writer = _Writer(_config['path'], _config['max_bytes'],
+                              _config['backups'], _config['truncate'])
+            _config['truncate'] = False
+            _writer.start()
+        return _writer
+
+
+atexit.register(close)
+
+
+class _Writer(threading.Thread):
+    def __init__(self, path, max_bytes, backups, truncate=False):
+        super().__init__(name='logger', daemon=True)
+        self.queue = queue.SimpleQueue()
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.truncate = truncate
+
+
+    def run(self):
+        self.file = None
+        try:
+            running = True
+            while running:
+                # wait for a message, then take whatever else is already there
+                items = [self.queue.get()]
+                while len(items) < BATCH:
+                    try:
+                        items.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                lines, events = [], []
+                for item in items:
+                    if item is None:
+                        running = False
+                    elif isinstance(item, threading.Event):
+                        events.append(item)
+                    else:
+                        lines.append(_format(*item))
+                try:
+                    self._write(''.join(lines))
+                except OSError:
+                    # the log is not worth stopping the game, the batch is lost
+                    pass
+                for event in events:
+                    event.set()
+        finally:
+            if self.file is not None:
+                self.file.close()
+
+
+    def _write(self, text):
+        if not text:
+            return
+        if self.file is None:
+            self.file = open(self.path, 'w' if self.truncate else 'a')
+            self.truncate = False
+        if self.file.tell() + len(text) > self.max_bytes and self.file.tell():
+            self._rotate()
+        self.file.write(text)
+        self.file.flush()
+
+
+    def _rotate(self):
+        self.file.close()
+        self.file = None
+        for i in range(self.backups, 0, -1):
+            source = self.path if i == 1 else f'{self.path}.{i - 1}'
+            if os.path.exists(source):
+                os.replace(source, f'{self.path}.{i}')
+        self.file = open(self.path, 'w')
+
+
+def _format(timestamp, level, text):
+    stamp = time.strftime('%H:%M:%S', time.localtime(timestamp))
+    millis = int(timestamp % 1 * 1000)
+    return f'{stamp}.{millis:03} {LEVEL_NAMES.get(level, level)} {text}\n'
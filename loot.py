@@ -0,0 +1,183 @@
+"""
+Loot tables.
+
+A loot table is a list of weighted entries, each either a treasure or another
+loot table, which is drawn from in turn: tables nest, to give rarities (a
+'rare' entry of small weight leading to a table of rare treasures) without
+repeating the treasures of a table in every table using it.
+
+A dungeon declares its tables by id in its 'loot-tables' entry, and each chest
+refers to the table it is drawn from (see dunfile). The 'treasures' list of the
+dungeon is the table DEFAULT, of equal weights, which chests without a table
+are drawn from:
+
+    "loot-tables": {
+        "common": [{"weight": 10, "treasure": {"type": "health_potion", ...}},
+                   {"weight": 5, "treasure": {"type": "weapon", ...}},
+                   {"weight": 1, "table": "rare"}],
+        "rare": [{"treasure": {"type": "spell", ...}}]
+    },
+    "treasure-chests": [[3, 4], {"pos": [5, 6], "table": "common"}]
+
+(the weight of an entry is 1 by default). compile_tables turns the declarations
+into LootTable objects once per dungeon; a table is immutable, so that it is
+shared by the chests, the snapshots and the undo history.
+
+Each table draws with the alias method (see AliasSampler): one random number
+and two array lookups per table visited, whatever the number of entries.
+"""
+
+import array
+
+import treasures
+
+
+DEFAULT = 'treasures'
+
+
+class AliasSampler:
+    """
+    Draws the indexes 0 to n - 1 with probabilities proportional to their
+    weights, in constant time (Vose's alias method).
+
+    The range [0, n) is cut into n columns of width 1; column (i) is shared
+    between index (i), for its lower part (prob[i]), and index (alias[i]) for
+    the rest, which the construction makes possible for any weights. A draw
+    picks a column and a height with a single random number.
+    """
+
+    __slots__ = ('n', 'prob', 'alias', 'uniform')
+
+    def __init__(self, weights):
+        n = self.n = len(weights)
+        if not n:
+            raise ValueError('no weights')
+        if any(w <= 0 for w in weights):
+            raise ValueError(f'weights must be positive: {weights}')
+        # equal weights draw like random.Random.choice, so that the plain
+        # treasure lists draw the same treasures as before loot tables
+        self.uniform = all(w == weights[0] for w in weights)
+        total = sum(weights)
+        scaled = [w * n / total for w in weights]
+        self.prob = prob = array.array('d', [1.0] * n)
+        self.alias = alias = array.array('l', range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
+        # what is left is 1 up to rounding errors, prob already says so
+
+
+    def draw(self, rng):
+        """Returns an index, drawn with the random.Random (rng)."""
+        if self.uniform:
+            return rng.randrange(self.n)
+        x = rng.random() * self.n
+        i = int(x)
+        return i if x - i < self.prob[i] else self.alias[i]
+
+
+class LootTable:
+    """
+    Attributes:
+    - id: the id the table is declared with
+    - entries: the list of the entries, treasures.Treasure or LootTable objects
+    - weights: the list of the weights of the entries
+    - sampler: the AliasSampler of the entries
+    """
+
+    __slots__ = ('id', 'entries', 'weights', 'sampler')
+
+    def __init__(self, id, entries, weights):
+        self.id = id
+        self.entries = entries
+        self.weights = weights
+        self.sampler = AliasSampler(weights)
+
+
+    def draw(self, rng):
+        """Returns a treasure drawn from (self), with the random.Random
+        (rng)."""
+        table = self
+        while True:
+            entry = table.entries[table.sampler.draw(rng)]
+            if not isinstance(entry, LootTable):
+                return entry
+            table = entry
+
+
+def compile_tables(treasure_dicts, declarations):
+    """Returns a dict mapping the id of every table to its LootTable: DEFAULT,
+    made of the (treasure_dicts) with equal weights, and every table of
+    (declarations), a dict mapping ids to lists of entries (see the module
+    docstring). Raises ValueError on a reference to an unknown table, on a
+    table including itself, on an empty table or on a weight which is not
+    positive."""
+
+    declarations = dict(declarations)
+    if DEFAULT in declarations:
+        raise ValueError(f'loot table id reserved for the treasures list: {DEFAULT}')
+    tables = {}
+    if treasure_dicts:
+        tables[DEFAULT] = LootTable(
+            DEFAULT, [treasures.parse_dict(dct) for dct in treasure_dicts],
+            [1] * len(treasure_dicts))
+    compiling = []
+
+    def compile_table(table_id):
+        table = tables.get(table_id)
+        if table is not None:
+            return table
+        if table_id in compiling:
+            cycle = ' -> '.join(compiling[compiling.index(table_id):] + [table_id])
+            raise ValueError(f'loot table including itself: {cycle}')
+        if table_id not in declarations:
+            raise ValueError(f'unknown loot table: {table_id}')
+        if not declarations[table_id]:
+            raise ValueError(f'empty loot table: {table_id}')
+        compiling.append(table_id)
+        entries, weights = [], []
+        for entry in declarations[table_id]:
+            if 'table' in entry:
+                entries.append(compile_table(entry['table']))
+            else:
+                entries.append(treasures.parse_dict(entry['treasure']))
+            weights.append(entry.get('weight', 1))
+        compiling.pop()
+        try:
+            table = tables[table_id] = LootTable(table_id, entries, weights)
+        except ValueError as e:
+            raise ValueError(f'loot table {table_id}: {e}') from None
+        return table
+
+    for table_id in declarations:
+        compile_table(table_id)
+    return tables
+
+
+def declare(tables):
+    """Returns the pair (<treasure dicts>, <declarations>) which compile_tables
+    turns into the LootTable objects (tables) and the tables they include: the
+    inverse of compile_tables."""
+    treasure_dicts, declarations = [], {}
+    pending = list(tables)
+    while pending:
+        table = pending.pop()
+        if table.id == DEFAULT:
+            treasure_dicts = [treasures.to_dict(t) for t in table.entries]
+            continue
+        if table.id in declarations:
+            continue
+        entries = declarations[table.id] = []
+        for entry, weight in zip(table.entries, table.weights):
+            if isinstance(entry, LootTable):
+                entries.append({'weight': weight, 'table': entry.id})
+                pending.append(entry)
+            else:
+                entries.append({'weight': weight,
+                                'treasure': treasures.to_dict(entry)})
+    return treasure_dicts, declarations
@@ -1,25 +1,36 @@
 import sys
 import curses
-import os
 
+import catalog
 import globvars
+import logger
 import utils
 
-from game import Game
-
 
 def dunscreen():
-    dungeons = sorted(os.listdir(globvars.DUNDIR))
+    dungeons = catalog.Catalog(globvars.DUNDIR)
+    items = None
     while True:
-        choice = utils.List.get(dungeons)
+        # the same items as long as the directory does not change, which lets
+        # utils.List keep its index of them
+        if dungeons.refresh() or items is None:
+            names = dungeons.names()
+            width = max(map(len, names), default=0)
+            items = [f'{name:<{width}}  {dungeons.entries[name].describe()}'
+                     for name in names]
+        choice = utils.List.get(items)
         if choice is None:
             break
-        path = f'{globvars.DUNDIR}/{choice}'
+        path = f'{globvars.DUNDIR}/{names[items.index(choice)]}'
         play(path)
 
 
 def play(path):
-    game = Game(path)
+    # the engine is only imported once a dungeon is played, so that the menus
+    # show up at once
+    from game import Game
+
+    game = Game(path, record=globvars.REPLAYFILE)
     outcome = game.play()
     pass
 
@@ -37,5 +48,6 @@ def main(stdscr):
             raise ValueError(f'Invalid choice: "{choice}"')
 
 
+logger.configure(globvars.LOGFILE, truncate=globvars.TRUNCATE_LOG)
 curses.wrapper(main)
 
@@ -0,0 +1,113 @@
+"""
+Memory benchmark for the entity model.
+
+Generates a dungeon with many enemies and treasure chests (see dungen), loads
+it and reports, with tracemalloc, the memory taken by the game state
+(Game.build) and the bytes per entity of each kind of entity. For comparison,
+it also reports the size of an instance of an equivalent class with a
+per-instance __dict__, which is what every entity used to be.
+
+Usage: py membench.py [<enemies>] [<chests>]
+"""
+
+import os
+import sys
+import tempfile
+import tracemalloc
+
+import dungen
+import dunfile
+import enemies
+import treasures
+
+from game import Game, Hero, Enemy
+
+
+ENEMIES = 200_000
+CHESTS = 200_000
+
+
+def params(nenemies, nchests, seed=0):
+    """Returns the dungen.Params of a dungeon without obstacles, with a square
+    map just big enough to hold (nenemies) enemies and (nchests) chests on a
+    quarter of its positions."""
+    side = int(((nenemies + nchests + 2) * 4) ** 0.5) + 1
+    return dungen.Params(side, side, 0, nenemies, nchests, seed)
+
+
+def traced(function):
+    """Calls (function) and returns a pair (<result>, <bytes allocated by the
+    call and still alive afterwards>)."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = function()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+class DictEntity:
+    """An entity as it used to be: its attributes in a per-instance dict."""
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+
+def per_instance(make, n):
+    """Returns the average number of bytes taken by one of (n) objects created
+    with (make)."""
+    objects, size = traced(lambda: [make() for _ in range(n)])
+    return (size - sys.getsizeof(objects)) / n
+
+
+def main(argv):
+    nenemies = int(argv[0]) if argv else ENEMIES
+    nchests = int(argv[1]) if len(argv) > 1 else CHESTS
+
+    dungeon = params(nenemies, nchests)
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+        dungen.write(dungeon, f)
+    try:
+        game = Game(f.name, headless=True, cache=False)
+        # the game closes its dungeon once built, build it again from a new one
+        game.dungeon = dunfile.load(f.name)
+    finally:
+        os.remove(f.name)
+
+    del (game.hero, game.enemy_table, game.dunmap, game.visibility,
+         game.flow_fields, game.activity, game.chests)
+    try:
+        _, total = traced(game.build)
+    finally:
+        game.dungeon.close()
+    nrows, ncols = dungeon.nrows, dungeon.ncols
+    print(f'dungeon: {nrows}x{ncols}, {nenemies} enemies, {nchests} chests')
+    print(f'game state: {total / 2**20:.1f} MiB, '
+          f'{total / (nenemies + nchests):.1f} bytes per entity '
+          f'(map included)')
+
+    n = 10_000
+    table = enemies.EnemyTable()
+    def make_enemy():
+        index = table.add(40, 100, 2, 20, (0, 0), 'rabid', *treasures.defaults)
+        enemy = Enemy(table, index)
+        table.views.append(enemy)
+        return enemy
+    rows = [
+        ('hero', per_instance(lambda: Hero(100, 100, 2, 10, (0, 0)), n)),
+        ('enemy (table row + view)', per_instance(make_enemy, n)),
+        ('weapon', per_instance(lambda: treasures.Weapon('axe', 20), n)),
+        ('spell', per_instance(lambda: treasures.Spell('fb', 30, 50, 2), n)),
+        ('chest (unshared)', per_instance(
+            lambda: treasures.TreasureChest(None), n)),
+        ('entity with a __dict__', per_instance(
+            lambda: DictEntity(health=1, max_health=1, mana=1, max_mana=1,
+                               mana_regen=1, fist_damage=1, weapon=None,
+                               spell=None, pos=None), n)),
+    ]
+    print('bytes per instance:')
+    for name, size in rows:
+        print(f'  {name:<26}{size:>8.1f}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,205 @@
+"""
+Shortest paths over a Dunmap.
+
+A FlowField holds the walking distance from every position to a target
+position, going around obstacles. Actors and treasure chests do not block
+paths: chests can be walked over and actors move, so an actor standing in the
+way is only taken into account when stepping (see FlowField.direction).
+
+A field is computed with a breadth-first search from its target, lazily: the
+search stops as soon as the position asked about is reached, and resumes from
+where it stopped when a farther position is asked about. All the enemies
+chasing the same position thus share one search, and each of them then finds
+its next step with a few lookups.
+
+When the target moves to an adjacent position (the hero took a step), a
+complete field is repaired rather than recomputed: no distance grows by more
+than one, which is applied to all the distances at once through an offset, and
+the distances which shrink are lowered by a search from the new target which
+stops wherever nothing changes.
+"""
+
+import array
+import collections
+
+import utils
+
+
+# the stored value of the positions the search has not reached. Anything above
+# _FAR is unknown, whatever the offset.
+_UNKNOWN = 2**31 - 1
+_FAR = 2**30
+
+
+class FlowField:
+    """
+    Attributes:
+    - dunmap
+    - target: the position the distances are to, None until the first
+      FlowField.retarget
+    - dist: (dist[i] + offset) is the distance from the position of index (i)
+      (see Dunmap.index) to the target, for the positions the search reached
+    - offset
+    - frontier: the indexes of the positions at distance (radius), whose
+      neighbours the search has not visited yet. The distances up to (radius)
+      are final. The field is complete when the frontier is empty.
+    """
+
+    def __init__(self, dunmap):
+        self.dunmap = dunmap
+        self.target = None
+        self.dist = None
+        self.offset = 0
+        self.frontier = []
+        self.radius = 0
+        self._visited = array.array('l')
+
+
+    @property
+    def complete(self):
+        return self.target is not None and not self.frontier
+
+
+    def retarget(self, target):
+        """Makes (target) the target of the field."""
+        target = tuple(target)
+        if target == self.target:
+            return
+        if (self.complete and _adjacent(target, self.target)
+                and self.distance(target) is not None):
+            self._repair(target)
+        else:
+            self._restart(target)
+
+
+    def _restart(self, target):
+        dunmap = self.dunmap
+        ncells = dunmap.nrows * dunmap.ncols
+        if self.dist is None or 8 * len(self._visited) > ncells:
+            self.dist = array.array('i', [_UNKNOWN]) * ncells
+        else:
+            dist = self.dist
+            for i in self._visited:
+                dist[i] = _UNKNOWN
+        i = dunmap.index(target)
+        self.target = target
+        self.offset = 0
+        self.dist[i] = 0
+        self.frontier = [i]
+        self.radius = 0
+        self._visited = array.array('l', self.frontier)
+
+
+    def _repair(self, target):
+        dist, kinds, ncols = self.dist, self.dunmap.kinds, self.dunmap.ncols
+        ncells, obstacle = len(dist), self.dunmap.KIND_OBSTACLE
+        self.offset += 1
+        i = self.dunmap.index(target)
+        dist[i] = -self.offset
+        layer = [i]
+        while layer:
+            next_layer = []
+            for i in layer:
+                d = dist[i] + 1
+                col = i % ncols
+                for j in (i - 1 if col > 0 else -1,
+                          i + 1 if col < ncols - 1 else -1,
+                          i - ncols, i + ncols):
+                    if 0 <= j < ncells and dist[j] > d and kinds[j] != obstacle:
+                        dist[j] = d
+                        next_layer.append(j)
+            layer = next_layer
+        self.target = target
+
+
+    def _expand(self):
+        """Makes the distances of the next layer of the search final."""
+        dist, kinds, ncols = self.dist, self.dunmap.kinds, self.dunmap.ncols
+        ncells, obstacle = len(dist), self.dunmap.KIND_OBSTACLE
+        d = self.radius + 1 - self.offset
+        next_frontier = []
+        for i in self.frontier:
+            col = i % ncols
+            for j in (i - 1 if col > 0 else -1,
+                      i + 1 if col < ncols - 1 else -1,
+                      i - ncols, i + ncols):
+                if 0 <= j < ncells and dist[j] > _FAR and kinds[j] != obstacle:
+                    dist[j] = d
+                    next_frontier.append(j)
+        self.frontier = next_frontier
+        self.radius += 1
+        self._visited.extend(next_frontier)
+
+
+    def distance(self, pos):
+        """Returns the walking distance from (pos) to the target, or None if
+        the target cannot be reached from (pos)."""
+        i = self.dunmap.index(pos)
+        dist = self.dist
+        while dist[i] > _FAR and self.frontier:
+            self._expand()
+        d = dist[i]
+        return None if d > _FAR else d + self.offset
+
+
+    def direction(self, pos, preferred=None):
+        """Returns the direction of a step from (pos) which gets closer to the
+        target and which can be taken right now (see Dunmap.can_move_to), or
+        None if there is none. (preferred) is tried first."""
+        d = self.distance(pos)
+        if d is None:
+            return None
+        dunmap = self.dunmap
+        directions = ('up', 'down', 'left', 'right')
+        if preferred is not None:
+            directions = (preferred,) + directions
+        for direction in directions:
+            new_pos = utils.move_pos(pos, direction)
+            if (dunmap.can_move_to(new_pos)
+                    and self.dist[dunmap.index(new_pos)] + self.offset < d):
+                return direction
+        return None
+
+
+class FlowFields:
+    """The flow fields towards the most recently used targets of a Dunmap.
+    A FlowFields is a listener of its Dunmap (see Dunmap.listeners) and forgets
+    every field when an obstacle appears or disappears."""
+
+    def __init__(self, dunmap, size=3):
+        self.dunmap = dunmap
+        self.size = size
+        self.fields = collections.OrderedDict()
+        dunmap.listeners.append(self)
+
+
+    def cell_changed(self, pos, old_kind, new_kind):
+        obstacle = self.dunmap.KIND_OBSTACLE
+        if old_kind == obstacle or new_kind == obstacle:
+            self.fields.clear()
+
+
+    def get(self, target):
+        """Returns the FlowField towards (target). A field whose target is next
+        to (target) is preferably retargeted, since it can be repaired."""
+        target = tuple(target)
+        field = self.fields.get(target)
+        if field is not None:
+            self.fields.move_to_end(target)
+            return field
+
+        old_target = next((t for t, f in self.fields.items()
+                           if f.complete and _adjacent(t, target)), None)
+        if old_target is not None:
+            field = self.fields.pop(old_target)
+        elif len(self.fields) >= self.size:
+            _, field = self.fields.popitem(last=False)
+        else:
+            field = FlowField(self.dunmap)
+        field.retarget(target)
+        self.fields[target] = field
+        return field
+
+
+def _adjacent(pos1, pos2):
+    return abs(pos1[0] - pos2[0]) + abs(pos1[1] - pos2[1]) == 1
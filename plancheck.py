@@ -0,0 +1,136 @@
+"""
+Differential check of the two-phase enemy turns (see planning).
+
+A plan made before the commit is only followed while Planner.is_valid says
+nothing it was made from changed; otherwise the enemy plans again on the spot.
+Those rules must make the two phases play exactly like turns played one by one.
+This plays the same seeded games twice, with the usual planning and with every
+plan thrown away (each enemy plans again at its turn, which is playing the
+turns one by one), and compares Game.digest after every turn. With --workers N,
+the games are also played with the planning in N worker processes.
+
+The games are played with a random hero, on crowded generated dungeons (see
+dungen) unless dungeon files are given, with enemies seeing along their row and
+column and within a field of view (see --fov).
+
+Usage: py plancheck.py [options] [<dungeon-path> ...]
+
+Options:
+    --turns N      turns per game (default 200)
+    --seeds N      games per dungeon and field of view (default 3)
+    --fov R        the field of view radius (default 4)
+    --workers N    also plan in N worker processes (default 0: not checked)
+
+The exit status is 1 if the digests of a game differ.
+"""
+
+import os
+import sys
+import random
+import argparse
+import tempfile
+
+import dungen
+import planning
+import policies
+
+from game import Game
+
+
+TURNS = 200
+SEEDS = 3
+FOV_RADIUS = 4
+
+# the generated dungeons: crowded, so that the enemies often get in each
+# other's way, with chests whose opening changes the static blockers
+GENERATED = (dungen.Params(30, 30, 0.2, 150, 30, seed=1),
+             dungen.Params(40, 40, 0.25, 250, 40, seed=2))
+
+
+class Replanner(planning.Planner):
+    """A Planner whose plans are never valid: every enemy plans again at its
+    turn, which plays the turns one by one."""
+
+    def is_valid(self, game, enemy, plan):
+        return False
+
+
+def digests(path, turns, seed, fov_radius, planner):
+    """Plays (turns) turns of a game on the dungeon file (path) with a random
+    hero seeded (seed), planning with (planner), and resets the game whenever
+    it ends. Returns the list of the digests of the state after every turn,
+    taken before the resets."""
+    game = Game(path, headless=True, seed=seed, fov_radius=fov_radius)
+    game.planner = planner
+    rng = random.Random(seed)
+    result = []
+    try:
+        for _ in range(turns):
+            outcome = game.step(policies.random_command(rng))
+            result.append(game.digest())
+            if outcome is not Game.ONGOING:
+                game.reset()
+    finally:
+        planner.close()
+    return result
+
+
+def check(path, turns, seed, fov_radius, workers=0):
+    """Returns None if the game on (path) seeded (seed) plays the same with
+    every way of planning, otherwise a description of the first difference."""
+    expected = digests(path, turns, seed, fov_radius, Replanner())
+    planners = [('planned', planning.Planner())]
+    if workers:
+        planners.append((f'{workers} workers', planning.Planner(workers)))
+    for name, planner in planners:
+        actual = digests(path, turns, seed, fov_radius, planner)
+        for turn, (a, b) in enumerate(zip(expected, actual), 1):
+            if a != b:
+                return f'{name}: differs from turn {turn}'
+    return None
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Checks that planned enemy turns play like one by one.')
+    parser.add_argument('paths', nargs='*', help='dungeon files')
+    parser.add_argument('--turns', type=int, default=TURNS)
+    parser.add_argument('--seeds', type=int, default=SEEDS)
+    parser.add_argument('--fov', type=int, default=FOV_RADIUS)
+    parser.add_argument('--workers', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    paths, generated = list(args.paths), []
+    # the names of the generated dungeons, from their parameters
+    names = {}
+    if not paths:
+        for params in GENERATED:
+            with tempfile.NamedTemporaryFile('w', suffix='.json',
+                                             delete=False) as f:
+                dungen.write(params, f)
+            generated.append(f.name)
+            names[f.name] = (f'{params.nrows}x{params.ncols}/{params.nenemies}'
+                             f'/{params.nchests}')
+        paths = generated
+
+    status = 0
+    print(f'{"dungeon":<24}{"fov":>6}{"seed":>6}  result')
+    try:
+        for path in paths:
+            for fov_radius in (None, args.fov):
+                for seed in range(args.seeds):
+                    error = check(path, args.turns, seed, fov_radius,
+                                  args.workers)
+                    if error is not None:
+                        status = 1
+                    print(f'{names.get(path, path)[-23:]:<24}'
+                          f'{"-" if fov_radius is None else fov_radius:>6}'
+                          f'{seed:>6}  {error or "ok"}')
+    finally:
+        for path in generated:
+            os.remove(path)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
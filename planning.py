@@ -0,0 +1,290 @@
+"""
+Two-phase enemy turns.
+
+The enemy phase is played in two phases:
+- plan: every awake enemy looks for the hero and chooses the step it would take
+  towards its target, the hero if it sees it, otherwise where it last saw it.
+  This reads the map and changes nothing, so that the enemies can be planned
+  in any order, and in parallel.
+- commit: the enemies then play their turns one after the other, in table
+  order, following their plans (see Game.enemy_turn). Conflicts are resolved
+  by that order: of two enemies stepping into the same position, the first
+  one gets there and the second one is blocked; attacks land in table order.
+
+A plan is the pair (<seen>, <direction>): whether the enemy sees the hero, and
+the direction of its step towards its target, or None.
+
+Plans are made against the map as it was before the commit, and the earlier
+turns of the commit change the map. A plan is thus only followed when what it
+was made from did not change (see Planner.is_valid): the hero is still on the
+map if it was seen, nothing changed in the line between the enemy and the hero
+(or, with fields of view, no static blocker changed), and none of the positions
+next to the enemy changed. An enemy with a stale plan plans again on the spot,
+which makes the two phases play exactly like turns played one by one.
+
+Planning can run in worker processes, each planning the enemies of a horizontal
+band of the map. Every worker keeps its own copy of the kinds of the map, which
+is kept up to date with the positions which changed since the previous plan,
+and its own Visibility and FlowFields over it. (Threads would not help: the
+planning is pure Python and would hold the interpreter lock.)
+"""
+
+import array
+import multiprocessing
+
+import enemies
+import utils
+
+
+# the directions as coded between the processes
+DIRECTIONS = (None, 'up', 'down', 'left', 'right')
+_DIRECTION_CODES = {direction: code for code, direction in enumerate(DIRECTIONS)}
+
+_NEIGHBOURS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+
+
+def sees(visibility, fov_radius, pos, hero_pos):
+    """Returns True if an enemy at (pos) sees the hero at (hero_pos), see
+    Game.find_hero."""
+    if fov_radius is None:
+        return visibility.sees(pos, hero_pos)
+    return hero_pos in visibility.fov(pos, fov_radius)
+
+
+def step_towards(flow_fields, pos, target):
+    """Returns the direction of the step from (pos) along a shortest path around
+    the obstacles to (target), or straight towards it when there is no path, or
+    None if the step cannot be taken right now."""
+    preferred = utils.approach_direction(pos, target)
+    field = flow_fields.get(target)
+    if field.distance(pos) is None:
+        return preferred
+    return field.direction(pos, preferred)
+
+
+def plan(pos, last_seen, hero_pos, seen, flow_fields):
+    """Returns the plan of an enemy at (pos) which last saw the hero at
+    (last_seen) and which sees it at (hero_pos) or not, according to (seen)."""
+    target = hero_pos if seen else last_seen
+    if target is None or tuple(target) == tuple(pos):
+        return (seen, None)
+    return (seen, step_towards(flow_fields, pos, target))
+
+
+class Planner:
+    """
+    Plans the turns of the awake enemies of a game and checks the plans during
+    the commit. A Planner listens to the Dunmap of its game (see
+    Dunmap.listeners) to know which positions changed.
+
+    Attributes:
+    - workers: the number of worker processes, 0 to plan in the game's process
+    """
+
+    def __init__(self, workers=0):
+        self.workers = workers
+        self._processes = []
+        self._dunmap = None
+        # the dunmap the workers have a copy of
+        self._worker_map = None
+        # the positions changed since the workers were last told, and since
+        # the commit started
+        self._unsynced = set()
+        self._committed = None
+        self._changed_rows = set()
+        self._changed_cols = set()
+        self._static_version = 0
+
+
+    def cell_changed(self, pos, old_kind, new_kind):
+        pos = tuple(pos)
+        if self.workers:
+            self._unsynced.add(pos)
+        if self._committed is not None:
+            self._committed.add(pos)
+            self._changed_rows.add(pos[0])
+            self._changed_cols.add(pos[1])
+
+
+    def _attach(self, game):
+        """Listens to the dunmap of (game) if not done yet."""
+        dunmap = game.dunmap
+        if dunmap is self._dunmap:
+            return
+        if self._dunmap is not None and self in self._dunmap.listeners:
+            self._dunmap.listeners.remove(self)
+        dunmap.listeners.append(self)
+        self._dunmap = dunmap
+
+    ########################################
+    # plan
+
+    def plan(self, game, indexes):
+        """Returns the list of the plans of the enemies of (game) whose indexes
+        are in (indexes), in the same order."""
+        self._attach(game)
+        self._static_version = game.visibility.static_version
+        if not self.workers or not indexes:
+            views = game.enemy_table.views
+            return [game.plan_enemy(views[i]) for i in indexes]
+        if not self._processes:
+            self._start()
+        self._sync(game)
+        return self._plan_in_workers(game, indexes)
+
+
+    def _plan_in_workers(self, game, indexes):
+        table = game.enemy_table
+        rows, cols = table.rows, table.cols
+        ls_rows, ls_cols = table.last_seen_rows, table.last_seen_cols
+        nworkers, nrows = len(self._processes), game.dunmap.nrows
+        # the positions in (indexes) of the enemies of each band
+        bands = [[] for _ in range(nworkers)]
+        for k, i in enumerate(indexes):
+            bands[rows[i] * nworkers // nrows].append(k)
+
+        hero_pos = game.hero.pos
+        hero_on_map = game.dunmap[hero_pos] is game.hero
+        for (conn, _), band in zip(self._processes, bands):
+            records = array.array('l')
+            for k in band:
+                i = indexes[k]
+                records.extend((rows[i], cols[i], ls_rows[i], ls_cols[i]))
+            conn.send(('plan', hero_pos, hero_on_map, records.tobytes()))
+
+        plans = [None] * len(indexes)
+        for (conn, _), band in zip(self._processes, bands):
+            codes = conn.recv()
+            for n, k in enumerate(band):
+                plans[k] = (bool(codes[2 * n]), DIRECTIONS[codes[2 * n + 1]])
+        return plans
+
+    ########################################
+    # commit
+
+    def start_commit(self):
+        self._committed = set()
+        self._changed_rows.clear()
+        self._changed_cols.clear()
+
+
+    def end_commit(self):
+        self._committed = None
+
+
+    def is_valid(self, game, enemy, plan):
+        """Returns True if (plan), made for (enemy) before the commit started,
+        is still what the enemy would plan now."""
+        seen, _ = plan
+        hero = game.hero
+        if seen and game.dunmap[hero.pos] is not hero:
+            return False
+        if game.fov_radius is not None:
+            if game.visibility.static_version != self._static_version:
+                return False
+        else:
+            (row, col), (hero_row, hero_col) = enemy.pos, hero.pos
+            if ((row == hero_row and hero_row in self._changed_rows)
+                    or (col == hero_col and hero_col in self._changed_cols)):
+                return False
+        committed = self._committed
+        if committed:
+            row, col = enemy.pos
+            for drow, dcol in _NEIGHBOURS:
+                if (row + drow, col + dcol) in committed:
+                    return False
+        return True
+
+    ########################################
+    # workers
+
+    def _start(self):
+        context = multiprocessing.get_context()
+        for _ in range(self.workers):
+            conn, child_conn = context.Pipe()
+            process = context.Process(target=_worker, args=(child_conn,),
+                                      name='planner', daemon=True)
+            process.start()
+            child_conn.close()
+            self._processes.append((conn, process))
+
+
+    def _sync(self, game):
+        """Brings the maps of the workers up to date with (game)."""
+        dunmap = game.dunmap
+        if dunmap is not self._worker_map:
+            self._worker_map = dunmap
+            message = ('map', dunmap.nrows, dunmap.ncols, bytes(dunmap.kinds),
+                       game.fov_radius)
+        elif self._unsynced:
+            posns = array.array('l')
+            kinds = dunmap.kinds
+            ncols = dunmap.ncols
+            changed = bytearray()
+            for row, col in self._unsynced:
+                posns.extend((row, col))
+                changed.append(kinds[row * ncols + col])
+            message = ('changes', posns.tobytes(), bytes(changed))
+        else:
+            return
+        self._unsynced = set()
+        for conn, _ in self._processes:
+            conn.send(message)
+
+
+    def close(self):
+        """Stops the worker processes, if any. A later plan starts new ones."""
+        for conn, process in self._processes:
+            try:
+                conn.send(('close',))
+            except OSError:
+                pass
+            process.join()
+            conn.close()
+        self._processes = []
+        self._worker_map = None
+
+
+def _worker(conn):
+    """The loop of a worker process, planning the enemies it is sent."""
+
+    # imported here: game imports this module
+    from game import Dunmap
+    import pathfinding
+    import visibility
+
+    dunmap = flow_fields = view = fov_radius = None
+    while True:
+        message = conn.recv()
+        kind = message[0]
+        if kind == 'map':
+            _, nrows, ncols, kinds, fov_radius = message
+            dunmap = Dunmap(nrows, ncols)
+            dunmap.kinds[:] = kinds
+            view = visibility.Visibility(dunmap)
+            flow_fields = pathfinding.FlowFields(dunmap)
+        elif kind == 'changes':
+            posns = array.array('l')
+            posns.frombytes(message[1])
+            ncols = dunmap.ncols
+            for n, new_kind in enumerate(message[2]):
+                pos = (posns[2 * n], posns[2 * n + 1])
+                dunmap._set_kind(pos, pos[0] * ncols + pos[1], new_kind)
+        elif kind == 'plan':
+            _, hero_pos, hero_on_map, data = message
+            records = array.array('l')
+            records.frombytes(data)
+            codes = bytearray()
+            for n in range(0, len(records), 4):
+                pos = (records[n], records[n + 1])
+                last_seen = (None if records[n + 2] == enemies.NOWHERE
+                             else (records[n + 2], records[n + 3]))
+                seen = hero_on_map and sees(view, fov_radius, pos, hero_pos)
+                seen, direction = plan(pos, last_seen, hero_pos, seen,
+                                       flow_fields)
+                codes.append(seen)
+                codes.append(_DIRECTION_CODES[direction])
+            conn.send(bytes(codes))
+        elif kind == 'close':
+            conn.close()
+            return
@@ -0,0 +1,74 @@
+"""
+Hero policies for automated play.
+
+A policy is an object with a method (command(game, rng)) which returns the next
+hero command in the form returned by Game.read_command (never 'start-console'),
+or None when the policy has nothing left to play. (rng) is a random.Random owned
+by the caller, so that a policy's choices are reproducible from a seed.
+"""
+
+DIRECTIONS = ('up', 'down', 'left', 'right')
+ATTACKS = ('weapon', 'spell', 'fist')
+
+
+def random_command(rng):
+    """Returns a random hero command."""
+    if rng.random() < 0.5:
+        return rng.choice(DIRECTIONS)
+    return rng.choice(ATTACKS), rng.choice(DIRECTIONS)
+
+
+def parse_command(text):
+    """Parses a command written as in a script file: either a direction
+    ('left') or an attack followed by a direction ('spell left')."""
+    words = text.split()
+    if len(words) == 1 and words[0] in DIRECTIONS:
+        return words[0]
+    elif len(words) == 2 and words[0] in ATTACKS and words[1] in DIRECTIONS:
+        return tuple(words)
+    raise ValueError(f'invalid command: "{text}"')
+
+
+class RandomPolicy:
+    def command(self, game, rng):
+        return random_command(rng)
+
+
+class ScriptedPolicy:
+    """Plays a fixed list of commands, the same for every game."""
+
+    def __init__(self, commands):
+        self.commands = commands
+        self.index = 0
+
+
+    @classmethod
+    def from_file(cls, filename):
+        """One command per line, blank lines and lines starting with # are
+        ignored."""
+        with open(filename) as f:
+            lines = [line.strip() for line in f]
+        return cls([parse_command(line) for line in lines
+                    if line and not line.startswith('#')])
+
+
+    def restart(self):
+        self.index = 0
+
+
+    def command(self, game, rng):
+        if self.index == len(self.commands):
+            return None
+        command = self.commands[self.index]
+        self.index += 1
+        return command
+
+
+def parse(spec):
+    """Returns the policy described by (spec): either 'random' or
+    'script:<filename>'."""
+    if spec == 'random':
+        return RandomPolicy()
+    elif spec.startswith('script:'):
+        return ScriptedPolicy.from_file(spec[len('script:'):])
+    raise ValueError(f'invalid policy: "{spec}"')
@@ -0,0 +1,144 @@
+"""
+Turn instrumentation.
+
+A Profiler times the phases of the turns of a Game: the hero's turn, the turn
+of each enemy (per behavior), find_hero, draw and the animation calls. It keeps
+the latest durations of each of them, for percentiles (see Profiler.report),
+and a trace of the latest turns which can be exported in the Chrome trace-event
+format (see Profiler.export), to be opened in chrome://tracing or Perfetto.
+
+Instrumentation is off by default and costs nothing then: Profiler.attach
+shadows the timed methods of a game with timing wrappers, as attributes of the
+game itself, and Profiler.detach removes them, leaving the plain methods of the
+class.
+"""
+
+import json
+import time
+import functools
+import collections
+
+
+# the timed methods of a Game and the names they are reported under
+METHODS = (('hero_phase', 'turn.hero'),
+           ('enemy_phase', 'turn.enemies'),
+           ('hero_turn', 'hero_turn'),
+           ('enemy_friendly_turn', 'enemy_turn.friendly'),
+           ('enemy_aggressive_turn', 'enemy_turn.aggressive'),
+           ('enemy_rabid_turn', 'enemy_turn.rabid'),
+           ('find_hero', 'find_hero'),
+           ('draw', 'draw'),
+           ('animate_spell', 'animate_spell'),
+           ('animate_melee', 'animate_melee'),
+           ('play_animations', 'play_animations'))
+
+# the number of durations kept per name
+WINDOW = 1000
+
+# the number of trace events kept
+TRACE_EVENTS = 200_000
+
+PERCENTILES = (50, 90, 99)
+
+
+class Profiler:
+    """
+    Attributes:
+    - durations: maps each name to a deque of its latest durations, in
+      nanoseconds
+    - trace: a deque of the latest trace events
+    - turn: the number of hero phases so far
+    """
+
+    def __init__(self, window=WINDOW, trace_events=TRACE_EVENTS):
+        self.window = window
+        self.durations = collections.defaultdict(
+            lambda: collections.deque(maxlen=window))
+        self.trace = collections.deque(maxlen=trace_events)
+        self.turn = 0
+        self.game = None
+        self._origin = time.perf_counter_ns()
+
+
+    def attach(self, game):
+        """Starts timing (game)."""
+        self.detach()
+        for method, name in METHODS:
+            setattr(game, method, self._timed(getattr(game, method), name))
+        self.game = game
+
+
+    def detach(self):
+        """Stops timing the game (self) is attached to, if any."""
+        if self.game is None:
+            return
+        for method, _ in METHODS:
+            self.game.__dict__.pop(method, None)
+        self.game = None
+
+
+    def clear(self):
+        for durations in self.durations.values():
+            durations.clear()
+        self.trace.clear()
+
+
+    def _timed(self, function, name):
+        durations, trace = self.durations[name], self.trace
+        clock, origin = time.perf_counter_ns, self._origin
+        new_turn = name == 'turn.hero'
+
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            if new_turn:
+                self.turn += 1
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                end = clock()
+                durations.append(end - start)
+                trace.append((name, start - origin, end - start, self.turn))
+        return timed
+
+    ########################################
+    # reports
+
+    def percentiles(self, name):
+        """Returns a dict with the count, the percentiles (see PERCENTILES) and
+        the maximum of the latest durations of (name), in seconds."""
+        durations = sorted(self.durations[name])
+        if not durations:
+            return {'count': 0}
+        result = {'count': len(durations)}
+        for p in PERCENTILES:
+            i = min(len(durations) - 1, len(durations) * p // 100)
+            result[f'p{p}'] = durations[i] / 1e9
+        result['max'] = durations[-1] / 1e9
+        return result
+
+
+    def report(self):
+        """Returns the lines of a table of the percentiles of every name."""
+        header = f'{"":<22}{"count":>7}' + ''.join(
+            f'{f"p{p}":>10}' for p in PERCENTILES) + f'{"max":>10}'
+        lines = [header]
+        for _, name in METHODS:
+            stats = self.percentiles(name)
+            if not stats['count']:
+                continue
+            line = f'{name:<22}{stats["count"]:>7}'
+            for key in [f'p{p}' for p in PERCENTILES] + ['max']:
+                line += f'{stats[key] * 1e3:>8.3f}ms'
+            lines.append(line)
+        return lines
+
+
+    def export(self, path):
+        """Writes the trace to the file (path) in the Chrome trace-event
+        format. The number of the turn of each event is in its args."""
+        events = [{'name': name, 'ph': 'X', 'ts': start / 1e3, 'dur': dur / 1e3,
+                   'pid': 0, 'tid': 0, 'args': {'turn': turn}}
+                  for name, start, dur, turn in self.trace]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,113 @@
+"""
+Game recordings.
+
+A recording holds what is needed to play a game again exactly: the dungeon
+file, the seed of the game (see Game.rng), and every event which changed the
+state of the game, in order: the hero commands returned by Game.read_command
+and the console commands which change the state (reset, undo, redo, load). It
+ends with the digest of the final state (see Game.digest), which a replay
+compares its own final state with (see replay.py).
+
+The file format (all integers little-endian):
+- a header, see HEADER, followed by the path of the dungeon file in UTF-8
+- the events: one byte each, the index of the event in EVENTS. A LOAD is
+  followed by the length of the loaded snapshot (see LENGTH) and by the
+  snapshot itself, in the format of savegame.
+- END, followed by the digest of the final state. A recording cut short (the
+  process was killed) has no END.
+
+Reading a recording runs no code from it: the snapshots of the LOAD events are
+decoded by savegame.loads, which only reads its explicit format, so recordings
+can be shared, as with bug reports.
+"""
+
+import os
+import struct
+
+import savegame
+
+
+MAGIC = b'DUNR'
+VERSION = 3
+
+# magic, version, seed, length of the path of the dungeon file
+HEADER = struct.Struct('<4sHQH')
+LENGTH = struct.Struct('<I')
+
+_DIRECTIONS = ('up', 'down', 'left', 'right')
+
+RESET, UNDO, REDO, LOAD = 'reset', 'undo', 'redo', 'load'
+
+# the hero commands, then the console events
+EVENTS = (_DIRECTIONS
+          + tuple((by, d) for by in ('weapon', 'spell', 'fist')
+                  for d in _DIRECTIONS)
+          + (RESET, UNDO, REDO, LOAD))
+_CODES = {event: code for code, event in enumerate(EVENTS)}
+
+END = 0xff
+
+
+class Recorder:
+    def __init__(self, path, dungeon, seed):
+        """Starts recording a game on the dungeon file (dungeon) with the seed
+        (seed) to the file (path)."""
+        self.file = open(path, 'wb')
+        dungeon = os.path.abspath(dungeon).encode()
+        self.file.write(HEADER.pack(MAGIC, VERSION, seed, len(dungeon)))
+        self.file.write(dungeon)
+
+
+    def event(self, event):
+        """Records (event), a hero command or one of {RESET, UNDO, REDO}."""
+        self.file.write(bytes((_CODES[event],)))
+
+
+    def load(self, path):
+        """Records the loading of the saved game in the file (path)."""
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.file.write(bytes((_CODES[LOAD],)) + LENGTH.pack(len(data)) + data)
+
+
+    def close(self, digest):
+        """Ends the recording. (digest) is the digest of the final state."""
+        self.file.write(bytes((END,)) + digest)
+        self.file.close()
+
+
+def read(path):
+    """Returns (<dungeon path>, <seed>, <events>, <digest>), where
+    <events> is the list of the recorded events, in which a LOAD is the pair
+    (LOAD, <snapshot>), and <digest> is the digest of the final state, or None
+    if the recording is cut short. Raises ValueError if (path) is not a
+    recording."""
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        magic, version, seed, path_len = HEADER.unpack_from(data)
+    except struct.error as e:
+        raise ValueError(f'{path}: not a recording') from e
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f'{path}: not a version {VERSION} recording')
+    i = HEADER.size + path_len
+    dungeon = data[HEADER.size:i].decode()
+
+    events, digest, load = [], None, _CODES[LOAD]
+    while i < len(data):
+        code = data[i]
+        i += 1
+        if code == END:
+            digest = data[i:]
+            break
+        elif code == load:
+            length, = LENGTH.unpack_from(data, i)
+            i += LENGTH.size
+            events.append((LOAD, savegame.loads(data[i:i + length], path)[1]))
+            i += length
+        elif code < len(EVENTS):
+            events.append(EVENTS[code])
+        else:
+            raise ValueError(f'{path}: invalid event {code}')
+    return dungeon, seed, events, digest
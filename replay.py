@@ -0,0 +1,72 @@
+"""
+Replays recordings (see recording) headlessly, as fast as possible, and checks
+that each of them ends in the state it was recorded with (see Game.digest).
+Reports the time the turns took.
+
+Usage: py replay.py <recording> ...
+
+The exit status is 1 if a replay did not end in the recorded state.
+"""
+
+import sys
+import time
+
+import recording
+import undo
+
+from game import Game
+
+
+def replay(path):
+    """Replays the recording in the file (path). Returns a dict of results; its
+    'verified' entry is None if the recording has no final state to check."""
+
+    dungeon, seed, events, digest = recording.read(path)
+    game = Game(dungeon, headless=True, seed=seed)
+    if recording.UNDO in events or recording.REDO in events:
+        game.history = undo.History(game)
+
+    turns = 0
+    start = time.perf_counter()
+    for event in events:
+        if event == recording.RESET:
+            game.reset()
+        elif event == recording.UNDO:
+            game.history.undo()
+        elif event == recording.REDO:
+            game.history.redo()
+        elif isinstance(event, tuple) and event[0] == recording.LOAD:
+            game.record()
+            game.restore(event[1])
+        else:
+            game.step(event)
+            turns += 1
+    elapsed = time.perf_counter() - start
+
+    return {'recording': path,
+            'turns': turns,
+            'secs': elapsed,
+            'turns_per_sec': turns / elapsed if elapsed else float('inf'),
+            'verified': None if digest is None else game.digest() == digest}
+
+
+def main(argv):
+    if not argv:
+        print('usage: py replay.py <recording> ...', file=sys.stderr)
+        return 2
+
+    status = 0
+    print(f'{"recording":<30}{"turns":>8}{"turns/s":>14}  state')
+    for path in argv:
+        result = replay(path)
+        verified = {None: 'unchecked', True: 'ok', False: 'MISMATCH'}[
+            result['verified']]
+        if result['verified'] is False:
+            status = 1
+        print(f'{result["recording"]:<30}{result["turns"]:>8}'
+              f'{result["turns_per_sec"]:>14.0f}  {verified}')
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
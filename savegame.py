@@ -0,0 +1,234 @@
+"""
+Saved games.
+
+A saved game is a Game.snapshot together with the absolute path of the dungeon
+file it was played on. On disk it is:
+- MAGIC
+- a version byte
+- the zlib compression of:
+  - the length of the document, see LENGTH
+  - the document: a JSON object holding the dungeon path and every part of the
+    snapshot which is not a flat array (the hero, the treasures, the loot
+    tables, the state of the random generator), and the length of each blob
+  - the blobs: the flat arrays of the snapshot (see Dunmap.snapshot and
+    enemies.EnemyTable.snapshot), in the order of BLOBS, little-endian
+
+The format is explicit, so that loading a file never runs code from it (as
+unpickling would) and a game saved on one platform loads on any other: the
+arrays are saved with their fixed-width typecodes, in one byte order. The flat
+arrays compress well: most of a map is walkable.
+"""
+
+import os
+import sys
+import json
+import zlib
+import random
+import array
+import struct
+import itertools
+
+import loot
+import enemies
+import treasures
+import utils
+
+
+MAGIC = b'DUNS'
+VERSION = 4
+
+LENGTH = struct.Struct('<I')
+
+# the blobs, as (<part of the snapshot>, <name>, <typecode>)
+BLOBS = ((None, 'entities', 'q'),
+         ('dunmap', 'kinds', 'B'),
+         ('dunmap', 'eids', 'I'),
+         ('dunmap', 'charbuf', 'B'),
+         *(('enemies', name, enemies.TYPECODE) for name in enemies.ARRAY_COLUMNS),
+         ('enemies', 'behaviors', 'B'))
+
+# the kinds of the positions holding an entity, and the largest kind (see
+# Dunmap.kinds)
+_KIND_HERO, _KIND_ENEMY, _KIND_CHEST = 2, 3, 4
+_MAX_KIND = _KIND_CHEST
+
+# how the snapshot describes the entities which are not enemies (see
+# Game.snapshot): no entity, the hero, and the chest k as (_CHEST_ENTITY - k)
+_NO_ENTITY, _HERO_ENTITY, _CHEST_ENTITY = -1, -2, -3
+
+# the indexes of the attributes of the hero in Hero.state: the numbers, the
+# treasures and the position
+_HERO_NUMBERS = range(6)
+_HERO_TREASURES = (6, 7)
+_HERO_POS = 8
+
+
+def save(path, dungeon, snapshot):
+    """Saves (snapshot), a snapshot of a game on the dungeon file (dungeon), to
+    the file (path). The file is replaced atomically."""
+    utils.write_atomically(path, dumps(dungeon, snapshot))
+
+
+def dumps(dungeon, snapshot):
+    """Returns the content of the saved game file of (snapshot), a snapshot of
+    a game on the dungeon file (dungeon)."""
+
+    found = {}
+    def index(treasure):
+        dct = treasures.to_dict(treasure)
+        return found.setdefault(json.dumps(dct, sort_keys=True), len(found))
+
+    hero = list(snapshot['hero'])
+    for i in _HERO_TREASURES:
+        hero[i] = index(hero[i])
+    table = snapshot['enemies']
+    chest_tables = snapshot['loot']
+    treasure_dicts, declarations = loot.declare(chest_tables)
+    blobs = [_little_endian(_part(snapshot, part)[name], typecode)
+             for part, name, typecode in BLOBS]
+    document = {
+        'dungeon': os.path.abspath(dungeon),
+        'hero': hero,
+        'weapons': [index(t) for t in table['weapons']],
+        'spells': [index(t) for t in table['spells']],
+        'treasures': [json.loads(key) for key in found],
+        'loot': {'chests': [t.id for t in chest_tables],
+                 'treasures': treasure_dicts,
+                 'tables': declarations},
+        'dims': snapshot['dunmap']['dims'],
+        'gateway_pos': snapshot['dunmap']['gateway_pos'],
+        'rng': snapshot['rng'],
+        'blobs': [len(blob) for blob in blobs]}
+    document = json.dumps(document, separators=(',', ':')).encode()
+    return (MAGIC + bytes((VERSION,))
+            + zlib.compress(b''.join((LENGTH.pack(len(document)), document,
+                                      *blobs))))
+
+
+def load(path):
+    """Returns the pair (<dungeon path>, <snapshot>) saved in the file (path).
+    Raises ValueError if (path) is not a saved game."""
+    with open(path, 'rb') as f:
+        return loads(f.read(), path)
+
+
+def loads(data, path='<bytes>'):
+    """Like load, for the content (data) of a saved game file."""
+    header = MAGIC + bytes((VERSION,))
+    if not data.startswith(header):
+        raise ValueError(f'{path}: not a version {VERSION} saved game')
+    try:
+        return _decode(zlib.decompress(data[len(header):]))
+    except (zlib.error, struct.error, UnicodeDecodeError, KeyError, IndexError,
+            TypeError, ValueError) as e:
+        raise ValueError(f'{path}: corrupt saved game') from e
+
+
+def _decode(data):
+    length, = LENGTH.unpack_from(data)
+    start = LENGTH.size + length
+    document = json.loads(data[LENGTH.size:start].decode())
+
+    snapshot = {'dunmap': {}, 'enemies': {}}
+    nrows, ncols = document['dims']
+    sizes = document['blobs']
+    if len(sizes) != len(BLOBS) or start + sum(sizes) != len(data):
+        raise ValueError('inconsistent blobs')
+    for (part, name, typecode), size in zip(BLOBS, sizes):
+        blob = _little_endian(data[start:start + size], typecode)
+        start += size
+        _part(snapshot, part)[name] = blob
+    cells = nrows * ncols
+    dunmap, table = snapshot['dunmap'], snapshot['enemies']
+    nenemies = len(table['behaviors'])
+    if (len(dunmap['kinds']) != cells or len(dunmap['charbuf']) != cells
+            or len(dunmap['eids']) != cells * array.array('I').itemsize
+            or any(len(table[name]) != nenemies * array.array(typecode).itemsize
+                   for part, name, typecode in BLOBS
+                   if part == 'enemies' and name != 'live')):
+        raise ValueError('inconsistent dimensions')
+    dunmap['dims'] = (nrows, ncols)
+    gateway_pos = document['gateway_pos']
+    dunmap['gateway_pos'] = None if gateway_pos is None else tuple(gateway_pos)
+
+    found = [treasures.parse_dict(dct) for dct in document['treasures']]
+    hero = document['hero']
+    if not all(type(hero[i]) is int for i in _HERO_NUMBERS):
+        raise ValueError('invalid hero')
+    for i in _HERO_TREASURES:
+        hero[i] = found[hero[i]]
+    hero[_HERO_POS] = tuple(hero[_HERO_POS])
+    snapshot['hero'] = tuple(hero)
+    table['weapons'] = tuple(found[i] for i in document['weapons'])
+    table['spells'] = tuple(found[i] for i in document['spells'])
+    if len(table['weapons']) != nenemies or len(table['spells']) != nenemies:
+        raise ValueError('inconsistent enemies')
+
+    chests = document['loot']
+    tables = loot.compile_tables(chests['treasures'], chests['tables'])
+    snapshot['loot'] = tuple(tables[table_id] for table_id in chests['chests'])
+    version, state, gauss_next = document['rng']
+    snapshot['rng'] = (version, tuple(state), gauss_next)
+    random.Random().setstate(snapshot['rng'])
+    _check_references(snapshot, nenemies)
+    return document['dungeon'], snapshot
+
+
+def _check_references(snapshot, nenemies):
+    """Raises ValueError unless every reference of (snapshot) leads somewhere:
+    the positions to the entities, the entities to the enemies and the chests,
+    and the positions of the hero and of the gateway into the map."""
+
+    dunmap = snapshot['dunmap']
+    nrows, ncols = dunmap['dims']
+    for pos in (snapshot['hero'][_HERO_POS], dunmap['gateway_pos']):
+        if pos is not None and not (
+                len(pos) == 2 and 0 <= pos[0] < nrows and 0 <= pos[1] < ncols):
+            raise ValueError(f'position out of the map: {pos}')
+
+    entities = array.array('q')
+    entities.frombytes(snapshot['entities'])
+    if (not entities or entities[0] != _NO_ENTITY
+            or max(entities) >= nenemies
+            or min(entities) < _CHEST_ENTITY - len(snapshot['loot']) + 1):
+        raise ValueError('invalid entities')
+    kinds = dunmap['kinds']
+    if max(kinds) > _MAX_KIND:
+        raise ValueError('invalid kinds')
+    eids = array.array('I')
+    eids.frombytes(dunmap['eids'])
+    # the positions holding an entity must hold one of their kind
+    holding = kinds.translate(_HOLDING)
+    for kind, eid in zip(itertools.compress(kinds, holding),
+                         itertools.compress(eids, holding)):
+        if eid >= len(entities):
+            raise ValueError(f'invalid entity id: {eid}')
+        entity = entities[eid]
+        if kind == _KIND_ENEMY:
+            valid = entity >= 0
+        elif kind == _KIND_HERO:
+            valid = entity == _HERO_ENTITY
+        else:
+            valid = entity <= _CHEST_ENTITY
+        if not valid:
+            raise ValueError(f'entity {eid} of the wrong kind')
+
+
+# maps the kinds of the positions holding an entity to 1, the others to 0
+_HOLDING = bytes(kind in (_KIND_HERO, _KIND_ENEMY, _KIND_CHEST)
+                 for kind in range(256))
+
+
+def _part(snapshot, part):
+    return snapshot if part is None else snapshot[part]
+
+
+def _little_endian(blob, typecode):
+    """Returns the bytes (blob) of an array of (typecode) converted between the
+    native byte order and little-endian, both ways."""
+    if sys.byteorder == 'little' or array.array(typecode).itemsize == 1:
+        return blob
+    column = array.array(typecode)
+    column.frombytes(blob)
+    column.byteswap()
+    return column.tobytes()
@@ -0,0 +1,81 @@
+"""
+A spatial index over the actors of a game.
+
+The map is cut into square buckets of (cell_size) positions on a side, and each
+bucket holds the actors standing in it. A query only visits the buckets
+overlapping the queried area, so that its cost depends on the size of the area
+and on the number of actors in it, not on the size of the map or on the total
+number of actors.
+
+Buckets are dicts used as insertion-ordered sets, so that queries return the
+actors in the same order whenever the same moves were made.
+"""
+
+
+class SpatialHash:
+    def __init__(self, cell_size=8):
+        self.cell_size = cell_size
+        self.buckets = {}
+
+
+    def _bucket_key(self, pos):
+        return (pos[0] // self.cell_size, pos[1] // self.cell_size)
+
+
+    def add(self, actor, pos):
+        self.buckets.setdefault(self._bucket_key(pos), {})[actor] = None
+
+
+    def remove(self, actor, pos):
+        key = self._bucket_key(pos)
+        bucket = self.buckets[key]
+        del bucket[actor]
+        if not bucket:
+            del self.buckets[key]
+
+
+    def move(self, actor, old_pos, new_pos):
+        if self._bucket_key(old_pos) != self._bucket_key(new_pos):
+            self.remove(actor, old_pos)
+            self.add(actor, new_pos)
+
+
+    def __len__(self):
+        return sum(map(len, self.buckets.values()))
+
+    ########################################
+    # queries
+
+    def in_rect(self, top, left, bottom, right):
+        """Returns the list of the actors whose positions (r, c) are such that
+        (top <= r <= bottom) and (left <= c <= right)."""
+        return [actor for actor in self._candidates(top, left, bottom, right)
+                if top <= actor.pos[0] <= bottom and left <= actor.pos[1] <= right]
+
+
+    def in_radius(self, pos, radius):
+        """Returns the list of the actors within (radius) of (pos) (euclidean
+        distance)."""
+        row, col = pos
+        radius_sq = radius * radius
+        return [actor for actor in self._candidates(row - radius, col - radius,
+                                                    row + radius, col + radius)
+                if (actor.pos[0] - row) ** 2 + (actor.pos[1] - col) ** 2 <= radius_sq]
+
+
+    def _candidates(self, top, left, bottom, right):
+        """Yields the actors of the buckets overlapping the rectangle."""
+        size, buckets = self.cell_size, self.buckets
+        brows = range(top // size, bottom // size + 1)
+        bcols = range(left // size, right // size + 1)
+        if len(brows) * len(bcols) > len(buckets):
+            # fewer buckets in use than overlapping, visit those instead
+            for (brow, bcol), bucket in sorted(buckets.items()):
+                if brow in brows and bcol in bcols:
+                    yield from bucket
+            return
+        for brow in brows:
+            for bcol in bcols:
+                bucket = buckets.get((brow, bcol))
+                if bucket is not None:
+                    yield from bucket
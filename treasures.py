@@ -1,20 +1,27 @@
-import random
-
 class TreasureChest:
-    def __init__(self, treasures):
-        self.treasures = treasures
+    # chests have no state of their own: all the chests drawing from the same
+    # loot.LootTable (self.table) are one object
+    __slots__ = ('table',)
+
+    def __init__(self, table):
+        self.table = table
 
-    def open(self):
-        # returns a random treasure from self.treasures
-        treasure = random.choice(self.treasures)
-        return treasure
+    def open(self, rng):
+        # returns a random treasure from self.table, drawn with the
+        # random.Random (rng)
+        return self.table.draw(rng)
 
 class Treasure:
-    # base class for all treasures
+    # base class for all treasures. Treasures are never modified once created,
+    # which is what allows parse_dict to share identical ones.
+    __slots__ = ()
+
     def give_to_actor(self, actor):
         raise NotImplementedError
     
 class HealthPotion(Treasure):
+    __slots__ = ('amount',)
+
     def __init__(self, amount):
         self.amount = amount
 
@@ -22,6 +29,8 @@ class HealthPotion(Treasure):
         actor.heal(self.amount)
 
 class ManaPotion(Treasure):
+    __slots__ = ('amount',)
+
     def __init__(self, amount):
         self.amount = amount
 
@@ -29,6 +38,8 @@ class ManaPotion(Treasure):
         actor.add_mana(self.amount)
 
 class Weapon(Treasure):
+    __slots__ = ('name', 'damage')
+
     def __init__(self, name, damage):
         self.name = name
         self.damage = damage
@@ -39,7 +50,9 @@ class Weapon(Treasure):
     def __str__(self):
         return self.name
 
-class Spell:
+class Spell(Treasure):
+    __slots__ = ('name', 'damage', 'mana_cost', 'cast_range')
+
     def __init__(self, name, damage, mana_cost, cast_range):
         self.name = name
         self.damage = damage
@@ -51,15 +64,38 @@ class Spell:
 
     def __str__(self):
         return self.name
-        
+
+class AreaSpell(Spell):
+    # bursts where it lands, hurting every actor within (radius) of that spot
+    __slots__ = ('radius',)
+
+    def __init__(self, name, damage, mana_cost, cast_range, radius):
+        super().__init__(name, damage, mana_cost, cast_range)
+        self.radius = radius
+
+# the treasures created by parse_dict, keyed by their definition
+_flyweights = {}
+
 def parse_dict(dct):
-    """Returns the treasure corresponding to (dct)."""
+    """Returns the treasure corresponding to (dct). Identical definitions give
+    the same treasure object."""
+    key = tuple(sorted(dct.items()))
+    treasure = _flyweights.get(key)
+    if treasure is None:
+        treasure = _flyweights[key] = _parse_dict(dct)
+    return treasure
+
+def _parse_dict(dct):
     treasure_type = dct['type']
     if treasure_type == 'weapon':
         return Weapon(dct['name'], dct['damage'])
     elif treasure_type == 'spell':
         return Spell(*(dct[attr] for attr in
                        ('name', 'damage', 'mana_cost', 'cast_range')))
+    elif treasure_type == 'area_spell':
+        return AreaSpell(*(dct[attr] for attr in
+                           ('name', 'damage', 'mana_cost', 'cast_range',
+                            'radius')))
     elif treasure_type == 'health_potion':
         return HealthPotion(dct['amount'])
     elif treasure_type == 'mana_potion':
@@ -67,6 +103,26 @@ def parse_dict(dct):
     else:
         raise ValueError(f'invalid treasure type: {treasure_type}')
 
-default_weapon = Weapon('nil', 0)
-default_spell = Spell('nil', 0, 0, 1)
+# the type and the attributes of the definition of each class of treasures,
+# subclasses first
+_DEFINITIONS = ((AreaSpell, 'area_spell',
+                 ('name', 'damage', 'mana_cost', 'cast_range', 'radius')),
+                (Spell, 'spell', ('name', 'damage', 'mana_cost', 'cast_range')),
+                (Weapon, 'weapon', ('name', 'damage')),
+                (HealthPotion, 'health_potion', ('amount',)),
+                (ManaPotion, 'mana_potion', ('amount',)))
+
+def to_dict(treasure):
+    """Returns the definition of (treasure), which parse_dict turns back into
+    it."""
+    for cls, treasure_type, attrs in _DEFINITIONS:
+        if isinstance(treasure, cls):
+            dct = {attr: getattr(treasure, attr) for attr in attrs}
+            dct['type'] = treasure_type
+            return dct
+    raise ValueError(f'invalid treasure: {treasure!r}')
+
+default_weapon = parse_dict({'type': 'weapon', 'name': 'nil', 'damage': 0})
+default_spell = parse_dict({'type': 'spell', 'name': 'nil', 'damage': 0,
+                            'mana_cost': 0, 'cast_range': 1})
 defaults = (default_weapon, default_spell)
@@ -0,0 +1,417 @@
+"""
+Multi-level undo.
+
+A History remembers the states a Game went through, up to a bounded number of
+them, so that the player can go back and forth between them (see Game.console).
+
+Recording a state costs what changed since the previous one, not the size of
+the game. The history keeps a copy of the latest state of the game it saw, its
+base (see _Base), and the other states as deltas: the values a state has where
+it differs from its neighbour on the way to the base. The game tells what may
+have changed since the base: the rows of the map assigned to (see
+Dunmap.touched_rows) and the enemies written to (see
+enemies.EnemyTable.touched). Only those are compared with the base. After a
+restore of the game (a reset, a load), or when most enemies were touched, the
+whole state is compared with the base instead, column by column.
+
+The mana of a sleeping enemy is kept as the table holds it, not regenerated
+yet, together with the clock the enemy fell asleep at (see activity). Recording
+a state thus settles no sleeping enemy, and putting a state back puts its
+sleeping enemies back to sleep.
+"""
+
+import copy
+import array
+import operator
+import itertools
+import collections
+
+import enemies
+
+
+# the default number of states kept
+SIZE = 256
+
+# the columns of an enemies.EnemyTable kept by the history: the typed arrays,
+# except for the live enemies which follow from the health, and the others
+_ARRAYS = tuple(name for name in enemies.ARRAY_COLUMNS if name != 'live')
+_COLUMNS = _ARRAYS + ('behaviors', 'weapons', 'spells')
+
+# the parts of a state replaced whole by a delta
+_SCALARS = ('hero', 'rng', 'clock', 'gateway_pos', 'entities', 'loot')
+
+_EID_SIZE = array.array('I').itemsize
+
+# when more than this fraction of the enemies were touched, as when they all
+# fall asleep after a restore, comparing the whole table is the cheaper
+CROWDED = 0.1
+
+
+class History:
+    """
+    Attributes:
+    - game
+    - past: the recorded states, the most recent last. The oldest ones are
+      forgotten once there are more than (size) of them.
+    - future: the states undone, the most recently undone last
+
+    The states on top of (past) and (future) are deltas from the base, the
+    others are deltas from the state above them.
+    """
+
+    def __init__(self, game, size=SIZE):
+        self.game = game
+        self.past = collections.deque(maxlen=size)
+        self.future = []
+        self._base = None
+
+
+    def record(self):
+        """Remembers the current state of the game, which is about to change.
+        The states undone so far cannot be redone anymore."""
+        self._update()
+        self.past.append({})
+        self.future.clear()
+
+
+    def undo(self):
+        """Puts the game back in the most recently recorded state. Returns False
+        if there is none."""
+        return self._move(self.past, self.future)
+
+
+    def redo(self):
+        """Cancels the most recent undo. Returns False if there is none."""
+        return self._move(self.future, self.past)
+
+
+    def clear(self):
+        self.past.clear()
+        self.future.clear()
+
+    ########################################
+    # deltas
+
+    def _update(self):
+        """Brings the base up to date with the game, and the deltas on top of
+        the stacks with the base."""
+        game, base = self.game, self._base
+        if base is None:
+            self._base = _Base(game)
+            return
+        if base.follows(game):
+            delta = base.update(game)
+        elif base.fits(game):
+            delta = base.update(game, restored=True)
+        else:
+            # a game of another size
+            base.dunmap = None
+            delta = {'base': base}
+            self._base = _Base(game)
+        if delta:
+            for stack in (self.past, self.future):
+                if stack:
+                    stack[-1] = self._compose(delta, stack[-1])
+
+
+    def _move(self, source, target):
+        """Puts the game in the state on top of (source), and the current state
+        on top of (target)."""
+        if not source:
+            return False
+        self._update()
+        delta = source.pop()
+        if 'base' in delta:
+            # the bases in the deltas are never modified, they may be shared
+            self._base.dunmap = None
+            target.append({'base': self._base})
+            self._base = delta['base'].copy()
+        else:
+            target.append(self._base.apply(delta))
+        self._base.restore(self.game)
+        return True
+
+
+    def _compose(self, first, second):
+        """Returns the delta from the base applying the delta (first), then
+        (second)."""
+        if not first or 'base' in second:
+            return second
+        elif not second:
+            return first
+        elif 'base' in first:
+            base = first['base'].copy()
+        elif 'sleeping' in first and 'asleep' in second:
+            # the sleeping enemies of (first) would come after (second)'s
+            base = self._base.copy()
+            base.apply(first)
+        else:
+            delta = {**first, **second}
+            for name in ('rows', 'enemies', 'sleeping'):
+                if name in first and name in second:
+                    delta[name] = {**first[name], **second[name]}
+            return delta
+        base.apply(second)
+        return {'base': base}
+
+
+class _Base:
+    """
+    A copy of a state of a game, kept up to date with it at the cost of what
+    changed (see _Base.update).
+
+    A delta from a base to another state is a dict holding, when they differ:
+    - the _SCALARS
+    - 'rows': maps the index of each row of the map to the triple of its
+      'kinds', 'eids' and 'charbuf' bytes in the other state
+    - 'enemies': maps the index of each enemy to the tuple of its values in the
+      _COLUMNS in the other state
+    - 'asleep': the (asleep) of the other state, packed (see _pack), and then
+      'sleeping', which maps the index of each enemy to the clock it fell
+      asleep at, or None
+    or, when the other state is a game of another size, only 'base', the base
+    of the other state.
+
+    Attributes:
+    - dunmap: the Dunmap of the game, whose changes are tracked
+    - dims, gateway_pos: as in Dunmap.snapshot
+    - kinds, eids, charbuf: the flat arrays of the map as bytearrays
+    - entities: the array of the descriptions of the entities of the map, see
+      Game.describe
+    - columns: maps the _COLUMNS of the enemy table to copies of them
+    - asleep, clock: as in activity.ActivityScheduler
+    - hero, rng, loot: as in Game.snapshot
+    """
+
+    def __init__(self, game):
+        dunmap, table, activity = game.dunmap, game.enemy_table, game.activity
+        self.dims = (dunmap.nrows, dunmap.ncols)
+        self.gateway_pos = dunmap.gateway_pos
+        self.kinds = bytearray(dunmap.kinds)
+        self.eids = bytearray(dunmap.eids.tobytes())
+        self.charbuf = bytearray(dunmap.charbuf)
+        self.entities = game.describe(dunmap.entities)
+        self.columns = {name: getattr(table, name)[:] for name in _COLUMNS}
+        self.asleep = dict(activity.asleep)
+        self.clock = activity.clock
+        self.hero = game.hero.state()
+        self.rng = game.rng.getstate()
+        self.loot = tuple(chest.table for chest in game.chests)
+        self._track(game)
+
+
+    def copy(self):
+        """Returns a copy of (self), which tracks no game."""
+        base = copy.copy(self)
+        base.dunmap = None
+        for name in ('kinds', 'eids', 'charbuf', 'asleep'):
+            setattr(base, name, copy.copy(getattr(self, name)))
+        base.columns = {name: column[:]
+                        for name, column in self.columns.items()}
+        return base
+
+
+    def follows(self, game):
+        """Whether the changes of (game) since (self) was last up to date with
+        it are tracked. New entities of the map are not (they are only ever
+        added when the game is built)."""
+        dunmap = game.dunmap
+        return (dunmap is self.dunmap and dunmap.touched_rows is not None
+                and game.enemy_table.touched is not None
+                and len(dunmap.entities) == len(self.entities))
+
+
+    def fits(self, game):
+        """Whether (game) has the size of (self): the same dimensions and
+        number of enemies."""
+        dunmap = game.dunmap
+        return (self.dims == (dunmap.nrows, dunmap.ncols)
+                and len(game.enemy_table) == len(self.columns['health']))
+
+
+    def update(self, game, restored=False):
+        """Brings (self) up to date with (game), which it must follow, or only
+        fit if (restored) is True. Returns the delta from the new state of
+        (self) to the old one."""
+
+        dunmap, table, activity = game.dunmap, game.enemy_table, game.activity
+        delta = {}
+        scalars = {'hero': game.hero.state(), 'rng': game.rng.getstate(),
+                   'clock': activity.clock, 'gateway_pos': dunmap.gateway_pos}
+        if restored:
+            scalars['entities'] = game.describe(dunmap.entities)
+            scalars['loot'] = tuple(chest.table for chest in game.chests)
+        for name, value in scalars.items():
+            old = getattr(self, name)
+            if value != old:
+                delta[name] = old
+                setattr(self, name, value)
+
+        ncols = self.dims[1]
+        rows = {}
+        for row in range(self.dims[0]) if restored else dunmap.touched_rows:
+            start, end = row * ncols, (row + 1) * ncols
+            value = (bytes(dunmap.kinds[start:end]),
+                     dunmap.eids[start:end].tobytes(),
+                     bytes(dunmap.charbuf[start:end]))
+            old = self._row(row)
+            if value != old:
+                rows[row] = old
+                self._set_row(row, value)
+        if rows:
+            delta['rows'] = rows
+
+        columns = [getattr(table, name) for name in _COLUMNS]
+        if restored or len(table.touched) > CROWDED * len(table):
+            # the enemies which differ, found column by column
+            indexes = set()
+            for name, column in zip(_COLUMNS, columns):
+                if column != self.columns[name]:
+                    indexes.update(itertools.compress(
+                        range(len(table)),
+                        map(operator.ne, column, self.columns[name])))
+            sleepers = self._sleepers(activity.asleep)
+            if sleepers is None:
+                delta['asleep'] = _pack(self.asleep)
+                self.asleep = dict(activity.asleep)
+                sleepers = ()
+        else:
+            indexes = sleepers = table.touched
+        sleeping = {}
+        for index in sleepers:
+            since, old = activity.asleep.get(index), self.asleep.get(index)
+            if since != old:
+                sleeping[index] = old
+                self._set_since(index, since)
+        if sleeping:
+            delta['sleeping'] = sleeping
+        indexes = list(indexes)
+        changed = {}
+        for index, value, old in zip(indexes, _values(indexes, columns),
+                                     self._values(indexes)):
+            if value != old:
+                changed[index] = old
+                self._set_values(index, value)
+        if changed:
+            delta['enemies'] = changed
+        self._track(game)
+        return delta
+
+
+    def apply(self, delta):
+        """Puts (self) in the state (delta) leads to, see _Base. Returns the
+        delta back."""
+        # the delta back is taken before anything changes, since the values of
+        # 'sleeping' come after 'asleep'
+        inverse = {name: getattr(self, name)
+                   for name in _SCALARS if name in delta}
+        if 'asleep' in delta:
+            inverse['asleep'] = _pack(self.asleep)
+        if 'rows' in delta:
+            inverse['rows'] = {row: self._row(row) for row in delta['rows']}
+        if 'enemies' in delta:
+            inverse['enemies'] = dict(zip(delta['enemies'],
+                                          self._values(delta['enemies'])))
+        if 'sleeping' in delta:
+            inverse['sleeping'] = {index: self.asleep.get(index)
+                                   for index in delta['sleeping']}
+
+        for name in _SCALARS:
+            if name in delta:
+                setattr(self, name, delta[name])
+        if 'asleep' in delta:
+            self.asleep = dict(zip(*delta['asleep']))
+        for index, since in delta.get('sleeping', {}).items():
+            self._set_since(index, since)
+        for row, value in delta.get('rows', {}).items():
+            self._set_row(row, value)
+        for index, value in delta.get('enemies', {}).items():
+            self._set_values(index, value)
+        return inverse
+
+
+    def restore(self, game):
+        """Puts (game) in the state of (self), and tracks its changes from
+        there."""
+        columns = self.columns
+        table = {name: columns[name].tobytes() for name in _ARRAYS}
+        table['behaviors'] = bytes(columns['behaviors'])
+        table['weapons'] = tuple(columns['weapons'])
+        table['spells'] = tuple(columns['spells'])
+        game.restore({'dunmap': {'dims': self.dims,
+                                 'kinds': bytes(self.kinds),
+                                 'eids': bytes(self.eids),
+                                 'charbuf': bytes(self.charbuf),
+                                 'gateway_pos': self.gateway_pos},
+                      'entities': self.entities.tobytes(),
+                      'hero': self.hero,
+                      'enemies': table,
+                      'loot': self.loot,
+                      'rng': self.rng})
+        game.activity.restore(self.clock, self.asleep)
+        self._track(game)
+
+
+    def _sleepers(self, asleep):
+        """Returns the indexes of the enemies which fell asleep or woke up in
+        (asleep), compared with (self.asleep), or None if there are so many
+        that keeping all of (self.asleep) is the smaller."""
+        old = self.asleep
+        if asleep == old:
+            return ()
+        # at least as many changed as the sizes differ by
+        if abs(len(asleep) - len(old)) >= len(old):
+            return None
+        sleepers = {index for index, _ in old.items() ^ asleep.items()}
+        return sleepers if len(sleepers) < len(old) else None
+
+
+    def _track(self, game):
+        """Starts tracking the changes of (game), which (self) is up to date
+        with."""
+        self.dunmap = game.dunmap
+        self.dunmap.touched_rows = set()
+        game.enemy_table.touched = set()
+
+    ########################################
+    # rows and enemies
+
+    def _row(self, row):
+        start, end = row * self.dims[1], (row + 1) * self.dims[1]
+        return (bytes(self.kinds[start:end]),
+                bytes(self.eids[start * _EID_SIZE:end * _EID_SIZE]),
+                bytes(self.charbuf[start:end]))
+
+
+    def _set_row(self, row, value):
+        start, end = row * self.dims[1], (row + 1) * self.dims[1]
+        (self.kinds[start:end], self.eids[start * _EID_SIZE:end * _EID_SIZE],
+         self.charbuf[start:end]) = value
+
+
+    def _values(self, indexes):
+        return _values(indexes, self.columns.values())
+
+
+    def _set_values(self, index, values):
+        for column, value in zip(self.columns.values(), values):
+            column[index] = value
+
+
+    def _set_since(self, index, since):
+        if since is None:
+            self.asleep.pop(index, None)
+        else:
+            self.asleep[index] = since
+
+
+def _values(indexes, columns):
+    """Returns an iterator of the tuples of the values of the enemies (indexes)
+    in (columns), the _COLUMNS of a table."""
+    return zip(*[map(column.__getitem__, indexes) for column in columns])
+
+
+def _pack(asleep):
+    """Returns the pair of the arrays of the keys and of the values of
+    (asleep), which take less memory than the dict."""
+    return (array.array('q', asleep.keys()), array.array('q', asleep.values()))
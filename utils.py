@@ -1,3 +1,4 @@
+import os
 import sys
 import curses
 
@@ -23,6 +24,22 @@ def relative_direction(pos1, pos2):
     else:
         return None
 
+
+def approach_direction(pos1, pos2):
+    """Returns the direction of a single step from (pos1) which brings it closer
+    to (pos2), moving along the axis on which they are further apart. Returns
+    None if (pos1 == pos2)."""
+
+    row1, col1 = pos1
+    row2, col2 = pos2
+    drow, dcol = row2 - row1, col2 - col1
+    if drow == dcol == 0:
+        return None
+    elif abs(dcol) >= abs(drow):
+        return 'right' if dcol > 0 else 'left'
+    else:
+        return 'down' if drow > 0 else 'up'
+
     
 def move_pos(pos, direction):
     if direction not in {'up', 'down', 'left', 'right'}:
@@ -36,20 +53,44 @@ def move_pos(pos, direction):
     return (pos[0] + dx_dy[0], pos[1] + dx_dy[1])
 
 
-logfile = 'log'
-def log(text):
-    with open(logfile, 'a') as f:
-        print(text, file=f)
-        
-# truncate 
-with open(logfile, 'w'):
-    pass
+def write_atomically(path, data):
+    """Replaces the content of the file (path) with the bytes (data), writing
+    them to a temporary file first, so that (path) is never left half written.
+    Raises OSError when the file cannot be written, after removing the
+    temporary file."""
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
 
 ####################
 """
 Attributes used:
 - items: the list of strings which are the item names
 - base
+
+Keys: up and down move the selection by a row, page up and page down by a
+screen, home and end to the first and last items. ENTER chooses the selected
+item and `q` goes back, unless a filter is being typed.
+
+Typing any other character filters the list: only the items containing the
+typed text (whatever the case) are shown, and the filter is shown on the last
+row. BACKSPACE removes the last character of the filter, ESCAPE removes the
+whole filter.
+
+The filter is searched incrementally: an index mapping every character to the
+items containing it, built when get is first called with the items, gives the
+matches of the first character of a filter, and each further character only
+searches the matches of the filter without it, which are kept so that
+BACKSPACE costs nothing.
+
+Only the screen rows whose content changed are drawn again (see List.drawn),
+so that a key press costs about the same whatever the number of items.
 """
 
 class List:
@@ -60,13 +101,31 @@ class List:
     base = None
     
     # The index of the currently selected item on the screen. The index of the
-    # actual item is (List.items) is (List.base + List.index)
+    # actual item in (List.items) is (List.matches[List.base + List.index])
     index = None
     
     # The screen where the list will be displayed.
     # Important: scr.keypad must be True.
     scr = None
 
+    # The indexes in (List.items) of the items shown, those matching the filter
+    matches = None
+
+    # The typed filter, and the pairs (<filter>, <its matches>) of the shorter
+    # filters it was typed through, each filter a prefix of the next
+    filter = ''
+    filters = None
+
+    # The lowercase items, and the index mapping every character to the sorted
+    # indexes of the lowercase items containing it. Both are kept from one call
+    # of get to the next, with a copy of the items they were built for
+    lowered = None
+    char_index = None
+    indexed = None
+
+    # (drawn[r]) is what screen row (r) shows, as the pair (<text>, <attr>)
+    drawn = None
+
 
     def get(items, scr=None):
         curses.curs_set(False)
@@ -78,68 +137,166 @@ class List:
         List.items = items
         List.base = 0
         List.index = 0
+        List.matches = range(len(items))
+        List.filter = ''
+        List.filters = []
+        List.build_index()
 
         # helper attributes
-        List.nrows, List.ncols = List.scr.getmaxyx()
+        List.resize()
         
         return List.main()
+
+
+    def build_index():
+        """Builds List.lowered and List.char_index, unless they were built
+        for the same items by an earlier call of get."""
+        if List.indexed == List.items:
+            return
+        List.indexed = list(List.items)
+        List.lowered = [item.lower() for item in List.items]
+        char_index = {}
+        for i, item in enumerate(List.lowered):
+            for char in set(item):
+                char_index.setdefault(char, []).append(i)
+        List.char_index = char_index
+
+
+    def resize():
+        nrows, List.ncols = List.scr.getmaxyx()
+        # the last row shows the filter, when there is room for it
+        List.nrows = max(1, nrows - 1)
+        List.drawn = [None] * nrows
+        List.scr.clear()
+        List.index = min(List.index, List.nrows - 1)
         
 
     def main():
         List.show()
         while True:
             key = List.scr.getkey().lower()
-            if key == 'q':
+            if key == 'q' and not List.filter:
                 return None
             elif key == 'key_up':
                 List.move('up')
             elif key == 'key_down':
                 List.move('down')
+            elif key == 'key_ppage':
+                List.move('up', List.nrows)
+            elif key == 'key_npage':
+                List.move('down', List.nrows)
+            elif key == 'key_home':
+                List.move('up', len(List.matches))
+            elif key == 'key_end':
+                List.move('down', len(List.matches))
+            elif key == 'key_resize':
+                List.resize()
             elif key == '\n':
-                item = List.items[List.base + List.index]
+                if not List.matches:
+                    curses.beep()
+                    continue
+                item = List.items[List.matches[List.base + List.index]]
                 List.end()
                 return item
+            elif key in ('key_backspace', '\b', '\x7f'):
+                List.set_filter(List.filter[:-1])
+            elif key == '\x1b':
+                List.set_filter('')
+            elif len(key) == 1 and key.isprintable():
+                List.set_filter(List.filter + key)
             List.show()
 
 
-    def move(direc):
+    def move(direc, steps=1):
+        """Moves the selection (steps) rows in (direc), as far as the list
+        allows."""
         rindex = List.index + List.base
         if direc == 'down':
-            if rindex == len(List.items) - 1:
-                curses.beep()
-            else:
-                if List.index == List.nrows - 1:
-                    List.base += 1
-                else:
-                    List.index += 1
+            target = min(rindex + steps, len(List.matches) - 1)
         elif direc == 'up':
-            if rindex == 0:
-                curses.beep()
-            else:
-                if List.index == 0:
-                    List.base -= 1
-                else:
-                    List.index -= 1
+            target = max(rindex - steps, 0)
         else:
             raise ValueError(f'Invalid direction: "{direc}"')
+        if target == rindex or not List.matches:
+            curses.beep()
+            return
+        # scroll as little as possible to keep the selection on the screen
+        if target < List.base:
+            List.base = target
+        elif target >= List.base + List.nrows:
+            List.base = target - List.nrows + 1
+        List.index = target - List.base
+
+
+    def set_filter(text):
+        """Shows only the items containing (text), whatever the case, and
+        selects the first one."""
+        if text == List.filter:
+            return
+        filters = List.filters
+        if not text:
+            del filters[:]
+            List.matches = range(len(List.items))
+        elif text.startswith(List.filter) and len(text) == len(List.filter) + 1:
+            # one more character: only the current matches can still match
+            if filters:
+                lowered = List.lowered
+                matches = [i for i in List.matches if text in lowered[i]]
+            else:
+                matches = List.char_index.get(text, [])
+            filters.append((text, matches))
+            List.matches = matches
+        else:
+            # fewer characters: go back to the matches of a shorter filter
+            while filters and not text.startswith(filters[-1][0]):
+                filters.pop()
+            if filters and filters[-1][0] == text:
+                List.matches = filters[-1][1]
+            else:
+                lowered = List.lowered
+                List.matches = [i for i in range(len(List.items))
+                                if text in lowered[i]]
+                filters[:] = [(text, List.matches)]
+        List.filter = text
+        List.base = List.index = 0
 
 
     def end():
         List.scr.clear(); List.scr.refresh()
         List.scr = List.items = List.base = List.index = None
+        List.matches = List.filters = List.drawn = None
+        List.filter = ''
 
 
     def at(index):
-        return List.items[List.base + index]
+        return List.items[List.matches[List.base + index]]
+
+
+    def draw_row(r, text, attr=0):
+        """Draws (text) on the screen row (r), unless it is already there."""
+        if List.drawn[r] == (text, attr):
+            return
+        List.drawn[r] = (text, attr)
+        # the last column of the last row cannot be written to
+        List.scr.addstr(r, 0, text[:List.ncols - 1], attr)
+        List.scr.clrtoeol()
 
     
     def show():
-        List.scr.clear()
-        for r in range(min(List.nrows, len(List.items))):
-            if r == List.index:
-                List.scr.addstr(r, 0, List.at(r), curses.A_REVERSE)
+        shown = min(List.nrows, len(List.matches) - List.base)
+        for r in range(List.nrows):
+            if r >= shown:
+                List.draw_row(r, '')
+            elif r == List.index:
+                List.draw_row(r, List.at(r), curses.A_REVERSE)
             else:
-                List.scr.addstr(r, 0, List.at(r))
+                List.draw_row(r, List.at(r))
+        if List.filter:
+            status = f'/{List.filter}  ({len(List.matches)} of {len(List.items)})'
+        else:
+            status = ''
+        if len(List.drawn) > List.nrows:
+            List.draw_row(List.nrows, status)
         List.scr.refresh()
 
 
@@ -0,0 +1,145 @@
+"""
+Batched environments for hero bots.
+
+A VecEnv plays N games of one dungeon in lockstep: VecEnv.step takes one action
+per game and advances all of them by a turn. The observations, rewards and
+done flags of the N games are returned as flat arrays, stacked game after game,
+and reused from one step to the next:
+- observations: a bytearray of N grids of (nrows * ncols) characters, the
+  characters of Dunmap.chat (see VecEnv.grid for one grid as strings)
+- rewards: an array of doubles, see REWARDS
+- dones: a bytearray of flags, 1 for the games which ended on this step
+
+A game which ends is reset at once, with the next seed, so that the
+observation returned for it is the first one of its next episode; how the
+episode ended is in the infos returned with it.
+
+The N games are headless Games without animations. They share the compiled
+initial state of the dungeon (see duncache), and each reset restores it with a
+few bulk copies. The observations are updated with one copy of each map's
+character buffer (see Dunmap.charbuf) per step.
+
+An action is the index of a command in ACTIONS, or a command as returned by
+Game.read_command.
+"""
+
+import array
+
+import policies
+
+from batch import WON, KILLED, UNFINISHED
+from game import Game
+
+
+ACTIONS = tuple(policies.DIRECTIONS) + tuple(
+    (attack, direction) for attack in policies.ATTACKS
+    for direction in policies.DIRECTIONS)
+
+# the reward of the step ending an episode in each way; the other steps are
+# rewarded 0
+REWARDS = {WON: 1.0, KILLED: -1.0, UNFINISHED: 0.0}
+
+
+class VecEnv:
+    """
+    Attributes:
+    - games: the N games
+    - nrows, ncols: the dimensions of the dungeon
+    - observations, rewards, dones: see the module docstring
+    - turns: (turns[i]) is the number of turns of the current episode of game
+      (i)
+    - seeds: (seeds[i]) is the seed of the current episode of game (i)
+    """
+
+    def __init__(self, filename, n, seed=0, max_turns=1000, fov_radius=None):
+        """Creates (n) games on the dungeon file (filename), which start their
+        first episodes right away. The episodes are seeded (seed), (seed + 1),
+        ... in the order they start. An episode still running after
+        (max_turns) turns ends as UNFINISHED."""
+        if n <= 0:
+            raise ValueError(f'invalid number of games: {n}')
+        self.max_turns = max_turns
+        self.seeds = array.array('q', range(seed, seed + n))
+        self._next_seed = seed + n
+        self.games = [Game(filename, headless=True, animate=False, seed=s,
+                           fov_radius=fov_radius)
+                      for s in self.seeds]
+        self.nrows = self.games[0].dunmap.nrows
+        self.ncols = self.games[0].dunmap.ncols
+        self.observations = bytearray(n * self.nrows * self.ncols)
+        self.rewards = array.array('d', [0.0]) * n
+        self.dones = bytearray(n)
+        self.turns = array.array('l', [0]) * n
+        for i in range(n):
+            self._observe(i)
+
+
+    def __len__(self):
+        return len(self.games)
+
+
+    def reset(self):
+        """Starts a new episode in every game. Returns the observations."""
+        for i in range(len(self.games)):
+            self._reset_game(i)
+            self._observe(i)
+            self.rewards[i] = 0.0
+            self.dones[i] = 0
+        return self.observations
+
+
+    def step(self, actions):
+        """Plays a turn of every game, game (i) playing (actions[i]). Returns
+        the tuple (<observations>, <rewards>, <dones>, <infos>), where
+        (infos[i]) is None, or, when game (i) ended on this step, a dict with
+        its 'outcome' (one of {WON, KILLED, UNFINISHED}), its number of
+        'turns' and its 'seed'."""
+
+        games = self.games
+        if len(actions) != len(games):
+            raise ValueError(f'{len(actions)} actions for {len(games)} games')
+        rewards, dones, turns = self.rewards, self.dones, self.turns
+        infos = [None] * len(games)
+        for i, (game, action) in enumerate(zip(games, actions)):
+            command = ACTIONS[action] if isinstance(action, int) else action
+            outcome = game.step(command)
+            turns[i] += 1
+            if outcome is Game.WON:
+                outcome = WON
+            elif outcome is Game.KILLED:
+                outcome = KILLED
+            elif turns[i] >= self.max_turns:
+                outcome = UNFINISHED
+            else:
+                rewards[i] = 0.0
+                dones[i] = 0
+                self._observe(i)
+                continue
+            rewards[i] = REWARDS[outcome]
+            dones[i] = 1
+            infos[i] = {'outcome': outcome, 'turns': turns[i],
+                        'seed': self.seeds[i]}
+            self._reset_game(i)
+            self._observe(i)
+        return self.observations, rewards, dones, infos
+
+
+    def grid(self, i):
+        """Returns the observation of game (i) as a list of strings, one per
+        row, as Dunmap.chars."""
+        size, ncols = self.nrows * self.ncols, self.ncols
+        obs = self.observations[i * size:(i + 1) * size]
+        return [obs[r * ncols:(r + 1) * ncols].decode()
+                for r in range(self.nrows)]
+
+
+    def _reset_game(self, i):
+        self.seeds[i] = self._next_seed
+        self._next_seed += 1
+        self.games[i].reset(self.seeds[i])
+        self.turns[i] = 0
+
+
+    def _observe(self, i):
+        size = self.nrows * self.ncols
+        self.observations[i * size:(i + 1) * size] = self.games[i].dunmap.charbuf
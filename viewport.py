@@ -0,0 +1,65 @@
+"""
+A camera over a Dunmap, for dungeons bigger than the terminal.
+
+The Viewport is the rectangle of the dunmap which is shown on the screen. It
+follows a position (the hero's): whenever the position gets closer than a
+margin to an edge of the rectangle, the rectangle is re-centered on it, within
+the bounds of the map. Re-centering rather than scrolling by one cell means that
+the whole window only has to be redrawn once in a while.
+"""
+
+
+class Viewport:
+    """
+    Attributes:
+    - nrows, ncols: the dimensions of the dunmap
+    - height, width: the dimensions of the rectangle, at most those of the map
+    - top, left: the dunmap position shown at the top left corner of the screen
+    """
+
+    def __init__(self, nrows, ncols, height, width):
+        self.nrows, self.ncols = nrows, ncols
+        self.height = max(1, min(nrows, height))
+        self.width = max(1, min(ncols, width))
+        self.top = self.left = 0
+
+
+    def _margins(self):
+        return self.height // 4, self.width // 4
+
+
+    def follow(self, pos):
+        """Moves the rectangle if (pos) is too close to its edges. Returns True if
+        the rectangle moved."""
+        row, col = pos
+        vmargin, hmargin = self._margins()
+        top, left = self.top, self.left
+        if not (top + vmargin <= row < top + self.height - vmargin):
+            top = _clamp(row - self.height // 2, 0, self.nrows - self.height)
+        if not (left + hmargin <= col < left + self.width - hmargin):
+            left = _clamp(col - self.width // 2, 0, self.ncols - self.width)
+        moved = (top, left) != (self.top, self.left)
+        self.top, self.left = top, left
+        return moved
+
+
+    def to_screen(self, r, c):
+        """Returns the screen coordinates of the dunmap position (r, c), or None
+        if it is not shown."""
+        r, c = r - self.top, c - self.left
+        if 0 <= r < self.height and 0 <= c < self.width:
+            return r, c
+        return None
+
+
+    def rows(self, dunmap):
+        """Returns an iterator of the strings shown on the screen, from top to
+        bottom."""
+        ncols, charbuf = dunmap.ncols, dunmap.charbuf
+        for r in range(self.top, self.top + self.height):
+            start = r * ncols + self.left
+            yield charbuf[start:start + self.width].decode()
+
+
+def _clamp(value, low, high):
+    return max(low, min(high, value))
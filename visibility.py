@@ -0,0 +1,213 @@
+"""
+Line of sight over a Dunmap.
+
+A position blocks sight in a direction when it is not walkable (an obstacle,
+an actor or a treasure chest). Visibility keeps, for every row and every column
+of a Dunmap, the sorted list of blocking positions, so that the nearest blocker
+in a cardinal direction is found with a binary search. The lists are kept up to
+date incrementally: a Visibility registers itself as a listener of its Dunmap
+(see Dunmap.listeners) and is told about every change of kind.
+
+A full field of view (see Visibility.fov) is also available. It is computed with
+recursive shadowcasting over the static blockers only (obstacles and treasure
+chests; actors do not hide what is behind them) and is cached per origin until
+a static blocker changes, which empties the cache. The cache keeps the
+FOV_CACHE_SIZE fields of view used last.
+"""
+
+import bisect
+import itertools
+import collections
+
+
+# the number of fields of view cached
+FOV_CACHE_SIZE = 16384
+
+
+# The multipliers transforming the coordinates of the first octant into the
+# coordinates of each of the eight octants: (xx, xy, yx, yy).
+_OCTANTS = ((1, 0, 0, 1), (0, 1, 1, 0), (0, -1, 1, 0), (-1, 0, 0, 1),
+            (-1, 0, 0, -1), (0, -1, -1, 0), (0, 1, -1, 0), (1, 0, 0, -1))
+
+
+class Visibility:
+    """
+    Attributes:
+    - dunmap
+    - row_blockers: (row_blockers[r]) is the sorted list of the columns of the
+      blocking positions in row (r), or None if row (r) was never queried
+    - col_blockers: (col_blockers[c]) is the sorted list of the rows of the
+      blocking positions in column (c), or None if column (c) was never
+      queried
+    - static_version: incremented every time a static blocker appears or
+      disappears, which drops the cached fields of view
+
+    Lines are only indexed when they are first needed (see Visibility.row and
+    Visibility.col), so that creating a Visibility costs nothing.
+    """
+
+    def __init__(self, dunmap):
+        self.dunmap = dunmap
+        self.row_blockers = [None] * dunmap.nrows
+        self.col_blockers = [None] * dunmap.ncols
+        self.static_version = 0
+        self._static_kinds = (dunmap.KIND_OBSTACLE, dunmap.KIND_CHEST)
+        self._fov_cache = collections.OrderedDict()
+        dunmap.listeners.append(self)
+
+
+    def cell_changed(self, pos, old_kind, new_kind):
+        """Called by the Dunmap whenever the kind at (pos) changes."""
+        walkable = self.dunmap.KIND_WALKABLE
+        row, col = pos
+        row_line, col_line = self.row_blockers[row], self.col_blockers[col]
+        if old_kind == walkable:
+            if row_line is not None:
+                bisect.insort(row_line, col)
+            if col_line is not None:
+                bisect.insort(col_line, row)
+        elif new_kind == walkable:
+            if row_line is not None:
+                _remove(row_line, col)
+            if col_line is not None:
+                _remove(col_line, row)
+        if old_kind in self._static_kinds or new_kind in self._static_kinds:
+            self.static_version += 1
+            self._fov_cache.clear()
+
+
+    def row(self, r):
+        """Returns (self.row_blockers[r]), indexing the row if needed."""
+        line = self.row_blockers[r]
+        if line is None:
+            ncols = self.dunmap.ncols
+            kinds = self.dunmap.kinds[r * ncols:(r + 1) * ncols]
+            line = self.row_blockers[r] = list(
+                itertools.compress(range(ncols), kinds))
+        return line
+
+
+    def col(self, c):
+        """Returns (self.col_blockers[c]), indexing the column if needed."""
+        line = self.col_blockers[c]
+        if line is None:
+            kinds = self.dunmap.kinds[c::self.dunmap.ncols]
+            line = self.col_blockers[c] = list(
+                itertools.compress(range(self.dunmap.nrows), kinds))
+        return line
+
+    ########################################
+    # cardinal line of sight
+
+    def nearest(self, pos, direction):
+        """Starting next to (pos) and going in (direction), returns the first
+        blocking position, or None if there is none."""
+        row, col = pos
+        if direction == 'right':
+            line = self.row(row)
+            i = bisect.bisect_right(line, col)
+            return (row, line[i]) if i < len(line) else None
+        elif direction == 'left':
+            line = self.row(row)
+            i = bisect.bisect_left(line, col)
+            return (row, line[i - 1]) if i > 0 else None
+        elif direction == 'down':
+            line = self.col(col)
+            i = bisect.bisect_right(line, row)
+            return (line[i], col) if i < len(line) else None
+        elif direction == 'up':
+            line = self.col(col)
+            i = bisect.bisect_left(line, row)
+            return (line[i - 1], col) if i > 0 else None
+        raise ValueError(f'Invalid direction: {direction}')
+
+
+    def sees(self, pos, target):
+        """Returns True if (target) is on the same row or column as (pos) and
+        nothing blocks the view between them."""
+        if pos[0] == target[0]:
+            direction = 'left' if target[1] < pos[1] else 'right'
+        elif pos[1] == target[1]:
+            direction = 'up' if target[0] < pos[0] else 'down'
+        else:
+            return False
+        return self.nearest(pos, direction) == tuple(target)
+
+    ########################################
+    # field of view
+
+    def fov(self, origin, radius):
+        """Returns a frozenset of the positions visible from (origin) within
+        (radius) (euclidean distance). (origin) itself is included."""
+        origin = tuple(origin)
+        key = (origin, radius)
+        cache = self._fov_cache
+        visible = cache.get(key)
+        if visible is not None:
+            cache.move_to_end(key)
+            return visible
+        visible = cache[key] = frozenset(self._shadowcast(origin, radius))
+        if len(cache) > FOV_CACHE_SIZE:
+            cache.popitem(last=False)
+        return visible
+
+
+    def _is_opaque(self, row, col):
+        dunmap = self.dunmap
+        return dunmap.kinds[row * dunmap.ncols + col] in self._static_kinds
+
+
+    def _shadowcast(self, origin, radius):
+        visible = {origin}
+        for octant in _OCTANTS:
+            self._cast_octant(visible, origin, radius, *octant)
+        return visible
+
+
+    def _cast_octant(self, visible, origin, radius, xx, xy, yx, yy):
+        """Shadowcasting over one octant. The recursion of the classic algorithm
+        is replaced by an explicit stack of (<first row>, <start slope>, <end
+        slope>) triples, so that big radii cannot exhaust the Python stack."""
+
+        orow, ocol = origin
+        nrows, ncols = self.dunmap.nrows, self.dunmap.ncols
+        radius_sq = radius * radius
+        stack = [(1, 1.0, 0.0)]
+        while stack:
+            first, start, end = stack.pop()
+            if start < end:
+                continue
+            new_start = start
+            for j in range(first, radius + 1):
+                dx, dy = -j - 1, -j
+                blocked = False
+                while dx <= 0:
+                    dx += 1
+                    col = ocol + dx * xx + dy * xy
+                    row = orow + dx * yx + dy * yy
+                    l_slope = (dx - 0.5) / (dy + 0.5)
+                    r_slope = (dx + 0.5) / (dy - 0.5)
+                    if start < r_slope:
+                        continue
+                    elif end > l_slope:
+                        break
+                    inside = 0 <= row < nrows and 0 <= col < ncols
+                    if inside and dx * dx + dy * dy <= radius_sq:
+                        visible.add((row, col))
+                    opaque = not inside or self._is_opaque(row, col)
+                    if blocked:
+                        if opaque:
+                            new_start = r_slope
+                        else:
+                            blocked = False
+                            start = new_start
+                    elif opaque and j < radius:
+                        blocked = True
+                        stack.append((j + 1, start, l_slope))
+                        new_start = r_slope
+                if blocked:
+                    break
+
+
+def _remove(line, value):
+    del line[bisect.bisect_left(line, value)]